@@ -56,16 +56,45 @@
 
 
 # Imports
+import atexit
+import collections
+import concurrent.futures
 import configparser
+import ctypes
+import ctypes.util
 import datetime
+import errno
+import gzip
+import hashlib
+import http.server
+import itertools
+import json
+import logging
+import logging.handlers
 import os
+import platform
+import queue
 import re
 import shutil
+import signal
+import socket
+import socketserver
+import sqlite3
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 import traceback
 
+# fcntl is only available on Unix-like systems, and is only used for reflink
+# copies, so we can do without it.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 
 #
 # Default Variables/Settings
@@ -73,14 +102,55 @@ import traceback
 # NOTE: These are the base settings that get overridden by command-line arguments.
 #
 
+# Show the progress dashboard - a line for each transcode in progress, plus
+# the queue and the most recent finished jobs. It's left out anyway when the
+# output isn't going to a terminal, e.g. when running as a service.
+show_dashboard = True
+
+# How often (in seconds) to redraw the progress dashboard.
+dashboard_refresh = 1.0
+
 # Debug mode - writes script's activities (but not ffmpeg output) to log files.
-# CAUTION: logs can get big.
 debug_mode = False
 
-# Write ffmpeg output to log files.
-# CAUTION: logs can get big.
+# Debug log rotation - once the log grows past this many megabytes, or gets
+# this many hours old, it's compressed and a new one is started. 0 turns off
+# that limit.
+log_size = 10
+log_age = 24
+
+# Number of old (compressed) debug logs to keep.
+log_keep = 5
+
+# Write ffmpeg output to log files - one per transcode.
 save_ffmpeg_output = False
 
+# Only write ffmpeg's diagnostic lines (stream info, warnings and errors) to
+# its logs, leaving out the build banner and any periodic statistics lines, so
+# a log doesn't grow with the length of the encode.
+ffmpeg_log_diag = False
+
+# Directory for ffmpeg logs. If this is empty, they go in an "ffmpeg_logs"
+# directory in the same directory as the script.
+ffmpeg_log_dir = ''
+
+# Number of ffmpeg logs to keep - the oldest are deleted as new ones are
+# started. 0 keeps them all.
+ffmpeg_log_keep = 50
+
+# Output cache directory - if set, every transcode is kept here, and a source
+# identical to one that's already been transcoded with the same settings is
+# copied from the cache instead of being transcoded again.
+cache_dir = ''
+
+# Output cache size limit, in gigabytes. The least recently used transcodes
+# are thrown out when the cache grows past this. 0 means no limit.
+cache_size = 50
+
+# Fingerprint sources by hashing their entire contents, instead of their size
+# plus a sample of blocks. Slower, but catches every change.
+cache_full_hash = False
+
 # Full path to ffmpeg (unless it's in the system's PATH - if it cannot be reached
 # via just "ffmpeg," the full path will be needed here.
 ffmpeg_location = 'ffmpeg'
@@ -91,6 +161,34 @@ source_dir = ''
 # File extensions to flag
 file_exts = ["avi", "m4v", "mkv", "mov", "mp4", "webm", "wmv"]
 
+# How to watch the source directory for new files - "inotify" (Linux only)
+# reports files as soon as they're written, "poll" lists the directory every
+# few seconds, and "auto" uses inotify where it's available and polls
+# everywhere else.
+watch_backend = 'auto'
+
+# How long (in seconds) a file's size, modification time and inode must stay
+# unchanged before it's considered finished. Some writers (OBS, rsync, SMB
+# copies) don't keep the file open for the whole transfer, so this catches
+# what the open-file check can't.
+quiet_period = 0
+
+# Check whether another process has the file open before transcoding it. This
+# can be turned off on network shares, where remote writers can't be seen
+# anyway, and the quiet period used instead.
+handle_check = True
+
+# Watch subdirectories of the source directory too. Transcodes (and stored
+# sources) go into matching subdirectories of the destination (and storage)
+# directories.
+recursive = False
+
+# Claim each file before transcoding it, with a claim file in a hidden
+# directory in the source directory, so several instances on different
+# machines can watch the same shared source directory without transcoding
+# the same file twice.
+claim_files = False
+
 # Target directory for transcodes
 dest_dir = ''
 
@@ -103,11 +201,470 @@ storage_dir = ''
 # "mkv" for Matroska, etc.
 new_ext = ''
 
-# FFMPEG argument list storage
+# FFMPEG argument list storage, for a custom command line from the config file
 cmdline = []
 
-# Transcode description, filled in when a transcode mode is selected.
-trans_mode = ''
+# Names of the transcode presets selected in the command line
+selected_presets = []
+
+# More watch folders, from the config file's [watch:NAME] sections - one dict
+# of settings per section. Anything a section leaves out comes from the
+# command line and the rest of the config file.
+watch_configs = []
+
+# Number of transcodes (ffmpeg processes) to run at the same time. Each one
+# gets its own worker pulling files from a shared queue.
+worker_count = 1
+
+# Port to listen for remote workers on, optionally with an address, e.g.
+# "0.0.0.0:9470". Remote workers lease jobs from the queue alongside the local
+# ones. Blank means no remote workers.
+coordinator_listen = ''
+
+# Coordinator to take jobs from, as "host:port". This makes the script a
+# remote worker - it doesn't watch for files itself, it just transcodes what
+# the coordinator hands it. Blank means a normal instance.
+worker_address = ''
+
+# Seconds a remote worker can go without checking in before the coordinator
+# takes its job back and requeues it. It's also how long a claim file can go
+# without being renewed before another instance takes the file over.
+lease_time = 60
+
+# Segmented transcoding - sources longer than twice this many seconds are
+# split into segments at keyframes, which are transcoded several at a time and
+# then joined. 0 turns this off.
+segment_length = 0
+
+# Number of segments of one file to transcode at the same time.
+segment_jobs = 4
+
+# Number of times to retry a failed segment before giving up on the file.
+segment_retries = 2
+
+# Copy the video and/or audio stream straight into the new file, instead of
+# transcoding it, if the source's stream already matches what the preset would
+# make. (See each preset's "passthrough" rules.) This needs ffprobe.
+passthrough = True
+
+# Number of files to inspect with ffprobe at the same time. Results are kept
+# in the job store, so a file is only probed once unless it changes.
+probe_jobs = 4
+
+# Number of times to retry a transcode that failed for what looks like a
+# passing reason - a full disk, ffmpeg being killed, a network hiccup. The
+# first retry waits retry_delay seconds, and each one after that waits twice
+# as long as the last. Failures that look permanent (usually bad source data)
+# aren't retried.
+job_retries = 3
+retry_delay = 30
+
+# Directory to move sources that couldn't be transcoded to, along with a note
+# of what went wrong. If this is empty, they're left where they are, and
+# skipped until they change.
+quarantine_dir = ''
+
+# Check each transcode before the source is moved or renamed - the output is
+# probed with ffprobe, and its container, streams and duration compared with
+# the source's.
+verify_outputs = True
+
+# How far (in seconds) an output's duration may be from the source's.
+verify_tolerance = 1.0
+
+# Also decode this many seconds at the start and end of each output, to make
+# sure they're readable. 0 turns this off.
+verify_decode = 0
+
+# Number of transcodes to check at the same time. Checks run alongside the
+# transcodes, so workers don't wait on them.
+verify_jobs = 2
+
+# Order to transcode queued files in - "fifo" takes them in the order they
+# showed up, "smallest" takes the smallest files first, and "shortest" takes
+# the shortest (by probed duration, or if it couldn't be probed, the median of
+# recent files') first. Either way, a file with a priority tag in its name,
+# "[p0]" (first) through "[p9]" (last), goes ahead of or behind untagged
+# files, which count as "[p5]".
+queue_order = 'fifo'
+
+# Aging for the "smallest" and "shortest" orders, so big files don't wait
+# forever behind a steady stream of small ones - every second a file spends in
+# the queue counts as this many seconds shorter (or megabytes smaller). 0
+# turns aging off.
+queue_aging = 1.0
+
+# Job store database, which records every queued file and how far it got so
+# the script can pick up where it left off after a crash or restart. If this
+# is empty, it's kept in the same directory as the script.
+job_db = ''
+
+# Show the contents of the job store and exit, instead of monitoring.
+show_queue = False
+
+# Telemetry log, which gets one line of JSON per job with its sizes, timings
+# and outcome. If this is empty, it's kept in the same directory as the
+# script.
+telemetry_file = ''
+
+# Summarize the telemetry log and exit, instead of monitoring.
+show_report = False
+
+# How many hours back the summary covers. 0 means everything.
+report_window = 24
+
+# Benchmark the presets against synthetic test clips and exit, instead of
+# monitoring.
+run_benchmark = False
+
+# Benchmark baseline, which results are compared against. If this is empty,
+# it's kept in the same directory as the script.
+benchmark_baseline = ''
+
+# Replace the baseline with this benchmark run's results.
+save_baseline = False
+
+# How much worse (in percent) a benchmark result can be than the baseline
+# before it's flagged as a regression.
+benchmark_tolerance = 10
+
+# Number of dummy files for the control-plane scale benchmark, which runs the
+# script against stub ffmpeg/ffprobe programs and exits. 0 means don't run it.
+scalebench_files = 0
+
+# Seconds each stub transcode takes in the scale benchmark.
+stub_time = 0.1
+
+# Address and port to serve Prometheus metrics on, at /metrics, e.g. "9464"
+# for every address or "127.0.0.1:9464" for just one. Empty means no metrics
+# server.
+metrics_listen = ''
+
+# File to write Prometheus metrics to every few seconds, for node_exporter's
+# textfile collector. Empty means no metrics file.
+metrics_file = ''
+
+# Seconds between metrics file updates.
+metrics_interval = 15
+
+
+#
+# Stream Passthrough
+#
+# When a stream is copied instead of transcoded, these preset settings don't
+# apply to it (and would upset ffmpeg), so they're dropped from the command
+# line in favor of "-c:v copy" or "-c:a copy".
+#
+video_options = ["-c:v", "-b:v", "-profile:v", "-level:v", "-qscale:v", "-crf",
+                 "-pix_fmt", "-bf", "-g", "-r", "-s", "-vf"]
+audio_options = ["-c:a", "-b:a", "-af"]
+
+
+#
+# Benchmark Clips
+#
+# NOTE: "-benchmark" transcodes these with each preset. They're made with
+# ffmpeg's built-in test pattern (testsrc2) and tone (sine) generators, so
+# every run on every machine transcodes exactly the same thing.
+#
+benchmark_clips = [
+    {"name": "720p60", "size": "1280x720", "rate": 60, "duration": 10},
+    {"name": "1080p60", "size": "1920x1080", "rate": 60, "duration": 10},
+    {"name": "2160p30", "size": "3840x2160", "rate": 30, "duration": 5},
+]
+
+
+#
+# Transcode Presets
+#
+# NOTE: Each preset is selected by a command-line argument of the same name,
+# e.g., "-davinci". Selecting several presets produces all of their outputs
+# from a single ffmpeg run, so the source only gets decoded once.
+#
+presets = {
+
+    # Davinci Resolve (Linux) import transcode
+    # These settings build import files for Davinci Resolve 16.2 on Linux,
+    # and will transcode things like Twitch streams into a format that
+    # Resolve will work with without requiring further alteration.
+    "davinci": {
+        "cmdline": [
+                       #"%FFMPEG%", # Required for obvious reasons and must be #1
+                       "-y", # Assume "yes" to prompts, e.g., overwrite warning
+                       "-progress -", # Output progress info (and yes that hyphen is REQUIRED)
+                       "-nostats", # Don't output a bunch of statistical info on the file
+                       "-hwaccel auto", # Hardware acceleration enabled, auto-detect
+                       "-i %SOURCEFILE%", # Name of file to transcode
+                       "-c:v mpeg4", # Transcode video to MPEG4
+                       "-qscale:v 1", # Set video quality to max
+                       "-c:a pcm_s16le", # Transcode audio to 16-bit PCM (LE byte order)
+                       "-b:v 36m", # Set bitrate to 36mbps
+                       "-r 60", # Force framerate of output to 60FPS (add/drop frames)
+                       "-f %NEWEXT%", # Transcode into container based on the "ext" setting
+                       "%DESTFILE%" # Name and path for trandcode output (should be last)
+                   ],
+        "ext": "mov",
+        "description": "Davinci Resolve 16+ Import - MPEG4 video, 16-bit PCM audio, MOV container",
+        "passthrough": {
+            "audio": {"codec_name": ["pcm_s16le"]},
+        },
+    },
+
+    # Youtube upload H.264 transcode
+    # These settings are for transcoding edited videos into a format
+    # that uploads quickly to Youtube. It follows the recommended
+    # encoding spec guidelines for Youtube as of 15 Dec 2020.
+    "youtube": {
+        "cmdline": [
+                       #"%FFMPEG%", # Required for obvious reasons and must be #1
+                       "-y", # Assume "yes" to prompts, e.g., overwrite warning
+                       "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
+                       "-nostats", # Don't output a bunch of statistical info on the file
+                       "-hwaccel auto", # Hardware acceleration enabled, auto-detect
+                       "-i %SOURCEFILE%", # Name of file to transcode
+                       #"-s 1920x1080", # Set output size to 1920x1080
+                       "-pix_fmt yuv420p", # Set pixel format to 4:2:0 YUV
+                       "-c:v libx264", # Transcode video to H.264
+                       "-b:v 75m", # Set video bitrate to 75mbps, which is for 4K HDR - the rate will be much smaller for lower resolution videos
+                       "-profile:v high", # High profile
+                       "-bf 2", # Set B-frame generation to two consecutive
+                       "-c:a aac", # Transcode audio to AAC
+                       "-g 30", # Force GOP to 1/2 framerate
+                       "-crf 18", # Set CRF to something middle-of-the-road
+                       "-use_editlist 0", # No edit lists
+                       "-movflags +faststart", # Relocate MOOV atom to beginning of file
+                       "-r 60", # Force framerate of output to 60FPS (add/drop frames)
+                       "-f %NEWEXT%", # Transcode into container based on the "ext" setting
+                       "%DESTFILE%" # Name and path for trandcode output (should be last)
+                   ],
+        "ext": "mp4",
+        "description": "Youtube upload - H.264 video, AAC audio, MP4 container",
+        "passthrough": {
+            "video": {"codec_name": ["h264"], "profile": ["High"],
+                      "pix_fmt": ["yuv420p"], "frame_rate": [60]},
+            "audio": {"codec_name": ["aac"]},
+        },
+    },
+
+    # Avid DNxHR-HQ transcode
+    # These settings are for transcoding edited videos into a popular
+    # working format for professional video editing. The files can be
+    # huge, but the resulting quality is about as good as it gets.
+    "dnxhr": {
+        "cmdline": [
+                       #"%FFMPEG%", # Required for obvious reasons and must be #1
+                       "-y", # Assume "yes" to prompts, e.g., overwrite warning
+                       "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
+                       "-nostats", # Don't output a bunch of statistical info on the file
+                       "-hwaccel auto", # Hardware acceleration enabled, auto-detect
+                       "-i %SOURCEFILE%", # Name of file to transcode
+                       "-c:v dnxhd", # Transcode video to DNxHD
+                       "-profile:v dnxhr_hq", # HQ profile
+                       "-c:a pcm_s16le", # Transcode audio to 16-bit PCM (LE byte order)
+                       "-pix_fmt yuv422p", # Set pixel format to 4:2:2 YUV
+                       "-f %NEWEXT%", # Transcode into container based on the "ext" setting
+                       "%DESTFILE%" # Name and path for trandcode output (should be last)
+                   ],
+        "ext": "mov",
+        "description": "DNxHR HQ video, 16-bit PCM audio, MOV container",
+        "passthrough": {
+            "video": {"codec_name": ["dnxhd"], "profile": ["DNXHR HQ"],
+                      "pix_fmt": ["yuv422p"]},
+            "audio": {"codec_name": ["pcm_s16le"]},
+        },
+    },
+
+    # Apple ProRes 4444 transcode
+    # These settings are for transcoding edited videos into a popular
+    # working format for professional video editing. The files can be
+    # huge, but the resulting quality is about as good as it gets.
+    "prores": {
+        "cmdline": [
+                       #"%FFMPEG%", # Required for obvious reasons and must be #1
+                       "-y", # Assume "yes" to prompts, e.g., overwrite warning
+                       "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
+                       "-nostats", # Don't output a bunch of statistical info on the file
+                       "-hwaccel auto", # Hardware acceleration enabled, auto-detect
+                       "-i %SOURCEFILE%", # Name of file to transcode
+                       "-pix_fmt yuv422p10le", # Set pixel format to 4:2:2 YUV, 10 bits per pixel
+                       "-c:v prores_ks", # Set codec to ProRes
+                       "-profile:v 4", # 4444 profile
+                       "-c:a pcm_s24le", # Transcode audio to 24-bit PCM (LE byte order)
+                       "-f %NEWEXT%", # Transcode into container based on the "ext" setting
+                       "%DESTFILE%" # Name and path for trandcode output (should be last)
+                   ],
+        "ext": "mov",
+        "description": "ProRes 4444 video, 24-bit PCM audio, MOV container",
+        "passthrough": {
+            "video": {"codec_name": ["prores"], "profile": ["4444"],
+                      "pix_fmt": ["yuv422p10le"]},
+            "audio": {"codec_name": ["pcm_s24le"]},
+        },
+    },
+
+    # Plex "nearly universal" HD (1080p) H.264 transcode
+    # These settings are for transcoding edited videos into a format
+    # that plays without additional transcoding on a wide variet of Plex
+    # clients. This minimizes the demand on the server for client
+    # transcodes. NOTE: Non-HD video is scaled, and non-16:9 aspect
+    # ratio video is either letterboxed or pillarboxed as required.
+    "plexhd": {
+        "cmdline": [
+                       #"%FFMPEG%", # Required for obvious reasons and must be #1
+                       "-y", # Assume "yes" to prompts, e.g., overwrite warning
+                       "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
+                       "-nostats", # Don't output a bunch of statistical info on the file
+                       "-hwaccel auto", # Hardware acceleration enabled, auto-detect
+                       "-i %SOURCEFILE%", # Name of file to transcode
+                       "-vf scale=\"'if(gt(a,16/9),1920,-1)':'if(gt(a,16/9),-1,1080)', pad=1920:1080:(1920-iw*min(1920/iw\,1080/ih))/2:(1080-ih*min(1920/iw\,1080/ih))/2\"", # Scale to 1920 wide and/or 1080 high regardless of aspect ratio, and pad extra space for non-16:9 ratios (letterbox or pillarbox)
+                       "-af \"aresample=async=1:min_hard_comp=0.100000:first_pts=0\"", # Audio resample to prevent desync
+                       "-pix_fmt yuv420p", # Set pixel format to 4:2:0 YUV
+                       "-c:v libx264", # Transcode video to H.264
+                       "-level:v 4.0", # Set H.264 level to 4.0, which supports 1080p30 @ up to 20mbps
+                       "-profile:v high", # High profile
+                       "-b:v 8m", # Set video bitrate to 8mbps
+                       "-c:a aac", # Transcode audio to AAC
+                       "-b:a 320k", # Set audio bitrate to 320kbps
+                       "-movflags +faststart", # Relocate MOOV atom to beginning of file
+                       "-r 30", # Force framerate of output to 30FPS (add/drop frames)
+                       "-crf 18", # Set CRF to something middle-of-the-road
+                       "-f %NEWEXT%", # Transcode into container based on the "ext" setting
+                       "%DESTFILE%" # Name and path for trandcode output (should be last)
+                   ],
+        "ext": "mp4",
+        "description": "Plex HD - H.264 video, AAC audio, MP4 container",
+        "passthrough": {
+            "video": {"codec_name": ["h264"], "profile": ["High"],
+                      "pix_fmt": ["yuv420p"], "width": [1920], "height": [1080],
+                      "level": lambda level: level <= 40, "frame_rate": [30],
+                      "bit_rate": lambda bit_rate: bit_rate <= 8000000},
+            "audio": {"codec_name": ["aac"],
+                      "bit_rate": lambda bit_rate: bit_rate <= 320000},
+        },
+    },
+
+    # Plex "nearly universal" SD (720p) H.264 transcode
+    # These settings are for transcoding edited videos into a format
+    # that plays without additional transcoding on a wide variet of Plex
+    # clients. This minimizes the demand on the server for client
+    # transcodes. NOTE: Non-SD video is scaled, and non-16:9 aspect
+    # ratio video is either letterboxed or pillarboxed as required.
+    "plexsd": {
+        "cmdline": [
+                       #"%FFMPEG%", # Required for obvious reasons and must be #1
+                       "-y", # Assume "yes" to prompts, e.g., overwrite warning
+                       "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
+                       "-nostats", # Don't output a bunch of statistical info on the file
+                       "-hwaccel auto", # Hardware acceleration enabled, auto-detect
+                       "-i %SOURCEFILE%", # Name of file to transcode
+                       "-vf scale=\"'if(gt(a,16/9),1280,-1)':'if(gt(a,16/9),-1,720)', pad=1280:720:(1280-iw*min(1280/iw\,720/ih))/2:(720-ih*min(1280/iw\,720/ih))/2\"", # Scale to 1280 wide and/or 720 high regardless of aspect ratio, and pad extra space for non-16:9 ratios (letterbox or pillarbox)
+                       "-af \"aresample=async=1:min_hard_comp=0.100000:first_pts=0\"", # Audio resample to prevent desync
+                       "-pix_fmt yuv420p", # Set pixel format to 4:2:0 YUV
+                       "-c:v libx264", # Transcode video to H.264
+                       "-level:v 4.0", # Set H.264 level to 4.0, which supports 1080p30 @ up to 20mbps
+                       "-profile:v baseline", # Baseline profile
+                       "-b:v 4m", # Set video bitrate to 4mbps
+                       "-c:a aac", # Transcode audio to AAC
+                       "-b:a 320k", # Set audio bitrate to 320kbps
+                       "-movflags +faststart", # Relocate MOOV atom to beginning of file
+                       "-r 30", # Force framerate of source to 30FPS (add/drop frames)
+                       "-crf 18", # Set CRF to something middle-of-the-road
+                       "-f %NEWEXT%", # Transcode into container based on the "ext" setting
+                       "%DESTFILE%" # Name and path for trandcode output (should be last)
+                   ],
+        "ext": "mp4",
+        "description": "Plex SD - H.264 video, AAC audio, MP4 container",
+        "passthrough": {
+            "video": {"codec_name": ["h264"], "profile": ["Baseline", "Constrained Baseline"],
+                      "pix_fmt": ["yuv420p"], "width": [1280], "height": [720],
+                      "level": lambda level: level <= 40, "frame_rate": [30],
+                      "bit_rate": lambda bit_rate: bit_rate <= 4000000},
+            "audio": {"codec_name": ["aac"],
+                      "bit_rate": lambda bit_rate: bit_rate <= 320000},
+        },
+    },
+
+    # WebM (VP9) Constant-Quality single-pass transcode
+    "webm": {
+        "cmdline": [
+                       #"%FFMPEG%", # Required for obvious reasons and must be #1
+                       "-y", # Assume "yes" to prompts, e.g., overwrite warning
+                       "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
+                       "-nostats", # Don't output a bunch of statistical info on the file
+                       "-hwaccel auto", # Hardware acceleration enabled, auto-detect
+                       "-i %SOURCEFILE%", # Name of file to transcode
+                       "-c:v libvpx-vp9", # Transcode to VP9
+                       "-crf 30", # Set CRF to something middle-of-the-road
+                       "-b:v 0", # Force CONSTANT-QUALITY mde
+                       "-f %NEWEXT%", # Transcode into container based on the "ext" setting
+                       "%DESTFILE%" # Name and path for trandcode output (should be last)
+                   ],
+        "ext": "webm",
+        "description": "WebM (VP9) Constant-Quality Single-Pass",
+        "passthrough": {
+            "video": {"codec_name": ["vp9"]},
+            "audio": {"codec_name": ["opus", "vorbis"]},
+        },
+    },
+
+#    # Add your own transcode presets!
+#    # Edit the following to add the components of a command line call
+#    # for ffmpeg. As is the case for calling ffmpeg directly, order
+#    # does matter. Enable ffmpeg logging by setting the "save_ffmpeg_output"
+#    # variable to True if your transcode fails - that way, you can inspect
+#    # ffmpeg's output to see what's making it upset. The preset's name is
+#    # also its command line argument, e.g., "-newtranscode".
+#
+#    # Please note the following tokens are allowed:
+#    #   %FFMPEG% : Full path to ffmpeg (defaults to "ffmpeg" but requires ffmpeg to
+#    #              be in a directory on the system's PATH)
+#    #   %SPATH% : Source directory provided by caller (not generally needed here)
+#    #   %DPATH% : Destination directory provided by caller (not generally needed here)
+#    #   %SOURCEFILE% : target file (filename, with full path)
+#    #   %DESTFILE% : destination file (filename, with full path, but with NEW extension)
+#    #   %NEWEXT% : New file extension, taken from the "ext" setting
+#    #
+#    # NOTE: If several presets are selected at once, they share one ffmpeg run.
+#    # Everything up to and including "-i %SOURCEFILE%" is taken from the first
+#    # preset, so keep the input settings the same as the other presets.
+#    "newtranscode": {
+#        "cmdline": [
+#                       #"%FFMPEG%", # Required for obvious reasons and must be #1
+#                       "-y", # Assume "yes" to prompts, e.g., overwrite warning
+#                       "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
+#                       "-nostats", # Don't output a bunch of statistical info on the file
+#                       "-hwaccel auto", # Hardware acceleration enabled, auto-detect
+#                       #
+#                       # Add your specific INPUT flags and settings here. See the other
+#                       # transcode entries for examples.
+#                       #
+#                       "-i %SOURCEFILE%", # Name of file to transcode
+#                       #
+#                       # Add your specific OUTPUT flags and settings here. See the other
+#                       # transcode entries for examples.
+#                       #
+#                       "-f %NEWEXT%", # Transcode into container based on the "ext" setting
+#                       "%DESTFILE%" # Name and path for trandcode output (should be last)
+#                   ],
+#
+#        # Set the extension to MOV.
+#        "ext": "mov",
+#
+#        # Briefly describe the transcode's results here, for later display.
+#        "description": "Briefly describe the transcode's results here.",
+#
+#        # Optional - if the source's video and/or audio stream already matches
+#        # these rules, it's copied into the new file as-is instead of being
+#        # transcoded. Each rule is a stream property as ffprobe reports it
+#        # (plus "frame_rate") and either a list of acceptable values or a
+#        # function that returns True if the value is acceptable. Leave a
+#        # stream out to always transcode it.
+#        "passthrough": {
+#            "video": {"codec_name": ["h264"], "pix_fmt": ["yuv420p"]},
+#            "audio": {"codec_name": ["aac"]},
+#        },
+#    },
+}
 
 
 # Get our script's directory.
@@ -142,260 +699,17 @@ if len(sys.argv) > 1:
         argument = sys.argv[index]
 
 
-        # Davinci Resolve (Linux) import transcode
-        if argument.lower() == "-davinci":
-            # These settings build import files for Davinci Resolve 16.2 on Linux,
-            # and will transcode things like Twitch streams into a format that
-            # Resolve will work with without requiring further alteration.
-            cmdline = [
-                          #"%FFMPEG%", # Required for obvious reasons and must be #1
-                          "-y", # Assume "yes" to prompts, e.g., overwrite warning
-                          "-progress -", # Output progress info (and yes that hyphen is REQUIRED)
-                          "-nostats", # Don't output a bunch of statistical info on the file
-                          "-hwaccel auto", # Hardware acceleration enabled, auto-detect
-                          "-i %SOURCEFILE%", # Name of file to transcode
-                          "-c:v mpeg4", # Transcode video to MPEG4
-                          "-qscale:v 1", # Set video quality to max
-                          "-c:a pcm_s16le", # Transcode audio to 16-bit PCM (LE byte order)
-                          "-b:v 36m", # Set bitrate to 36mbps
-                          "-r 60", # Force framerate of output to 60FPS (add/drop frames)
-                          "-f %NEWEXT%", # Transcode into container based on "new_ext" variable
-                          "%DESTFILE%" # Name and path for trandcode output (should be last)
-                       ]
-
-            # Set the extension to MOV.
-            new_ext = "mov"
-
-            # Set the description for later display.
-            trans_mode = "Davinci Resolve 16+ Import - MPEG4 video, 16-bit PCM audio, MOV container"
-
-
-        # Youtube upload H.264 transcode
-        elif argument.lower() == "-youtube":
-            # These settings are for transcoding edited videos into a format
-            # that uploads quickly to Youtube. It follows the recommended
-            # encoding spec guidelines for Youtube as of 15 Dec 2020.
-            cmdline = [
-                          #"%FFMPEG%", # Required for obvious reasons and must be #1
-                          "-y", # Assume "yes" to prompts, e.g., overwrite warning
-                          "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
-                          "-nostats", # Don't output a bunch of statistical info on the file
-                          "-hwaccel auto", # Hardware acceleration enabled, auto-detect
-                          "-i %SOURCEFILE%", # Name of file to transcode
-                          #"-s 1920x1080", # Set output size to 1920x1080
-                          "-pix_fmt yuv420p", # Set pixel format to 4:2:0 YUV
-                          "-c:v libx264", # Transcode video to H.264
-                          "-b:v 75m", # Set video bitrate to 75mbps, which is for 4K HDR - the rate will be much smaller for lower resolution videos
-                          "-profile:v high", # High profile
-                          "-bf 2", # Set B-frame generation to two consecutive
-                          "-c:a aac", # Transcode audio to AAC
-                          "-g 30", # Force GOP to 1/2 framerate
-                          "-crf 18", # Set CRF to something middle-of-the-road
-                          "-use_editlist 0", # No edit lists
-                          "-movflags +faststart", # Relocate MOOV atom to beginning of file
-                          "-r 60", # Force framerate of output to 60FPS (add/drop frames)
-                          "-f %NEWEXT%", # Transcode into container based on "new_ext" variable
-                          "%DESTFILE%" # Name and path for trandcode output (should be last)
-                      ]
-
-            # Set the extension to MP4.
-            new_ext = "mp4"
-
-            # Set the description for later display.
-            trans_mode = "Youtube upload - H.264 video, AAC audio, MP4 container"
-
-
-        # Avid DNxHR-HQ transcode
-        elif argument.lower() == "-dnxhr":
-            # These settings are for transcoding edited videos into a popular
-            # working format for professional video editing. The files can be
-            # huge, but the resulting quality is about as good as it gets.
-            cmdline = [
-                          #"%FFMPEG%", # Required for obvious reasons and must be #1
-                          "-y", # Assume "yes" to prompts, e.g., overwrite warning
-                          "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
-                          "-nostats", # Don't output a bunch of statistical info on the file
-                          "-hwaccel auto", # Hardware acceleration enabled, auto-detect
-                          "-i %SOURCEFILE%", # Name of file to transcode
-                          "-c:v dnxhd", # Transcode video to DNxHD
-                          "-profile:v dnxhr_hq", # HQ profile
-                          "-c:a pcm_s16le", # Transcode audio to 16-bit PCM (LE byte order)
-                          "-pix_fmt yuv422p", # Set pixel format to 4:2:2 YUV
-                          "-f %NEWEXT%", # Transcode into container based on "new_ext" variable
-                          "%DESTFILE%" # Name and path for trandcode output (should be last)
-                      ]
-
-            # Set the extension to MOV.
-            new_ext = "mov"
-
-            # Set the description for later display.
-            trans_mode = "DNxHR HQ video, 16-bit PCM audio, MOV container"
-
-
-        # Apple ProRes 4444 transcode
-        elif argument.lower() == "-prores":
-            # These settings are for transcoding edited videos into a popular
-            # working format for professional video editing. The files can be
-            # huge, but the resulting quality is about as good as it gets.
-            cmdline = [
-                          #"%FFMPEG%", # Required for obvious reasons and must be #1
-                          "-y", # Assume "yes" to prompts, e.g., overwrite warning
-                          "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
-                          "-nostats", # Don't output a bunch of statistical info on the file
-                          "-hwaccel auto", # Hardware acceleration enabled, auto-detect
-                          "-i %SOURCEFILE%", # Name of file to transcode
-                          "-pix_fmt yuv422p10le", # Set pixel format to 4:2:2 YUV, 10 bits per pixel
-                          "-c:v prores_ks", # Set codec to ProRes
-                          "-profile:v 4", # 4444 profile
-                          "-c:a pcm_s24le", # Transcode audio to 24-bit PCM (LE byte order)
-                          "-f %NEWEXT%", # Transcode into container based on "new_ext" variable
-                          "%DESTFILE%" # Name and path for trandcode output (should be last)
-                      ]
-
-            # Set the extension to MOV.
-            new_ext = "mov"
-
-            # Set the description for later display.
-            trans_mode = "ProRes 4444 video, 24-bit PCM audio, MOV container"
-
-
-        # Plex "nearly universal" HD (1080p) H.264 transcode
-        elif argument.lower() == "-plexhd":
-            # These settings are for transcoding edited videos into a format
-            # that plays without additional transcoding on a wide variet of Plex
-            # clients. This minimizes the demand on the server for client
-            # transcodes. NOTE: Non-HD video is scaled, and non-16:9 aspect
-            # ratio video is either letterboxed or pillarboxed as required.
-            cmdline = [
-                          #"%FFMPEG%", # Required for obvious reasons and must be #1
-                          "-y", # Assume "yes" to prompts, e.g., overwrite warning
-                          "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
-                          "-nostats", # Don't output a bunch of statistical info on the file
-                          "-hwaccel auto", # Hardware acceleration enabled, auto-detect
-                          "-i %SOURCEFILE%", # Name of file to transcode
-                          "-vf scale=\"'if(gt(a,16/9),1920,-1)':'if(gt(a,16/9),-1,1080)', pad=1920:1080:(1920-iw*min(1920/iw\,1080/ih))/2:(1080-ih*min(1920/iw\,1080/ih))/2\"", # Scale to 1920 wide and/or 1080 high regardless of aspect ratio, and pad extra space for non-16:9 ratios (letterbox or pillarbox)
-                          "-af \"aresample=async=1:min_hard_comp=0.100000:first_pts=0\"", # Audio resample to prevent desync
-                          "-pix_fmt yuv420p", # Set pixel format to 4:2:0 YUV
-                          "-c:v libx264", # Transcode video to H.264
-                          "-level:v 4.0", # Set H.264 level to 4.0, which supports 1080p30 @ up to 20mbps
-                          "-profile:v high", # High profile
-                          "-b:v 8m", # Set video bitrate to 8mbps
-                          "-c:a aac", # Transcode audio to AAC
-                          "-b:a 320k", # Set audio bitrate to 320kbps
-                          "-movflags +faststart", # Relocate MOOV atom to beginning of file
-                          "-r 30", # Force framerate of output to 30FPS (add/drop frames)
-                          "-crf 18", # Set CRF to something middle-of-the-road
-                          "-f %NEWEXT%", # Transcode into container based on "new_ext" variable
-                          "%DESTFILE%" # Name and path for trandcode output (should be last)
-                      ]
-
-            # Set the extension to MP4.
-            new_ext = "mp4"
-
-            # Set the description for later display.
-            trans_mode = "Plex HD - H.264 video, AAC audio, MP4 container"
-
-
-        # Plex "nearly universal" SD (720p) H.264 transcode
-        elif argument.lower() == "-plexsd":
-            # These settings are for transcoding edited videos into a format
-            # that plays without additional transcoding on a wide variet of Plex
-            # clients. This minimizes the demand on the server for client
-            # transcodes. NOTE: Non-SD video is scaled, and non-16:9 aspect
-            # ratio video is either letterboxed or pillarboxed as required.
-            cmdline = [
-                          #"%FFMPEG%", # Required for obvious reasons and must be #1
-                          "-y", # Assume "yes" to prompts, e.g., overwrite warning
-                          "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
-                          "-nostats", # Don't output a bunch of statistical info on the file
-                          "-hwaccel auto", # Hardware acceleration enabled, auto-detect
-                          "-i %SOURCEFILE%", # Name of file to transcode
-                          "-vf scale=\"'if(gt(a,16/9),1280,-1)':'if(gt(a,16/9),-1,720)', pad=1280:720:(1280-iw*min(1280/iw\,720/ih))/2:(720-ih*min(1280/iw\,720/ih))/2\"", # Scale to 1280 wide and/or 720 high regardless of aspect ratio, and pad extra space for non-16:9 ratios (letterbox or pillarbox)
-                          "-af \"aresample=async=1:min_hard_comp=0.100000:first_pts=0\"", # Audio resample to prevent desync
-                          "-pix_fmt yuv420p", # Set pixel format to 4:2:0 YUV
-                          "-c:v libx264", # Transcode video to H.264
-                          "-level:v 4.0", # Set H.264 level to 4.0, which supports 1080p30 @ up to 20mbps
-                          "-profile:v baseline", # Baseline profile
-                          "-b:v 4m", # Set video bitrate to 4mbps
-                          "-c:a aac", # Transcode audio to AAC
-                          "-b:a 320k", # Set audio bitrate to 320kbps
-                          "-movflags +faststart", # Relocate MOOV atom to beginning of file
-                          "-r 30", # Force framerate of source to 30FPS (add/drop frames)
-                          "-crf 18", # Set CRF to something middle-of-the-road
-                          "-f %NEWEXT%", # Transcode into container based on "new_ext" variable
-                          "%DESTFILE%" # Name and path for trandcode output (should be last)
-                      ]
-
-            # Set the extension to MP4.
-            new_ext = "mp4"
-
-            # Set the description for later display.
-            trans_mode = "Plex SD - H.264 video, AAC audio, MP4 container"
-
-
-        # WebM (VP9) Constant-Quality single-pass transcode
-        elif argument.lower() == "-webm":
-            cmdline = [
-                          #"%FFMPEG%", # Required for obvious reasons and must be #1
-                          "-y", # Assume "yes" to prompts, e.g., overwrite warning
-                          "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
-                          "-nostats", # Don't output a bunch of statistical info on the file
-                          "-hwaccel auto", # Hardware acceleration enabled, auto-detect
-                          "-i %SOURCEFILE%", # Name of file to transcode
-                          "-c:v libvpx-vp9", # Transcode to VP9
-                          "-crf 30", # Set CRF to something middle-of-the-road
-                          "-b:v 0", # Force CONSTANT-QUALITY mde
-                          "-f %NEWEXT%", # Transcode into container based on "new_ext" variable
-                          "%DESTFILE%" # Name and path for trandcode output (should be last)
-                      ]
-
-            # Set the extension to MOV.
-            new_ext = "webm"
-
-            # Set the description for later display.
-            trans_mode = "WebM (VP9) Constant-Quality Single-Pass"
-
-
-#        # Add your own transcode arguments!
-#        elif argument.lower() == "-newtranscode":
-#            # Edit the following to add the components of a command line call
-#            # for ffmpeg. As is the case for calling ffmpeg directly, order
-#            # does matter. Enable ffmpeg logging by setting the "save_ffmpeg_output"
-#            # variable to True if your transcode fails - that way, you can inspect
-#            # ffmpeg's output to see what's making it upset.
-#
-#            # Please note the following tokens are allowed:
-#            #   %FFMPEG% : Full path to ffmpeg (defaults to "ffmpeg" but requires ffmpeg to
-#            #              be in a directory on the system's PATH)
-#            #   %SPATH% : Source directory provided by caller (not generally needed here)
-#            #   %DPATH% : Destination directory provided by caller (not generally needed here)
-#            #   %SOURCEFILE% : target file (filename, with full path)
-#            #   %DESTFILE% : destination file (filename, with full path, but with NEW extension)
-#            #   %NEWEXT% : New file extension, taken from the "new_ext" variable
-#            cmdline = [
-#                          #"%FFMPEG%", # Required for obvious reasons and must be #1
-#                          "-y", # Assume "yes" to prompts, e.g., overwrite warning
-#                          "-progress -", # Output progress info (and yes that second hyphen is REQUIRED)
-#                          "-nostats", # Don't output a bunch of statistical info on the file
-#                          "-hwaccel auto", # Hardware acceleration enabled, auto-detect
-#                          #
-#                          # Add your specific INPUT flags and settings here. See the other
-#                          # transcode entries for examples.
-#                          #
-#                          "-i %SOURCEFILE%", # Name of file to transcode
-#                          #
-#                          # Add your specific OUTPUT flags and settings here. See the other
-#                          # transcode entries for examples.
-#                          #
-#                          "-f %NEWEXT%", # Transcode into container based on "new_ext" variable
-#                          "%DESTFILE%" # Name and path for trandcode output (should be last)
-#                      ]
-#
-#            # Set the extension to MOV.
-#            new_ext = "mov"
-#
-#            # Set the description for later display.
-#            trans_mode = "Briefly describe the transcode's results here."
+        # Transcode presets, e.g., "-davinci". More than one can be selected,
+        # in which case they all come out of the same ffmpeg run.
+        if argument.startswith("-") and argument.lower()[1:] in presets:
+
+            # Remember the preset, unless it's already been selected.
+            if argument.lower()[1:] not in selected_presets:
+                selected_presets.append(argument.lower()[1:])
+
+            # Set the extension from the preset. (If only one preset is
+            # selected, a "-c" after it can still override this.)
+            new_ext = presets[argument.lower()[1:]]["ext"]
 
 
         # Source directory
@@ -470,6 +784,61 @@ if len(sys.argv) > 1:
             index += 1
 
 
+        # Output cache directory
+        elif argument.lower() == "-cache":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the cache directory.
+            temp = sys.argv[index + 1].strip('"')
+
+            # Sanity check - is the next argument an actual path?
+            if not os.path.isdir(temp):
+                print("Cache directory doesn't exist - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            cache_dir = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Output cache size limit
+        elif argument.lower() == "-cachesize":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the size in gigabytes.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Cache size must be a whole number of gigabytes - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            cache_size = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Full-file fingerprinting for the output cache
+        elif argument.lower() == "-fullhash":
+
+            # We've passed the sanity check, so let's store this argument.
+            cache_full_hash = True
+
+
         # ffmpeg location
         elif argument.lower() == "-ffmpeg":
 
@@ -533,6 +902,18 @@ if len(sys.argv) > 1:
             with open(temp, 'r') as config_file: 
                 config.read_file(config_file)
 
+            # Each [watch:NAME] section is another watch folder.
+            for section in config.sections():
+                if section.lower().startswith("watch:"):
+                    watch_config = {"name": section[6:].strip()}
+                    for option in ("source", "destination", "finished", "extensions",
+                                   "presets", "custom", "container"):
+                        if config.has_option(section, option):
+                            temp = config.get(section, option, raw=True)
+                            if temp != "":
+                                watch_config[option] = temp
+                    watch_configs.append(watch_config)
+
             # Parse values into variables. Note that we will only change
             # a variable if the config file contains an entry for that
             # variable, which means that the config file overrides the
@@ -550,23 +931,85 @@ if len(sys.argv) > 1:
                 temp = config.get("paths", "finished", raw=True)
                 if temp != "":
                     storage_dir = temp
+            if config.has_option("paths", "telemetry"):
+                temp = config.get("paths", "telemetry", raw=True)
+                if temp != "":
+                    telemetry_file = temp
+            if config.has_option("paths", "metricsfile"):
+                temp = config.get("paths", "metricsfile", raw=True)
+                if temp != "":
+                    metrics_file = temp
+            if config.has_option("paths", "quarantine"):
+                temp = config.get("paths", "quarantine", raw=True)
+                if temp != "":
+                    quarantine_dir = temp
+            if config.has_option("paths", "cache"):
+                temp = config.get("paths", "cache", raw=True)
+                if temp != "":
+                    cache_dir = temp
+            if config.has_option("paths", "flogdir"):
+                temp = config.get("paths", "flogdir", raw=True)
+                if temp != "":
+                    ffmpeg_log_dir = temp
             if config.has_option("paths", "ffmpeg"):
                 temp = config.get("paths", "ffmpeg", raw=True)
                 if temp != "":
-                    ffmpeg_location = os.path.join(temp, "ffmpeg.exe")
+                    if os.name == 'nt':
+                        ffmpeg_location = os.path.join(temp, "ffmpeg.exe")
+                    else:
+                        ffmpeg_location = os.path.join(temp, "ffmpeg")
             if config.has_option("monitor", "extensions"):
                 temp = config.get("monitor", "extensions").split(',')
                 if temp != "":
                     file_ext = temp
+            if config.has_option("monitor", "watcher"):
+                temp = config.get("monitor", "watcher").lower()
+                if temp != "":
+                    if temp not in ("auto", "inotify", "poll"):
+                        print("Config file 'watcher' must be 'auto', 'inotify' or 'poll' - please check your config file.")
+                        quit()
+                    watch_backend = temp
+            if config.has_option("monitor", "quiet"):
+                temp = config.get("monitor", "quiet")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'quiet' must be a whole number of seconds - please check your config file.")
+                        quit()
+                    quiet_period = int(temp)
+            if config.has_option("monitor", "nohandlecheck"):
+                temp = config.get("monitor", "nohandlecheck")
+                if temp != "":
+                    handle_check = False
+            if config.has_option("monitor", "recursive"):
+                temp = config.get("monitor", "recursive")
+                if temp != "":
+                    recursive = True
+            if config.has_option("monitor", "claim"):
+                temp = config.get("monitor", "claim")
+                if temp != "":
+                    claim_files = True
             if config.has_option("transcode", "custom"):
                 temp = config.get("transcode", "custom", raw=True)
                 if temp != "":
-                    cmdline.append(temp)
-                    trans_mode = "Custom-defined ffmpeg commandline"
+                    cmdline = [temp]
             if config.has_option("transcode", "container"):
                 temp = config.get("transcode", "container")
                 if temp != "":
                     new_ext = temp
+            if config.has_option("options", "noprogress"):
+                temp = config.get("options", "noprogress")
+                if temp != "":
+                    show_dashboard = False
+            if config.has_option("options", "refresh"):
+                temp = config.get("options", "refresh")
+                if temp != "":
+                    try:
+                        dashboard_refresh = float(temp)
+                    except ValueError:
+                        dashboard_refresh = 0
+                    if dashboard_refresh <= 0:
+                        print("Config file 'refresh' must be a number of seconds above 0 - please check your config file.")
+                        quit()
             if config.has_option("options", "debug"):
                 temp = config.get("options", "debug")
                 if temp != "":
@@ -575,6 +1018,173 @@ if len(sys.argv) > 1:
                 temp = config.get("options", "flog")
                 if temp != "":
                     save_ffmpeg_output = True
+            if config.has_option("options", "flogdiag"):
+                temp = config.get("options", "flogdiag")
+                if temp != "":
+                    save_ffmpeg_output = True
+                    ffmpeg_log_diag = True
+            if config.has_option("options", "flogkeep"):
+                temp = config.get("options", "flogkeep")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'flogkeep' must be a whole number - please check your config file.")
+                        quit()
+                    ffmpeg_log_keep = int(temp)
+            if config.has_option("options", "logsize"):
+                temp = config.get("options", "logsize")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'logsize' must be a whole number of megabytes - please check your config file.")
+                        quit()
+                    log_size = int(temp)
+            if config.has_option("options", "logage"):
+                temp = config.get("options", "logage")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'logage' must be a whole number of hours - please check your config file.")
+                        quit()
+                    log_age = int(temp)
+            if config.has_option("options", "logkeep"):
+                temp = config.get("options", "logkeep")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'logkeep' must be a whole number - please check your config file.")
+                        quit()
+                    log_keep = int(temp)
+            if config.has_option("options", "jobdb"):
+                temp = config.get("options", "jobdb", raw=True)
+                if temp != "":
+                    job_db = temp
+            if config.has_option("options", "segment"):
+                temp = config.get("options", "segment")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'segment' must be a whole number of seconds - please check your config file.")
+                        quit()
+                    segment_length = int(temp)
+            if config.has_option("options", "segjobs"):
+                temp = config.get("options", "segjobs")
+                if temp != "":
+                    if not temp.isdigit() or int(temp) < 1:
+                        print("Config file 'segjobs' must be a whole number of 1 or more - please check your config file.")
+                        quit()
+                    segment_jobs = int(temp)
+            if config.has_option("options", "metrics"):
+                temp = config.get("options", "metrics")
+                if temp != "":
+                    if not temp.rpartition(":")[2].isdigit():
+                        print("Config file 'metrics' must be a port, or an address and port - please check your config file.")
+                        quit()
+                    metrics_listen = temp
+            if config.has_option("options", "nopassthrough"):
+                temp = config.get("options", "nopassthrough")
+                if temp != "":
+                    passthrough = False
+            if config.has_option("options", "retries"):
+                temp = config.get("options", "retries")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'retries' must be a whole number - please check your config file.")
+                        quit()
+                    job_retries = int(temp)
+            if config.has_option("options", "retrydelay"):
+                temp = config.get("options", "retrydelay")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'retrydelay' must be a whole number of seconds - please check your config file.")
+                        quit()
+                    retry_delay = int(temp)
+            if config.has_option("options", "noverify"):
+                temp = config.get("options", "noverify")
+                if temp != "":
+                    verify_outputs = False
+            if config.has_option("options", "verifytol"):
+                temp = config.get("options", "verifytol")
+                if temp != "":
+                    try:
+                        verify_tolerance = float(temp)
+                    except ValueError:
+                        verify_tolerance = -1
+                    if verify_tolerance < 0:
+                        print("Config file 'verifytol' must be a number of seconds - please check your config file.")
+                        quit()
+            if config.has_option("options", "verifydecode"):
+                temp = config.get("options", "verifydecode")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'verifydecode' must be a whole number of seconds - please check your config file.")
+                        quit()
+                    verify_decode = int(temp)
+            if config.has_option("options", "verifyjobs"):
+                temp = config.get("options", "verifyjobs")
+                if temp != "":
+                    if not temp.isdigit() or int(temp) < 1:
+                        print("Config file 'verifyjobs' must be a whole number of 1 or more - please check your config file.")
+                        quit()
+                    verify_jobs = int(temp)
+            if config.has_option("options", "order"):
+                temp = config.get("options", "order").lower()
+                if temp != "":
+                    if temp not in ("fifo", "smallest", "shortest"):
+                        print("Config file 'order' must be 'fifo', 'smallest' or 'shortest' - please check your config file.")
+                        quit()
+                    queue_order = temp
+            if config.has_option("options", "aging"):
+                temp = config.get("options", "aging")
+                if temp != "":
+                    try:
+                        queue_aging = float(temp)
+                    except ValueError:
+                        queue_aging = -1
+                    if queue_aging < 0:
+                        print("Config file 'aging' must be a number of 0 or more - please check your config file.")
+                        quit()
+            if config.has_option("options", "probejobs"):
+                temp = config.get("options", "probejobs")
+                if temp != "":
+                    if not temp.isdigit() or int(temp) < 1:
+                        print("Config file 'probejobs' must be a whole number of 1 or more - please check your config file.")
+                        quit()
+                    probe_jobs = int(temp)
+            if config.has_option("options", "cachesize"):
+                temp = config.get("options", "cachesize")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'cachesize' must be a whole number of gigabytes - please check your config file.")
+                        quit()
+                    cache_size = int(temp)
+            if config.has_option("options", "fullhash"):
+                temp = config.get("options", "fullhash")
+                if temp != "":
+                    cache_full_hash = True
+            if config.has_option("options", "jobs"):
+                temp = config.get("options", "jobs")
+                if temp != "":
+                    if not temp.isdigit():
+                        print("Config file 'jobs' must be a whole number - please check your config file.")
+                        quit()
+                    worker_count = int(temp)
+            if config.has_option("options", "coordinator"):
+                temp = config.get("options", "coordinator")
+                if temp != "":
+                    if not temp.rpartition(":")[2].isdigit():
+                        print("Config file 'coordinator' must be a port, or an address and port - please check your config file.")
+                        quit()
+                    coordinator_listen = temp
+            if config.has_option("options", "worker"):
+                temp = config.get("options", "worker")
+                if temp != "":
+                    if temp.rpartition(":")[0] == "" or not temp.rpartition(":")[2].isdigit():
+                        print("Config file 'worker' must be a host and port - please check your config file.")
+                        quit()
+                    worker_address = temp
+            if config.has_option("options", "lease"):
+                temp = config.get("options", "lease")
+                if temp != "":
+                    if not temp.isdigit() or int(temp) < 4:
+                        print("Config file 'lease' must be a whole number of seconds, 4 or more - please check your config file.")
+                        quit()
+                    lease_time = int(temp)
 
             # Advance the index an extra step, skipping the next since it's a
             # parameter.
@@ -601,6 +1211,75 @@ if len(sys.argv) > 1:
             index += 1
 
 
+        # Directory watcher backend
+        elif argument.lower() == "-watch":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the backend name.
+            temp = sys.argv[index + 1].lower()
+
+            # Sanity check - is it one we know about?
+            if temp not in ("auto", "inotify", "poll"):
+                print("Watcher must be 'auto', 'inotify' or 'poll' - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            watch_backend = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Write-stability quiet period
+        elif argument.lower() == "-quiet":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of seconds.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Quiet period must be a whole number of seconds - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            quiet_period = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Open-file check disable
+        elif argument.lower() == "-nohandlecheck":
+
+            # We've passed the sanity check, so let's store this argument.
+            handle_check = False
+
+
+        # Subdirectory watching enable
+        elif argument.lower() == "-recursive":
+
+            # We've passed the sanity check, so let's store this argument.
+            recursive = True
+
+
+        # Claim files enable
+        elif argument.lower() == "-claim":
+
+            # We've passed the sanity check, so let's store this argument.
+            claim_files = True
+
+
         # Output container
         elif argument.lower() == "-c":
 
@@ -620,6 +1299,38 @@ if len(sys.argv) > 1:
             index += 1
 
 
+        # Progress dashboard disable
+        elif argument.lower() == "-noprogress":
+
+            # We've passed the sanity check, so let's store this argument.
+            show_dashboard = False
+
+
+        # Progress dashboard redraw rate
+        elif argument.lower() == "-refresh":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a number of seconds.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            try:
+                dashboard_refresh = float(temp)
+            except ValueError:
+                dashboard_refresh = 0
+            if dashboard_refresh <= 0:
+                print("Refresh time must be a number of seconds above 0 - please check your command line.")
+                quit()
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
         # Debug mode enable
         elif argument.lower() == "-debug":
 
@@ -634,79 +1345,846 @@ if len(sys.argv) > 1:
             save_ffmpeg_output = True
 
 
-        elif argument.lower() == "--help":
+        # ffmpeg diagnostics-only logging mode enable
+        elif argument.lower() == "-flogdiag":
 
-            #      12345678901234567890123456789012345678901234567890123456789012345678901234567890
-            print("This script monitors a selected directory and hands video files")
-            print("to ffmpeg for transcoding into specific formats. it is designed")
-            print("to serve as an ingest/export autoprocessor for transcoding")
-            print("video files into and out of suitable formats for video editing.")
-            print("")
-            print("Usage:")
-            print("  {} TRANSCODE [OPTIONS ...] -s /full/source/path "
-                  "-d /full/dest/path [-f /full/finished/path] "
-                  "[-ffmpeg /full/path/to/ffmpeg]"
-                  . format(os.path.basename(__file__)))
-            print("")
-            print("Path Settings:")
-            print("")
-            print(" NOTE 1: These can appear in any order, but the parameter must")
-            print(" immediately follow the switch.")
-            print("")
-            print(" NOTE 2: Paths that include spaces must be enclosed in double-quotes.")
-            print("")
-            print("  -s /full/source/path     : Full path to source files.")
-            print("  -d /full/dest/path       : Full path to destination for transcodes.")
-            print("  [-f /full/finished/path] : Full path to destination for storing")
-            print("                             originals once transcodes have finished.")
-            print("                             NOTE: If this is not provided, original")
-            print("                             files will be renamed to end in '.processed'")
-            print("                             when transcodes are finished.")
-            print("  [-ffmpeg /full/path/to/ffmpeg] : Full path to ffmpeg - only needed")
-            print("                             if ffmpeg is not in a directory on the")
-            print("                             system's PATH.")
-            print("  [-conf /full/path/to/config.ini] : Full path to configuration file.")
-            print("                             File must be in INI format and overrides")
-            print("                             commandline arguments.")
-            print("")
-            print("TRANSCODE Choices:")
-            print("")
-            print(" -davinci : Transcode to a format compatible with the Linux version")
-            print("            of Davinci Resolve 16+ - MPEG4 video, PCM16LE audio,")
-            print("            max quality, Quicktime MOV container.")            
-            print("            These files can be big (~500MB/minute), so plan accordingly.")
-            print(" -youtube : Transcode to a format that makes for small uploadable")
-            print("            files for Youtube, based on Youtube's guidelines for")
-            print("            transcoding as of 15 Dec 2020 - H.264 video, AAC audio.")
-            print(" -dnxhr   : Transcode to Avid DNxHR HQ format, which is a highly")
-            print("            intechangeable professional editing format that works")
-            print("            with a variety of NLEs. WARNING: PRODUCES VERY LARGE")
-            print("            FILES.")
-            print(" -prores  : Transcodes to Apple ProRes 4444, which is a highly")
-            print("            intechangeable professional editing format that works")
-            print("            with a variety of NLEs. WARNING: PRODUCES VERY LARGE")
-            print("            FILES.")
-            print(" -plexhd  : Transcodes to a format that streams well over Plex,")
-            print("            without requiring additional server-side transcoding.")
-            print("            Files are scaled to 1080p, framerate is scaled to 30FPS,")
-            print("            and videos with aspect ratios other than 16x9 are either")
-            print("            letterboxed or pillarboxed to fit a 16x9 display.")
-            print(" -plexsd  : Transcodes to a format that streams well over Plex.")
-            print("            without requiring additional server-side transcoding.")
-            print("            Files are scaled to 720p, framerate is scaled to 30FPS,")
-            print("            and videos with aspect ratios other than 16x9 are either")
-            print("            letterboxed or pillarboxed to fit a 16x9 display.")
-            print(" -webm    : Transcode to WebM (VP9) constant-quality mode, which is")
-            print("            a popular mode for image hosting sites that support")
-            print("            short animations.")
-            print("")
-            print("Transcode Container OPTIONS:")
-            print("")
-            print(" -c [CONTAINER] : Container (filename extension) to transcode into,")
-            print("                  'mp4' for MPEG4, 'mov' for Quicktime, 'mkv' for")
-            print("                  Matroska, etc. This is automatically set for")
-            print("                  transcode presets (-davinci, -youtube, etc.).")
-            print("")
+            # We've passed the sanity check, so let's store this argument.
+            save_ffmpeg_output = True
+            ffmpeg_log_diag = True
+
+
+        # ffmpeg log directory
+        elif argument.lower() == "-flogdir":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the log directory.
+            temp = sys.argv[index + 1].strip('"')
+
+            # Sanity check - does the directory it goes in exist?
+            if not os.path.isdir(os.path.dirname(os.path.abspath(temp))):
+                print("ffmpeg log directory's parent directory doesn't exist - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            ffmpeg_log_dir = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Number of ffmpeg logs to keep
+        elif argument.lower() == "-flogkeep":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of logs.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("ffmpeg log count must be a whole number - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            ffmpeg_log_keep = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Debug log size limit
+        elif argument.lower() == "-logsize":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the size limit.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Debug log size must be a whole number of megabytes - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            log_size = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Debug log age limit
+        elif argument.lower() == "-logage":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the age limit.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Debug log age must be a whole number of hours - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            log_age = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Number of old debug logs to keep
+        elif argument.lower() == "-logkeep":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of logs.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Debug log count must be a whole number - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            log_keep = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Concurrent transcode count
+        elif argument.lower() == "-jobs":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of jobs.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number? (0 is
+            # only any use to a coordinator, which is checked later.)
+            if not temp.isdigit():
+                print("Job count must be a whole number - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            worker_count = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Segment length for segmented transcoding
+        elif argument.lower() == "-segment":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of seconds.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Segment length must be a whole number of seconds - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            segment_length = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Concurrent segment count
+        elif argument.lower() == "-segjobs":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of segments.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit() or int(temp) < 1:
+                print("Segment job count must be a whole number of 1 or more - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            segment_jobs = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Always transcode, even if the source's streams could be copied
+        elif argument.lower() == "-nopassthrough":
+
+            # We've passed the sanity check, so let's store this argument.
+            passthrough = False
+
+
+        # Failed transcode retry count
+        elif argument.lower() == "-retries":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of retries.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Retry count must be a whole number - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            job_retries = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Failed transcode retry delay
+        elif argument.lower() == "-retrydelay":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a number of seconds.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Retry delay must be a whole number of seconds - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            retry_delay = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Quarantine directory
+        elif argument.lower() == "-quarantine":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the quarantine directory.
+            temp = sys.argv[index + 1].strip('"')
+
+            # Sanity check - does the directory it goes in exist?
+            if not os.path.isdir(os.path.dirname(os.path.abspath(temp))):
+                print("Quarantine directory's parent directory doesn't exist - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            quarantine_dir = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Output verification disable
+        elif argument.lower() == "-noverify":
+
+            # We've passed the sanity check, so let's store this argument.
+            verify_outputs = False
+
+
+        # Output verification duration tolerance
+        elif argument.lower() == "-verifytol":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a number of seconds.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            try:
+                verify_tolerance = float(temp)
+            except ValueError:
+                verify_tolerance = -1
+            if verify_tolerance < 0:
+                print("Verification tolerance must be a number of seconds - please check your command line.")
+                quit()
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Output verification decode check
+        elif argument.lower() == "-verifydecode":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a number of seconds.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Decode check length must be a whole number of seconds - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            verify_decode = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Concurrent verification count
+        elif argument.lower() == "-verifyjobs":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of checks.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit() or int(temp) < 1:
+                print("Verification job count must be a whole number of 1 or more - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            verify_jobs = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Queue order
+        elif argument.lower() == "-order":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the order's name.
+            temp = sys.argv[index + 1].lower()
+
+            # Sanity check - is it one we know about?
+            if temp not in ("fifo", "smallest", "shortest"):
+                print("Queue order must be 'fifo', 'smallest' or 'shortest' - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            queue_order = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Queue aging rate
+        elif argument.lower() == "-aging":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the aging rate.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            try:
+                queue_aging = float(temp)
+            except ValueError:
+                queue_aging = -1
+            if queue_aging < 0:
+                print("Aging rate must be a number of 0 or more - please check your command line.")
+                quit()
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Concurrent probe count
+        elif argument.lower() == "-probejobs":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of probes.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit() or int(temp) < 1:
+                print("Probe job count must be a whole number of 1 or more - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            probe_jobs = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Job store location
+        elif argument.lower() == "-jobdb":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the database file.
+            temp = sys.argv[index + 1].strip('"')
+
+            # Sanity check - does the directory it goes in exist?
+            if not os.path.isdir(os.path.dirname(os.path.abspath(temp))):
+                print("Job store directory doesn't exist - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            job_db = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Job store listing
+        elif argument.lower() == "-queue":
+
+            # We've passed the sanity check, so let's store this argument.
+            show_queue = True
+
+
+        # Telemetry log location
+        elif argument.lower() == "-telemetry":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the telemetry log.
+            temp = sys.argv[index + 1].strip('"')
+
+            # Sanity check - is the file going somewhere that exists?
+            if not os.path.isdir(os.path.dirname(os.path.abspath(temp))):
+                print("Telemetry log directory doesn't exist - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            telemetry_file = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Summarize the telemetry log
+        elif argument.lower() == "-report":
+
+            # We've passed the sanity check, so let's store this argument.
+            show_report = True
+
+
+        # Telemetry summary time window
+        elif argument.lower() == "-window":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a number of hours.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Report window must be a whole number of hours - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            report_window = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Preset benchmark
+        elif argument.lower() == "-benchmark":
+
+            # We've passed the sanity check, so let's store this argument.
+            run_benchmark = True
+
+
+        # Benchmark baseline location
+        elif argument.lower() == "-baseline":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the baseline file.
+            temp = sys.argv[index + 1].strip('"')
+
+            # Sanity check - is the file going somewhere that exists?
+            if not os.path.isdir(os.path.dirname(os.path.abspath(temp))):
+                print("Baseline directory doesn't exist - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            benchmark_baseline = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Replace the benchmark baseline
+        elif argument.lower() == "-savebaseline":
+
+            # We've passed the sanity check, so let's store this argument.
+            save_baseline = True
+
+
+        # Benchmark regression tolerance
+        elif argument.lower() == "-tolerance":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a percentage.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit():
+                print("Tolerance must be a whole number percentage - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            benchmark_tolerance = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Control-plane scale benchmark
+        elif argument.lower() == "-scalebench":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the number of files.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            if not temp.isdigit() or int(temp) < 1:
+                print("Scale benchmark file count must be a whole number of 1 or more - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            scalebench_files = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Scale benchmark stub transcode time
+        elif argument.lower() == "-stubtime":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a number of seconds.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number?
+            try:
+                stub_time = float(temp)
+            except ValueError:
+                print("Stub time must be a number of seconds - please check your command line.")
+                quit()
+            if stub_time < 0:
+                print("Stub time must be a number of seconds - please check your command line.")
+                quit()
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Metrics server
+        elif argument.lower() == "-metrics":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a port, maybe with an
+            # address in front.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - does the argument end with a port number?
+            if not temp.rpartition(":")[2].isdigit():
+                print("Metrics must be a port, or an address and port - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            metrics_listen = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Coordinator port
+        elif argument.lower() == "-coordinator":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a port, maybe with an
+            # address in front.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - does the argument end with a port number?
+            if not temp.rpartition(":")[2].isdigit():
+                print("Coordinator must be a port, or an address and port - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            coordinator_listen = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Coordinator to work for
+        elif argument.lower() == "-worker":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a host and port.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is it a host and port?
+            if temp.rpartition(":")[0] == "" or not temp.rpartition(":")[2].isdigit():
+                print("Worker must be given the coordinator's host and port - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            worker_address = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Remote worker lease time
+        elif argument.lower() == "-lease":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be a number of seconds.
+            temp = sys.argv[index + 1]
+
+            # Sanity check - is the next argument a usable number? Workers
+            # check in four times per lease, so it can't be too short.
+            if not temp.isdigit() or int(temp) < 4:
+                print("Lease time must be a whole number of seconds, 4 or more - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            lease_time = int(temp)
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        # Metrics textfile
+        elif argument.lower() == "-metricsfile":
+
+            # Sanity check - is there a trailing argument?
+            if index + 1 >= len(sys.argv):
+                print("Missing argument - please check your command line.")
+                quit()
+
+            # Fetch the next argument, which SHOULD be the metrics file.
+            temp = sys.argv[index + 1].strip('"')
+
+            # Sanity check - is the file going somewhere that exists?
+            if not os.path.isdir(os.path.dirname(os.path.abspath(temp))):
+                print("Metrics file directory doesn't exist - please check your command line.")
+                quit()
+
+            # We've passed the sanity checks, so let's store this argument.
+            metrics_file = temp
+
+            # Advance the index an extra step, skipping the next since it's a
+            # parameter.
+            index += 1
+
+
+        elif argument.lower() == "--help":
+
+            #      12345678901234567890123456789012345678901234567890123456789012345678901234567890
+            print("This script monitors a selected directory and hands video files")
+            print("to ffmpeg for transcoding into specific formats. it is designed")
+            print("to serve as an ingest/export autoprocessor for transcoding")
+            print("video files into and out of suitable formats for video editing.")
+            print("")
+            print("Usage:")
+            print("  {} TRANSCODE [OPTIONS ...] -s /full/source/path "
+                  "-d /full/dest/path [-f /full/finished/path] "
+                  "[-ffmpeg /full/path/to/ffmpeg]"
+                  . format(os.path.basename(__file__)))
+            print("")
+            print("Path Settings:")
+            print("")
+            print(" NOTE 1: These can appear in any order, but the parameter must")
+            print(" immediately follow the switch.")
+            print("")
+            print(" NOTE 2: Paths that include spaces must be enclosed in double-quotes.")
+            print("")
+            print("  -s /full/source/path     : Full path to source files.")
+            print("  -d /full/dest/path       : Full path to destination for transcodes.")
+            print("  [-f /full/finished/path] : Full path to destination for storing")
+            print("                             originals once transcodes have finished.")
+            print("                             NOTE: If this is not provided, original")
+            print("                             files will be renamed to end in '.processed'")
+            print("                             when transcodes are finished.")
+            print("  [-ffmpeg /full/path/to/ffmpeg] : Full path to ffmpeg - only needed")
+            print("                             if ffmpeg is not in a directory on the")
+            print("                             system's PATH.")
+            print("  [-cache /full/cache/path] : Full path to an output cache directory.")
+            print("                             Identical sources transcoded with the same")
+            print("                             settings are copied from here instead of")
+            print("                             being transcoded again.")
+            print("  [-conf /full/path/to/config.ini] : Full path to configuration file.")
+            print("                             File must be in INI format and overrides")
+            print("                             commandline arguments.")
+            print("")
+            print("TRANSCODE Choices:")
+            print("")
+            print(" NOTE: More than one can be selected, e.g., '-davinci -youtube'.")
+            print(" The source is then decoded once and all of the outputs are made")
+            print(" by the same ffmpeg run. Outputs that share a container get the")
+            print(" preset's name added, e.g., 'clip.dnxhr.mov'.")
+            print("")
+            print(" -davinci : Transcode to a format compatible with the Linux version")
+            print("            of Davinci Resolve 16+ - MPEG4 video, PCM16LE audio,")
+            print("            max quality, Quicktime MOV container.")            
+            print("            These files can be big (~500MB/minute), so plan accordingly.")
+            print(" -youtube : Transcode to a format that makes for small uploadable")
+            print("            files for Youtube, based on Youtube's guidelines for")
+            print("            transcoding as of 15 Dec 2020 - H.264 video, AAC audio.")
+            print(" -dnxhr   : Transcode to Avid DNxHR HQ format, which is a highly")
+            print("            intechangeable professional editing format that works")
+            print("            with a variety of NLEs. WARNING: PRODUCES VERY LARGE")
+            print("            FILES.")
+            print(" -prores  : Transcodes to Apple ProRes 4444, which is a highly")
+            print("            intechangeable professional editing format that works")
+            print("            with a variety of NLEs. WARNING: PRODUCES VERY LARGE")
+            print("            FILES.")
+            print(" -plexhd  : Transcodes to a format that streams well over Plex,")
+            print("            without requiring additional server-side transcoding.")
+            print("            Files are scaled to 1080p, framerate is scaled to 30FPS,")
+            print("            and videos with aspect ratios other than 16x9 are either")
+            print("            letterboxed or pillarboxed to fit a 16x9 display.")
+            print(" -plexsd  : Transcodes to a format that streams well over Plex.")
+            print("            without requiring additional server-side transcoding.")
+            print("            Files are scaled to 720p, framerate is scaled to 30FPS,")
+            print("            and videos with aspect ratios other than 16x9 are either")
+            print("            letterboxed or pillarboxed to fit a 16x9 display.")
+            print(" -webm    : Transcode to WebM (VP9) constant-quality mode, which is")
+            print("            a popular mode for image hosting sites that support")
+            print("            short animations.")
+            print("")
+            print("Transcode Container OPTIONS:")
+            print("")
+            print(" -c [CONTAINER] : Container (filename extension) to transcode into,")
+            print("                  'mp4' for MPEG4, 'mov' for Quicktime, 'mkv' for")
+            print("                  Matroska, etc. This is automatically set for")
+            print("                  transcode presets (-davinci, -youtube, etc.).")
+            print(" -nopassthrough : Always transcode. Normally, a source's video or")
+            print("                  audio that already matches what the preset would")
+            print("                  make is copied into the new file as-is, which is")
+            print("                  far quicker.")
+            print("")
             print("Monitoring OPTIONS:")
             print("")
             print(" -e [EXTENSIONS] : Monitor source directory for specific filename")
@@ -714,6 +2192,144 @@ if len(sys.argv) > 1:
             print("                   separated and do not include periods, e.g., 'mp4,mov'.")
             print("                   By default, the most common video file extensions")
             print("                   supported by ffmpeg are selected.")
+            print(" -watch [auto|inotify|poll] : How to watch the source directory.")
+            print("                   'inotify' (Linux only) picks up files as soon")
+            print("                   as they're written, 'poll' lists the directory")
+            print("                   every few seconds. 'auto' (the default) uses")
+            print("                   inotify where it's available.")
+            print(" -quiet [SECONDS] : Only transcode a file once its size and")
+            print("                   modification time have stayed the same for this")
+            print("                   many seconds. Defaults to 0 (no waiting).")
+            print(" -nohandlecheck : Don't check whether other programs have a file")
+            print("                   open. Useful on network shares, where remote")
+            print("                   writers can't be seen - use -quiet instead.")
+            print(" -recursive : Also watch subdirectories of the source directory.")
+            print("                   Transcodes go into matching subdirectories of")
+            print("                   the destination directory.")
+            print(" -claim : Claim each file before transcoding it, so instances on")
+            print("                   several machines can share a source directory")
+            print("                   on a network share without doubling up.")
+            print("                   Always polls the source directory.")
+            print("")
+            print("Performance OPTIONS:")
+            print("")
+            print(" -jobs [COUNT] : Number of transcodes to run at the same time. Each")
+            print("                 file gets its own ffmpeg process. Defaults to 1.")
+            print(" -segment [SECONDS] : Split sources longer than twice this many")
+            print("                 seconds into segments at keyframes, transcode the")
+            print("                 segments several at a time, and join the results.")
+            print("                 Defaults to 0 (off).")
+            print(" -segjobs [COUNT] : Number of segments of one file to transcode at")
+            print("                 the same time. Defaults to 4.")
+            print(" -probejobs [COUNT] : Number of files to inspect with ffprobe at the")
+            print("                 same time. Defaults to 4.")
+            print(" -order [fifo|smallest|shortest] : Order to transcode queued files")
+            print("                 in - as they showed up (the default), smallest")
+            print("                 first, or shortest first. Files tagged [p0] to [p9]")
+            print("                 in their names go ahead of or behind the rest.")
+            print(" -aging [RATE] : For smallest/shortest, every second a file waits")
+            print("                 counts as RATE seconds shorter or MB smaller, so")
+            print("                 big files still get their turn. Defaults to 1.")
+            print("")
+            print("Failure OPTIONS:")
+            print("")
+            print(" -retries [COUNT] : Number of times to retry a transcode that")
+            print("                 failed for a passing reason (full disk, ffmpeg")
+            print("                 killed). Defaults to 3.")
+            print(" -retrydelay [SECONDS] : Wait before the first retry, doubling")
+            print("                 with each one after. Defaults to 30.")
+            print(" -quarantine [/full/path/to/dir] : Move sources that can't be")
+            print("                 transcoded here, with a note of what went wrong.")
+            print("                 Otherwise they're left in place and skipped until")
+            print("                 they change.")
+            print("")
+            print("Distributed OPTIONS:")
+            print("")
+            print(" -coordinator [[ADDRESS:]PORT] : Let remote workers lease queued")
+            print("                 jobs over the network, alongside this instance's")
+            print("                 own workers (-jobs 0 for none.)")
+            print(" -worker [HOST:PORT] : Work for the coordinator at HOST:PORT")
+            print("                 instead of watching for files. -s and -d (and")
+            print("                 [watch:NAME] sections) give the shared folders'")
+            print("                 paths on this machine.")
+            print(" -lease [SECONDS] : How long a remote worker can go without")
+            print("                 checking in before its job is requeued, or a")
+            print("                 claim (-claim) without being renewed before")
+            print("                 another instance takes it over. Defaults to 60.")
+            print("")
+            print("Verification OPTIONS:")
+            print("")
+            print(" -noverify : Don't check transcodes before moving or renaming the")
+            print("                 source. Normally each output is probed, and its")
+            print("                 container, streams and duration compared with the")
+            print("                 source's.")
+            print(" -verifytol [SECONDS] : How far an output's duration may be from")
+            print("                 the source's. Defaults to 1.")
+            print(" -verifydecode [SECONDS] : Also decode this many seconds at the")
+            print("                 start and end of each output. Defaults to 0 (off).")
+            print(" -verifyjobs [COUNT] : Number of transcodes to check at the same")
+            print("                 time. Defaults to 2.")
+            print("")
+            print("Output Cache OPTIONS:")
+            print("")
+            print(" -cachesize [GB] : Size limit for the output cache, after which the")
+            print("                 least recently used transcodes are thrown out.")
+            print("                 Defaults to 50. 0 means no limit.")
+            print(" -fullhash : Recognize identical sources by hashing their entire")
+            print("                 contents, instead of a sample of blocks.")
+            print("")
+            print("Job Store OPTIONS:")
+            print("")
+            print(" -jobdb [/full/path/to/file.db] : Job store database, which records")
+            print("                 each queued file and how far it got so a restart")
+            print("                 picks up where it left off. Defaults to a file")
+            print("                 next to this script.")
+            print(" -queue : Shows the contents of the job store and exits.")
+            print("")
+            print("Telemetry OPTIONS:")
+            print("")
+            print(" -telemetry [/full/path/to/file.jsonl] : Telemetry log, which gets")
+            print("                 a line of JSON for every job with its sizes,")
+            print("                 timings and outcome. Defaults to a file next to")
+            print("                 this script.")
+            print(" -report : Summarizes the telemetry log - throughput and timings per")
+            print("                 preset, and the slowest jobs - and exits.")
+            print(" -window [HOURS] : How far back -report looks. Defaults to 24.")
+            print("                 0 means everything.")
+            print("")
+            print("Benchmark OPTIONS:")
+            print("")
+            print(" -benchmark : Transcodes synthetic test clips with each selected")
+            print("                 preset (or every preset, if none are selected),")
+            print("                 compares the results with the baseline, and exits.")
+            print(" -baseline [/full/path/to/file.json] : Benchmark baseline. If it")
+            print("                 doesn't exist yet, the results are saved as the")
+            print("                 baseline. Defaults to a file next to this script.")
+            print(" -savebaseline : Replace the baseline with this run's results.")
+            print(" -tolerance [PERCENT] : How much slower, more CPU-hungry or bigger")
+            print("                 a result can be than the baseline before it's")
+            print("                 flagged as a regression. Defaults to 10.")
+            print(" -scalebench [COUNT] : Runs this script against COUNT dummy files")
+            print("                 and stub ffmpeg/ffprobe programs, measures how")
+            print("                 fast it gets through them, and exits. Linux only.")
+            print(" -stubtime [SECONDS] : How long each stub transcode takes in the")
+            print("                 scale benchmark. Defaults to 0.1.")
+            print("")
+            print("Metrics OPTIONS:")
+            print("")
+            print(" -metrics [[ADDRESS:]PORT] : Serve Prometheus metrics at /metrics on")
+            print("                 this port, e.g. '9464' or '127.0.0.1:9464'.")
+            print(" -metricsfile [/full/path/to/file.prom] : Write Prometheus metrics")
+            print("                 to this file every few seconds, for node_exporter's")
+            print("                 textfile collector.")
+            print("")
+            print("Display OPTIONS:")
+            print("")
+            print(" -noprogress : Don't show the progress dashboard - handy when")
+            print("               running as a service. It's also left out when")
+            print("               the output isn't going to a terminal.")
+            print(" -refresh [SECONDS] : How often to redraw the progress")
+            print("               dashboard. Default is 1.")
             print("")
             print("Debugging OPTIONS:")
             print("")
@@ -721,301 +2337,4006 @@ if len(sys.argv) > 1:
             print(" --version : Shows version/Copyright information.")
             print(" -debug : Enable debug logging - all STDOUT is also copied to a")
             print("          log file.")
+            print(" -logsize [MB] : Start a new debug log once it's this big. Old")
+            print("          logs are compressed. Default is 10, 0 means no limit.")
+            print(" -logage [HOURS] : Start a new debug log once it's this old.")
+            print("          Default is 24, 0 means no limit.")
+            print(" -logkeep [COUNT] : Number of old debug logs to keep. Default")
+            print("          is 5.")
             print(" -flog  : Enable ffmpeg output logging - all ffmpeg output is")
-            print("          copied to a log file. NOTE: This log file can become")
-            print("          pretty large over time.")
+            print("          copied to a log file, one per transcode.")
+            print(" -flogdiag : Like -flog, but only ffmpeg's diagnostic lines are")
+            print("          kept - no banner or statistics lines.")
+            print(" -flogdir [/full/path/to/dir] : Where to put ffmpeg logs.")
+            print("          Default is an ffmpeg_logs directory next to the script.")
+            print(" -flogkeep [COUNT] : Number of ffmpeg logs to keep. Default is")
+            print("          50, 0 keeps them all.")
             print("")
             quit()
 
 
-        elif argument.lower() == "--version":
-            # Version info is already done, so just quit.
-            quit()
+        elif argument.lower() == "--version":
+            # Version info is already done, so just quit.
+            quit()
+
+
+        else:
+            # Something got passed to the script that we don't recognize.
+            print("Unrecognized option - please check your command line.")
+            quit()
+
+
+        # Advance the index.
+        index += 1
+
+else:
+    print("No parameters given. Follow with '--help' for usage information.")
+    quit()
+
+
+# Persistent job store - a SQLite table recording every file we've queued and
+# how far it got, so a restart can pick up where the last run left off.
+class JobStore:
+
+    def __init__(self, db_file):
+        # The workers and the monitor loop all write through the one
+        # connection, so take turns.
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_file, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY,"
+            " path TEXT NOT NULL,"        # Full path to the source file
+            " inode INTEGER,"             # Source file's inode and size, so a new
+            " size INTEGER,"              # file with an old name isn't mistaken
+            " preset TEXT,"               # for the old one
+            " state TEXT NOT NULL,"       # queued, running, done, failed or dropped
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " queued_at REAL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " output_path TEXT,"
+            " error TEXT"                 # What went wrong, if it failed
+            ")"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_path ON jobs (path)")
+
+        # Job stores from older versions don't have the error column.
+        try:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN error TEXT")
+        except sqlite3.OperationalError:
+            pass
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            " path TEXT PRIMARY KEY,"     # Full path to the source file
+            " inode INTEGER NOT NULL,"    # Source file's inode, size and mtime
+            " size INTEGER NOT NULL,"     # when it was probed - if any of these
+            " mtime REAL NOT NULL,"       # change, it needs probing again
+            " result TEXT NOT NULL"       # ffprobe's JSON output
+            ")"
+        )
+
+    # Find the most recent job for a file, or None.
+    def find(self, file_path, inode, size):
+        with self.lock:
+            return self.db.execute(
+                "SELECT * FROM jobs WHERE path = ? AND inode = ? AND size = ?"
+                " ORDER BY id DESC LIMIT 1",
+                (file_path, inode, size)).fetchone()
+
+    # Add a newly queued job, returning its id.
+    def add(self, file_path, inode, size, preset):
+        with self.lock:
+            return self.db.execute(
+                "INSERT INTO jobs (path, inode, size, preset, state, queued_at)"
+                " VALUES (?, ?, ?, ?, 'queued', ?)",
+                (file_path, inode, size, preset, time.time())).lastrowid
+
+    # Update some of a job's columns.
+    def update(self, job_id, **columns):
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET {} WHERE id = ?"
+                . format(", " . join("{} = ?" . format(column) for column in columns)),
+                list(columns.values()) + [job_id])
+
+    # Mark a job as running, and count the attempt.
+    def start(self, job_id):
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET state = 'running', started_at = ?,"
+                " attempts = attempts + 1 WHERE id = ?",
+                (time.time(), job_id))
+
+    # Put any jobs that were running when we last stopped back in the queue,
+    # returning how many there were.
+    def requeue_interrupted(self):
+        with self.lock:
+            return self.db.execute(
+                "UPDATE jobs SET state = 'queued', started_at = NULL"
+                " WHERE state = 'running'").rowcount
+
+    # Find a file's cached ffprobe output, or None if it hasn't been probed
+    # since it last changed.
+    def find_probe(self, file_path, inode, size, mtime):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT result FROM probes WHERE path = ? AND inode = ? AND size = ?"
+                " AND mtime = ?", (file_path, inode, size, mtime)).fetchone()
+        return None if row is None else row["result"]
+
+    # Remember a file's ffprobe output.
+    def add_probe(self, file_path, inode, size, mtime, result):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO probes (path, inode, size, mtime, result)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (file_path, inode, size, mtime, result))
+
+    # Forget a file's ffprobe output, once it's been moved or renamed.
+    def remove_probe(self, file_path):
+        with self.lock:
+            self.db.execute("DELETE FROM probes WHERE path = ?", (file_path,))
+
+    # Forget the ffprobe output for files that aren't there any more.
+    def prune_probes(self):
+        with self.lock:
+            paths = [row["path"] for row in self.db.execute("SELECT path FROM probes")]
+            for file_path in paths:
+                if not os.path.isfile(file_path):
+                    self.db.execute("DELETE FROM probes WHERE path = ?", (file_path,))
+
+    # Fetch jobs, optionally only those in a given state, oldest first.
+    def jobs(self, state=None):
+        with self.lock:
+            if state is None:
+                return self.db.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+            return self.db.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id",
+                                   (state,)).fetchall()
+
+
+# Open the job store.
+if job_db == '':
+    job_db = os.path.join(path, os.path.basename(sys.argv[0]) + ".db")
+job_store = JobStore(job_db)
+job_store.prune_probes()
+
+
+# Show the job store's contents if asked, then quit.
+if show_queue:
+    stored_jobs = job_store.jobs()
+    if len(stored_jobs) == 0:
+        print("The job store is empty.")
+    for stored_job in stored_jobs:
+        print("{:>6}  {:<8}  {:<8}  attempts: {}  queued: {}"
+              . format(stored_job["id"], stored_job["state"],
+                       stored_job["preset"] or '', stored_job["attempts"],
+                       time.strftime("%Y-%m-%d %H:%M:%S",
+                                     time.localtime(stored_job["queued_at"]))))
+        print("        {}" . format(stored_job["path"]))
+        if stored_job["output_path"]:
+            for output_path in stored_job["output_path"].split("\n"):
+                print("        -> {}" . format(output_path))
+        if stored_job["error"]:
+            print("        !! {}" . format(stored_job["error"]))
+    quit()
+
+
+# Find the telemetry log.
+if telemetry_file == '':
+    telemetry_file = os.path.join(path, os.path.basename(sys.argv[0]) + ".jobs.jsonl")
+
+# Find (or make) the ffmpeg log directory.
+if save_ffmpeg_output == True:
+    if ffmpeg_log_dir == '':
+        ffmpeg_log_dir = os.path.join(path, "ffmpeg_logs")
+    os.makedirs(ffmpeg_log_dir, exist_ok=True)
+
+
+# Helper function - nearest-rank percentile of a list of numbers.
+def percentile(values, percent):
+    values = sorted(values)
+    return values[max(int(round(percent / 100 * len(values))) - 1, 0)]
+
+
+# Summarize the telemetry log if asked, then quit.
+if show_report:
+
+    # Helper function - seconds as H:MM:SS.
+    def hms(seconds):
+        (minutes, seconds) = divmod(int(seconds), 60)
+        (hours, minutes) = divmod(minutes, 60)
+        return "{}:{:02d}:{:02d}" . format(hours, minutes, seconds)
+
+    records = []
+    if os.path.isfile(telemetry_file):
+        with open(telemetry_file, 'r') as telemetry_log:
+            for line in telemetry_log:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+    if report_window > 0:
+        records = [record for record in records
+                   if record["finished_at"] >= time.time() - report_window * 3600]
+
+    if report_window > 0:
+        print("Transcode report for the last {} hour(s):" . format(report_window))
+    else:
+        print("Transcode report for all recorded jobs:")
+    print("")
+    if len(records) == 0:
+        print("No jobs recorded.")
+        quit()
+
+    for report_preset in sorted(set(record["preset"] for record in records)):
+        preset_records = [record for record in records if record["preset"] == report_preset]
+        encoded = [record for record in preset_records
+                   if record["outcome"] == 'done' and record["encode_time"]]
+        print("{}:" . format(report_preset))
+        print("  Jobs: {} done, {} from cache, {} failed, {} retries"
+              . format(len(encoded),
+                       len([record for record in preset_records if record["outcome"] == 'cached']),
+                       len([record for record in preset_records if record["outcome"] == 'failed']),
+                       len([record for record in preset_records if record["outcome"] == 'retried'])))
+        if len(encoded) == 0:
+            print("")
+            continue
+
+        encode_times = [record["encode_time"] for record in encoded]
+        total_encode = sum(encode_times)
+        total_media = sum(record["duration"] or 0 for record in encoded)
+        total_in = sum(record["source_size"] or 0 for record in encoded)
+        total_out = sum(record["output_size"] or 0 for record in encoded)
+        print("  Throughput: {} of media in {} ({:0.2f}x real time), {:0.1f} MB/s in, {:0.1f} MB/s out"
+              . format(hms(total_media), hms(total_encode), total_media / total_encode,
+                       total_in / total_encode / 1000000, total_out / total_encode / 1000000))
+        print("  Encode time: p50 {}  p90 {}  p99 {}  max {}"
+              . format(hms(percentile(encode_times, 50)), hms(percentile(encode_times, 90)),
+                       hms(percentile(encode_times, 99)), hms(max(encode_times))))
+        speeds = [record["speed"] for record in encoded if record["speed"]]
+        if len(speeds) > 0:
+            print("  Speed: p10 {:0.2f}x  p50 {:0.2f}x  p90 {:0.2f}x"
+                  . format(percentile(speeds, 10), percentile(speeds, 50), percentile(speeds, 90)))
+        waits = [(record["ready_wait"] or 0) + (record["queue_wait"] or 0) for record in encoded]
+        print("  Wait before encode: p50 {}  p90 {}"
+              . format(hms(percentile(waits, 50)), hms(percentile(waits, 90))))
+        print("")
+
+    slowest = sorted((record for record in records if record["encode_time"]),
+                     key=lambda record: record["encode_time"], reverse=True)[:10]
+    print("Slowest jobs:")
+    for record in slowest:
+        print("  {}  {:<8}  {:<7}  {}"
+              . format(hms(record["encode_time"]), record["preset"], record["outcome"],
+                       record["source"]))
+    quit()
+
+
+# Helper function - write stub ffmpeg and ffprobe programs into a directory,
+# for the scale benchmark (and the tests.) The stub ffmpeg reports a
+# one-minute source, sends a few progress reports spread over run_time
+# seconds, then writes an empty output file. The stub ffprobe describes every
+# file as the same one-minute clip.
+def write_stub_tools(stub_dir, run_time):
+
+    with open(os.path.join(stub_dir, "ffmpeg"), 'w') as stub:
+        stub.write("#!{}\n" . format(sys.executable))
+        stub.write(
+            "import sys, time\n"
+            "run_time = {}\n"
+            "sys.stderr.write('  Duration: 00:01:00.00, start: 0.000000, bitrate: 1000 kb/s\\n')\n"
+            "sys.stderr.flush()\n"
+            "steps = max(int(run_time / 0.5), 1)\n"
+            "for step in range(1, steps + 1):\n"
+            "    time.sleep(run_time / steps)\n"
+            "    out_time = 60000000 * step // steps\n"
+            "    sys.stdout.write('frame={{}}\\nfps=60.00\\nbitrate=1000.0kbits/s\\n'\n"
+            "                     'total_size={{}}\\nout_time_us={{}}\\nout_time_ms={{}}\\n'\n"
+            "                     'out_time=00:{{:02d}}:{{:02d}}.000000\\nspeed={{:.2f}}x\\nprogress={{}}\\n'\n"
+            "                     .format(3600 * step // steps, 7500000 * step // steps,\n"
+            "                             out_time, out_time, out_time // 60000000,\n"
+            "                             out_time // 1000000 % 60, 60 / run_time if run_time else 0,\n"
+            "                             'end' if step == steps else 'continue'))\n"
+            "    sys.stdout.flush()\n"
+            "open(sys.argv[-1], 'w').close()\n"
+            . format(run_time))
+
+    with open(os.path.join(stub_dir, "ffprobe"), 'w') as stub:
+        stub.write("#!{}\n" . format(sys.executable))
+        stub.write(
+            "import json\n"
+            "print(json.dumps({'format': {'duration': '60.000000', 'start_time': '0.000000',\n"
+            "                             'format_name': 'matroska,webm'},\n"
+            "                  'streams': [{'codec_type': 'video', 'codec_name': 'mpeg2video'},\n"
+            "                              {'codec_type': 'audio', 'codec_name': 'mp2'}]}))\n")
+    for stub_name in ("ffmpeg", "ffprobe"):
+        os.chmod(os.path.join(stub_dir, stub_name), 0o755)
+
+
+# Run the control-plane scale benchmark if asked, then quit. This starts the
+# script itself as a child process, watching a scratch source directory full
+# of dummy files, with ffmpeg and ffprobe swapped for stubs that take a set
+# time and report progress like the real thing. That shows how the watcher,
+# readiness checks, queue and finalize steps cope with a lot of files, with no
+# real transcoding cost in the way.
+if scalebench_files > 0:
+
+    if not os.path.isdir("/proc/self"):
+        print("The scale benchmark needs /proc to measure the script - it only "
+              "runs on Linux.")
+        quit()
+
+    bench_dir = tempfile.mkdtemp(prefix="autotranscode-scale-")
+    bench_source = os.path.join(bench_dir, "source")
+    bench_dest = os.path.join(bench_dir, "dest")
+    stub_dir = os.path.join(bench_dir, "bin")
+    for bench_path in (bench_source, bench_dest, stub_dir):
+        os.mkdir(bench_path)
+
+    write_stub_tools(stub_dir, stub_time)
+
+    # Fill the source directory with the backlog.
+    print("Creating {} files..." . format(scalebench_files))
+    for file_index in range(scalebench_files):
+        with open(os.path.join(bench_source, "backlog-{:06d}.mkv" . format(file_index)), 'wb') as dummy:
+            dummy.write(b"\0" * 1024)
+
+    # Start the script, with the same settings we were given.
+    telemetry_path = os.path.join(bench_dir, "telemetry.jsonl")
+    child_cmdline = [sys.executable, os.path.abspath(sys.argv[0]),
+                     "-s", bench_source, "-d", bench_dest, "-ffmpeg", stub_dir,
+                     "-jobdb", os.path.join(bench_dir, "jobs.db"), "-telemetry", telemetry_path,
+                     "-jobs", str(worker_count), "-watch", watch_backend,
+                     "-quiet", str(quiet_period)]
+    child_cmdline += ["-" + selected_preset for selected_preset in (selected_presets or ["youtube"])]
+    if not handle_check:
+        child_cmdline.append("-nohandlecheck")
+    if recursive:
+        child_cmdline.append("-recursive")
+    if claim_files:
+        child_cmdline.append("-claim")
+    with open(os.path.join(bench_dir, "console.log"), 'w') as child_console:
+        child = subprocess.Popen(child_cmdline, stdout=child_console, stderr=subprocess.STDOUT)
+
+    # Helper function - the child's CPU time (not counting the stubs) and
+    # peak memory use so far.
+    def child_usage():
+        with open("/proc/{}/stat" . format(child.pid), 'r') as stat_file:
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        cpu_time = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        peak_memory = 0
+        with open("/proc/{}/status" . format(child.pid), 'r') as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    peak_memory = int(line.split()[1]) * 1024
+        return (cpu_time, peak_memory)
+
+    # Helper function - how many files have been finished (and renamed).
+    def processed_count():
+        return sum(1 for entry in os.scandir(bench_source) if entry.name.endswith(".processed"))
+
+    try:
+        # Work through the backlog, giving up if things stall for a minute.
+        print("Working through the backlog...")
+        start_time = time.monotonic()
+        first_done = None
+        last_count = 0
+        last_change = start_time
+        while True:
+            time.sleep(0.5)
+            if child.poll() is not None:
+                raise RuntimeError("the script exited early - see {}"
+                                   . format(os.path.join(bench_dir, "console.log")))
+            count = processed_count()
+            now = time.monotonic()
+            if count > 0 and first_done is None:
+                first_done = now - start_time
+            if count != last_count:
+                (last_count, last_change) = (count, now)
+            if count >= scalebench_files:
+                break
+            if now - last_change > 60:
+                raise RuntimeError("no progress for a minute, with {} of {} files done"
+                                   . format(count, scalebench_files))
+        backlog_time = time.monotonic() - start_time
+        (backlog_cpu, _) = child_usage()
+
+        # Then drop in files one at a time, and see how long each takes to
+        # get picked up and finished.
+        print("Measuring pickup latency...")
+        latencies = []
+        for file_index in range(20):
+            trickle_file = os.path.join(bench_source, "trickle-{:06d}.mkv" . format(file_index))
+            created = time.monotonic()
+            with open(trickle_file, 'wb') as dummy:
+                dummy.write(b"\0" * 1024)
+            while not os.path.exists(trickle_file + ".processed"):
+                if time.monotonic() - created > 60:
+                    raise RuntimeError("{} wasn't picked up within a minute" . format(trickle_file))
+                time.sleep(0.01)
+            latencies.append(time.monotonic() - created - stub_time)
+        (total_cpu, peak_memory) = child_usage()
+
+    except RuntimeError as error:
+        print("Scale benchmark failed: {}." . format(error))
+        child.kill()
+        child.wait()
+        quit()
+
+    child.send_signal(signal.SIGINT)
+    child.wait()
+
+    # The script's own view of how long files waited.
+    waits = []
+    with open(telemetry_path, 'r') as telemetry_log:
+        for line in telemetry_log:
+            record = json.loads(line)
+            waits.append((record["ready_wait"] or 0) + (record["queue_wait"] or 0))
+
+    print("")
+    print("Scale benchmark: {} files, {} worker(s), {}s per stub transcode, {} watcher"
+          . format(scalebench_files, worker_count, stub_time, watch_backend))
+    print("  Backlog: {:0.1f}s total, first file done after {:0.2f}s, {:0.1f} jobs/s"
+          . format(backlog_time, first_done, scalebench_files / backlog_time))
+    print("  Script CPU time: {:0.2f}s for the backlog ({:0.2f}ms per file), {:0.2f}s in all"
+          . format(backlog_cpu, backlog_cpu / scalebench_files * 1000, total_cpu))
+    print("  Script peak memory: {:0.1f} MB" . format(peak_memory / 1000000))
+    print("  Pickup latency (new file to finished, minus stub time): p50 {:0.3f}s  p95 {:0.3f}s  max {:0.3f}s"
+          . format(percentile(latencies, 50), percentile(latencies, 95), max(latencies)))
+    if len(waits) > 0:
+        print("  Wait before transcode (from telemetry): p50 {:0.3f}s  p95 {:0.3f}s"
+              . format(percentile(waits, 50), percentile(waits, 95)))
+
+    shutil.rmtree(bench_dir)
+    quit()
+
+
+# The benchmark transcodes its own test clips (in a scratch directory that's
+# made once the sanity checks are done) with every preset unless some were
+# picked. It doesn't look at real files, so it doesn't need the passthrough
+# check.
+if run_benchmark:
+    source_dir = tempfile.gettempdir()
+    dest_dir = source_dir
+    passthrough = False
+    if cmdline == [] and selected_presets == []:
+        selected_presets = list(presets)
+    if benchmark_baseline == '':
+        benchmark_baseline = os.path.join(path, os.path.basename(sys.argv[0]) + ".baseline.json")
+
+
+# Helper function - work out what ffmpeg will be making - one entry per output
+# file, each with a name, command line, and extension. A custom command line
+# overrides any presets. A single preset gets the container from "-c" if one
+# was given, and several presets each use their own.
+def build_outputs(cmdline, selected_presets, new_ext):
+
+    outputs = []
+    if cmdline != []:
+        outputs.append({"name": "custom", "cmdline": cmdline, "ext": new_ext,
+                        "description": "Custom-defined ffmpeg commandline",
+                        "passthrough": {}})
+    else:
+        for selected_preset in selected_presets:
+            outputs.append({"name": selected_preset,
+                            "cmdline": presets[selected_preset]["cmdline"],
+                            "ext": (new_ext if len(selected_presets) == 1
+                                    else presets[selected_preset]["ext"]),
+                            "description": presets[selected_preset]["description"],
+                            "passthrough": presets[selected_preset].get("passthrough", {})})
+    return outputs
+
+
+# Watch folder - a source directory, where its transcodes go, and what they're
+# transcoded to, along with the files it's keeping an eye on. Every watch
+# folder shares the same workers, so -jobs caps transcodes across all of them.
+class Watch:
+
+    def __init__(self, name, source_dir, dest_dir, storage_dir, file_exts, outputs):
+        # Name, from the config file section ("default" for the one from the
+        # command line and [paths])
+        self.name = name
+
+        # Directories - where to watch, where transcodes go, and where to
+        # move sources once they're done (or '' to rename them)
+        self.source_dir = source_dir
+        self.dest_dir = dest_dir
+        self.storage_dir = storage_dir
+
+        # File extensions to watch for
+        self.file_exts = file_exts
+
+        # What ffmpeg will be making (see build_outputs())
+        self.outputs = outputs
+
+        # Short name of the transcode mode, e.g. "youtube", for the job store
+        # and metrics, and a description for the log
+        self.preset_name = "+" . join(output["name"] for output in outputs)
+        self.trans_mode = " + " . join(output["description"] for output in outputs)
+
+        # Candidate file list - files we've seen but haven't queued yet
+        self.candidates = []
+
+        # Readiness tracker for the candidates - maps each file name to its
+        # last seen (size, modification time, inode), and when that was first
+        # seen
+        self.candidate_stats = {}
+
+        # When each candidate file was first found (by time.monotonic())
+        self.candidate_found = {}
+
+        # Files that are queued or being transcoded, so the monitor loop
+        # doesn't queue the same file twice
+        self.active_files = set()
+
+        # Source files that failed for good and are still in the source
+        # directory, as file name -> (inode, size), so they're skipped unless
+        # they change
+        self.failed_files = {}
+
+        # What the last scan found in each directory under the source
+        # directory, as relative path -> (modification time, watched files,
+        # subdirectories). A directory whose modification time hasn't changed
+        # isn't listed again. The watcher and the main loop can both scan
+        # at once, so it's only touched while holding dir_lock.
+        self.dir_cache = {}
+        self.dir_lock = threading.Lock()
+
+
+# Set up the watch folders - the one from the command line (and [paths]), if
+# there is one, then one per [watch:NAME] section.
+watches = []
+if source_dir != '' or watch_configs == []:
+    watches.append(Watch("default", source_dir, dest_dir, storage_dir, file_exts,
+                         build_outputs(cmdline, selected_presets, new_ext)))
+for watch_config in watch_configs:
+    if "presets" in watch_config:
+        watch_presets = [preset.strip().lower() for preset in watch_config["presets"].split(',')]
+        for watch_preset in watch_presets:
+            if watch_preset not in presets:
+                print("Watch folder '{}' has an unknown preset '{}' - please check your "
+                      "config file." . format(watch_config["name"], watch_preset))
+                quit()
+    else:
+        watch_presets = selected_presets
+    if "extensions" in watch_config:
+        watch_exts = [ext.strip().strip('.').lower() for ext in watch_config["extensions"].split(',')]
+    else:
+        watch_exts = file_exts
+    if "container" in watch_config:
+        watch_ext = watch_config["container"]
+    elif "presets" in watch_config:
+        watch_ext = presets[watch_presets[0]]["ext"]
+    else:
+        watch_ext = new_ext
+    if "custom" in watch_config:
+        watch_cmdline = [watch_config["custom"]]
+    elif "presets" in watch_config:
+        watch_cmdline = []
+    else:
+        watch_cmdline = cmdline
+    watch_outputs = build_outputs(watch_cmdline, watch_presets, watch_ext)
+    watches.append(Watch(watch_config["name"],
+                         watch_config.get("source", ''),
+                         watch_config.get("destination", dest_dir),
+                         watch_config.get("finished", storage_dir),
+                         watch_exts, watch_outputs))
+
+
+# Sanity checks - let's make sure we have some settings.
+for watch in watches:
+    if watch.name == "default":
+        where = ""
+    else:
+        where = " for watch folder '{}'" . format(watch.name)
+    if watch.source_dir == '':
+        print("No source directory{} - please check your command line or config file." . format(where))
+        quit()
+    if watch.dest_dir == '':
+        print("No destination directory{} - please check your command line or config file." . format(where))
+        quit()
+    if not os.path.isdir(watch.source_dir):
+        print("Source directory{} doesn't exist - please check your command line or config file." . format(where))
+        quit()
+    if not os.path.isdir(watch.dest_dir):
+        print("Destination directory{} doesn't exist - please check your command line or config file." . format(where))
+        quit()
+    if watch.storage_dir != '' and not os.path.isdir(watch.storage_dir):
+        print("Transcode storage directory{} doesn't exist - please check your command line or config file." . format(where))
+        quit()
+    # A remote worker is told what to make by the coordinator.
+    if worker_address != '':
+        continue
+    if watch.outputs == []:
+        print("No transcode mode selected{} - please check your command line or config file." . format(where))
+        quit()
+    if watch.outputs[0]["ext"] == '':
+        print("No container selected{} - please check your command line or config file." . format(where))
+        quit()
+if len(set(os.path.realpath(watch.source_dir) for watch in watches)) < len(watches):
+    print("Two watch folders have the same source directory - please check your config file.")
+    quit()
+if coordinator_listen != '' and worker_address != '':
+    print("An instance can be a coordinator or a remote worker, but not both - "
+          "please check your command line or config file.")
+    quit()
+if worker_count == 0 and coordinator_listen == '':
+    print("Job count must be 1 or more, unless remote workers do all the work "
+          "(-coordinator) - please check your command line or config file.")
+    quit()
+if claim_files and watch_backend == 'inotify':
+    print("Shared source directories (-claim) have to be polled, since inotify "
+          "can't see files written by other machines - use '-watch poll' (or "
+          "'auto') instead.")
+    quit()
+if not handle_check and quiet_period == 0:
+    print("The open-file check is disabled but no quiet period is set - files "
+          "could be transcoded while still being written. Please set a quiet "
+          "period with -quiet in your command line or config file.")
+    quit()
+
+
+# More sanity checking - let's make sure we can access programs we need to access.
+if os.name == 'nt':
+    if shutil.which(ffmpeg_location) is None:
+        print("Program 'ffmpeg' not found or not on system's PATH - install the "
+              "application package 'ffmpeg' to install it. Or, use the '-ffmpeg' "
+              "argument to provide a full path to ffmpeg.exe.")
+        quit()
+else:
+    if shutil.which(ffmpeg_location) is None:
+        print("Program 'ffmpeg' not found or not on system's PATH - install the "
+              "package 'ffmpeg' to install it. Or, use the '-ffmpeg' "
+              "argument to provide a full path to ffmpeg.")
+        quit()
+    # We only need fuser if there's no /proc to look through.
+    if not os.path.isdir("/proc/self/fd") and shutil.which("fuser") is None:
+        print("Program 'fuser' not found or not on system's PATH - install the "
+              "package 'psmisc' to install it.")
+        quit()
+
+
+# ffprobe lives alongside ffmpeg. It's used to inspect sources before they're
+# transcoded if it's there, and it's needed to find keyframes for segmented
+# transcoding.
+if os.name == 'nt':
+    ffprobe_location = os.path.join(os.path.dirname(ffmpeg_location), "ffprobe.exe")
+else:
+    ffprobe_location = os.path.join(os.path.dirname(ffmpeg_location), "ffprobe")
+probe_available = shutil.which(ffprobe_location) is not None
+if segment_length > 0 and not probe_available:
+    print("Program 'ffprobe' not found alongside ffmpeg - it's needed for "
+          "segmented transcoding. Install it, or turn segmented transcoding off.")
+    quit()
+
+
+# If there's an output cache, make sure it exists.
+if cache_dir != '' and not os.path.isdir(cache_dir):
+    print("Cache directory doesn't exist - please check your command line or config file.")
+    quit()
+
+
+# Even more sanity checking - check to ensure we have write access to the
+# destination directories.
+for watch in watches:
+    try:
+        with open(os.path.join(watch.dest_dir, "check.tmp"), 'w') as check_file:
+            pass
+        os.remove(os.path.join(watch.dest_dir, "check.tmp"))
+    except:
+        print("Can't write to destination directory '{}' - please check your command line "
+              "or config file, and if it is correct, make sure it's writable by "
+              "root/sudo/admin accounts." . format(watch.dest_dir))
+        quit()
+
+
+# Check to see if we have elevated privileges.
+# Hat tip: "tahoar" at https://stackoverflow.com/questions/2946746/
+if os.name == 'nt':
+    try:
+        # Try to pull a directory listing of the Windows TEMP directory, which
+        # requires administrator rights.
+        temp = os.listdir(os.sep.join([os.environ.get('SystemRoot','C:\\windows'),'temp']))
+    except:
+        print("This script must be run with elevated privileges. Aborting.")
+        quit()
+
+else:
+    # Check to see if the current users is in the sudoers list and running the
+    # script as root.
+    #
+    # NOTE: This will require "sudo" even when running in a root shell!
+    if (not 'SUDO_USER' in os.environ) or (os.geteuid() != 0):
+        print("This script must be run with elevated privileges. Aborting.")
+        quit()
+
+
+# Files reported by the directory watcher, as (watch folder, file name)
+watch_events = queue.Queue()
+
+# Queue of transcode jobs waiting for a worker, as (key, count, job) - see
+# queue_key() for the key. The count keeps jobs with equal keys in order.
+job_queue = queue.PriorityQueue()
+queue_counter = itertools.count()
+
+# Durations (in seconds) of the last hundred probed files to be queued, for
+# guessing where files that couldn't be probed go under "-order shortest"
+probed_durations = collections.deque(maxlen=100)
+
+# Jobs handed out to remote workers, as lease id -> {"job", "host",
+# "expires"}. A lease expires (by time.monotonic()) unless the worker checks
+# in before then.
+leases = {}
+lease_counter = itertools.count(1)
+
+# Claims we hold on sources, as claim file path -> job, and what we've seen of
+# other instances' claims, as claim file path -> (contents, when we first saw
+# them like that).
+held_claims = {}
+claim_sightings = {}
+
+# Hidden directory in each source directory that claim files go in, and this
+# machine's name, for telling whose claim is whose.
+claim_dir_name = ".autotranscode-claims"
+claim_host = socket.gethostname()
+
+# Jobs that are currently being transcoded, for the progress display
+running_jobs = []
+
+# Lock for the list above, and for the watch folders' active and failed files
+state_lock = threading.Lock()
+
+# Lock for anything that writes to the screen or the log files
+log_lock = threading.Lock()
+
+# Directories under the source directories that are never watched, since we
+# put files there ourselves (or another watch folder is watching them)
+skipped_dirs = set()
+
+# inotify file descriptor, if we're using the inotify watcher, the C library
+# it came from, and which watch folder and directory each of its watches is on
+inotify_fd = None
+inotify_libc = None
+inotify_dirs = {}
+
+# Set of (device, inode) pairs for every file some process has open, rebuilt
+# once per pass over the candidate list (Linux only)
+open_files = None
+
+# Progress bar length (one per transcode, on the dashboard)
+bar_length = 20
+
+# Number of lines the dashboard took up on the screen when it was last drawn,
+# so it can be erased before anything else is written
+dashboard_height = 0
+
+# The last few finished jobs' telemetry records, newest first, for the
+# dashboard
+recent_outcomes = collections.deque(maxlen=5)
+
+# Loop delay times (seconds) - how long to wait between directory scans when
+# polling, and between checks on files that aren't ready yet. The wait starts
+# at the minimum, backs off toward the maximum while nothing's changing, and
+# drops back to the minimum as soon as something does.
+loop_delay_min = 0.25
+loop_delay = 5
+
+# Throbber text for progress bar
+if os.name == 'nt':
+    throbber = [
+        "[*.   ]",
+        "[.*.  ]",
+        "[ .*. ]",
+        "[  .*.]",
+        "[   .*]",
+        "[  .*.]",
+        "[ .*. ]",
+        "[.*.  ]",
+        "[*.   ]"
+    ]
+else:
+    throbber = [
+        "[\033[93m*\033[33m*\033[0m   ]",
+        "[\033[33m*\033[93m*\033[33m*\033[0m  ]",
+        "[ \033[33m*\033[93m*\033[33m*\033[0m ]",
+        "[  \033[33m*\033[93m*\033[33m*\033[0m]",
+        "[   \033[33m*\033[93m*\033[0m]",
+        "[  \033[33m*\033[93m*\033[33m*\033[0m]",
+        "[ \033[33m*\033[93m*\033[33m*\033[0m ]",
+        "[\033[33m*\033[93m*\033[33m*\033[0m  ]"
+    ]
+
+# Throbber step for progress bar
+throbber_step = 0
+
+# Functions to call with each progress report from ffmpeg, as (job, progress)
+progress_subscribers = []
+
+
+# Helper REGEX for ffmpeg complaints that might clear up on their own, so a
+# transcode that failed with one of them is worth retrying
+transient_regex = re.compile(
+    r"No space left on device|Disk quota exceeded|Cannot allocate memory|"
+    r"Resource temporarily unavailable|Input/output error|Broken pipe|"
+    r"Connection (timed out|reset|refused)|received signal|Immediate exit requested",
+    re.IGNORECASE
+)
+
+# Helper REGEX for the priority tag in a file's name, "[p0]" through "[p9]"
+priority_regex = re.compile(r"\[p(\d)\]", re.IGNORECASE)
+
+# Helper REGEX for the source duration in ffmpeg's banner. (Progress comes
+# from ffmpeg's "-progress" output instead, which doesn't need a regex.)
+# Hat tip: Werner Robitza :: https://gist.github.com/slhck
+dur_regex = re.compile(
+    r"Duration: (?P<hour>\d{2}):(?P<min>\d{2}):(?P<sec>\d{2})\.(?P<cs>\d{2})"
+)
+
+# Helper REGEX for the lines of ffmpeg's output that are left out of the logs
+# in diagnostics-only mode - the build banner, and periodic statistics lines.
+log_noise_regex = re.compile(
+    r"^(ffmpeg version |built with |configuration: |lib\w+ +\d+\. ?\d+\.|(frame|size)=.*time=)"
+)
+
+
+# Debug log file handler - starts a new log once the current one gets too big
+# or too old, and compresses the old one.
+class LogRotator(logging.handlers.RotatingFileHandler):
+
+    def __init__(self, filename, max_bytes, max_age, backup_count):
+        logging.handlers.RotatingFileHandler.__init__(
+            self, filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.max_age = max_age
+        self.rollover_at = time.time() + max_age
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self.compress
+
+    def shouldRollover(self, record):
+        if (self.max_age > 0 and time.time() >= self.rollover_at
+                and os.path.isfile(self.baseFilename)
+                and os.path.getsize(self.baseFilename) > 0):
+            return True
+        return logging.handlers.RotatingFileHandler.shouldRollover(self, record)
+
+    def doRollover(self):
+        logging.handlers.RotatingFileHandler.doRollover(self)
+        self.rollover_at = time.time() + self.max_age
+
+    @staticmethod
+    def compress(source_file, target_file):
+        with open(source_file, 'rb') as f_in, gzip.open(target_file, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source_file)
+
+
+# Debug log - write_log() hands lines to a queue, and a background thread
+# writes them to the log file, so logging never waits on the disk.
+debug_log = logging.getLogger("auto_transcode")
+debug_log.propagate = False
+debug_log.setLevel(logging.INFO)
+if debug_mode == True:
+    log_handler = LogRotator(os.path.join(path, os.path.basename(sys.argv[0]) + ".log"),
+                             log_size * 1024 * 1024, log_age * 3600, log_keep)
+    log_handler.setFormatter(logging.Formatter("%(message)s"))
+    log_queue = queue.Queue()
+    log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+    log_listener.start()
+    debug_log.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    # Write out whatever's still queued when the script exits.
+    def stop_log_listener():
+        log_listener.stop()
+        log_handler.close()
+    atexit.register(stop_log_listener)
+
+
+# Helper function for logging
+def write_log(log_text, level='INFO'):
+
+    # Several workers may be logging at once, so take turns.
+    with log_lock:
+
+        # Print the log text to the screen, in place of the dashboard.
+        # (Debug lines only go to the log file.)
+        if level != 'DEBUG':
+            clear_dashboard()
+            print("[{0: <5}] {1}" . format(level, log_text))
+
+        # Save to a log file.
+        if debug_mode == True:
+            debug_log.info("[{0: <5}] {1}" . format(level, log_text))
+
+
+# Helper function for converting timestamps to ms
+# Hat tip: Werner Robitza :: https://gist.github.com/slhck
+def to_ms(s=None, des=None, **kwargs) -> float:
+
+    # NOTE: ffmpeg timestamps are HH:MM:SS.cc, with the last field in
+    # hundredths of a second, not milliseconds.
+    if s:
+        hour = int(s[0:2])
+        minute = int(s[3:5])
+        sec = int(s[6:8])
+        ms = int(s[9:11]) * 10
+    else:
+        hour = int(kwargs.get("hour", 0))
+        minute = int(kwargs.get("min", 0))
+        sec = int(kwargs.get("sec", 0))
+        ms = int(kwargs.get("cs", 0)) * 10
+
+    result = (hour * 60 * 60 * 1000) + (minute * 60 * 1000) + (sec * 1000) + ms
+    if des and isinstance(des, int):
+        return round(result, des)
+    return result
+
+
+# Helper function for creating a neat-looking progress bar for one job, with
+# its speed, ETA and output size
+def progress_bar(job, width):
+
+    percentage = job.prog_pct
+
+    # Sanity check - percentage must be 0..100
+    # NOTE: Sometimes transcodes will exceed 100%.
+    if percentage < 0:
+        percentage = 0
+    if percentage > 100:
+        percentage = 100
+
+
+    # Calculate how much of a progress bar should be shown based on the
+    # percentage value.
+    block = int(round(bar_length * (percentage / 100)))
+
+    # Make an empty holder for the remaining time text.
+    remaining_time = '??:??:??'
+
+    # Calculate an ETA based on (current time - start time) extrapolated to 100%
+    # but don't bother if we're below 10% as the calculation will be largely
+    # meaningless in the early part of the job.
+    if percentage >= 10:
+
+        # Get the current time, then the difference from start.
+        current_time = datetime.datetime.now()
+        time_diff = current_time - job.start_time
+
+        # Calculate ETA (well, est. time remaining) from time thus far and
+        # percentage complete.
+        total_time = (time_diff.total_seconds() * 100) / percentage
+        eta = total_time * ((100 - percentage) / 100)
+
+        # Break the ETA down into days/hours/mins/secs, and build display
+        # text based on the results.
+        (days, remainder) = divmod(eta, 86400)
+        (hours, remainder) = divmod(remainder, 3600)
+        (minutes, seconds) = divmod(remainder, 60)   
+        days = int(days)
+        hours = int(hours)
+        minutes = int(minutes)
+        seconds = int(seconds)
+        if eta > 86400:
+            remaining_time = ("{}:{:02d}:{:02d}:{:02d}"
+                              . format(days, hours, minutes, seconds))
+        elif eta > 3600:
+            remaining_time = ("{}:{:02d}:{:02d}"
+                              . format(hours, minutes, seconds))
+        elif eta > 60:
+            remaining_time = "00:{:02d}:{:02d}" . format(minutes, seconds)
+        else:        
+            remaining_time = "{}s" . format(seconds)
+
+    # Fill in what ffmpeg's told us about how it's going.
+    fps_text = speed_text = size_text = '--'
+    if job.progress is not None:
+        if job.progress.fps is not None:
+            fps_text = "{:0.1f}" . format(job.progress.fps)
+        if job.progress.speed is not None:
+            speed_text = "{:0.2f}x" . format(job.progress.speed)
+        if job.progress.total_size is not None:
+            size_text = "{:0.1f} MB" . format(job.progress.total_size / 1048576)
+
+    # Build the progress bar.
+    if os.name == 'nt':
+        bar_text = "[{0}{1}]" . format("#" * block, "-" * (bar_length - block))
+    else:
+        bar_text = ("[\033[42m{0}\033[0m{1}]"
+                    . format(">" * block, "-" * (bar_length - block)))
+
+    # Fit the line to the terminal. On a narrow one, the output size, frame
+    # rate and speed are dropped (in that order), then the file name gets
+    # what's left, down to a minimum. If even that won't fit, the bar goes
+    # too.
+    stats = [("percent", "{:6.2f}%" . format(percentage)),
+             ("fps", "{:>6} fps" . format(fps_text)),
+             ("speed", "{:>7}" . format(speed_text)),
+             ("eta", "ETA {:>8}" . format(remaining_time)),
+             ("size", "{:>10}" . format(size_text))]
+    bar_width = bar_length + 3
+    for dropped in ("size", "fps", "speed", "bar"):
+        stats_width = sum(len(text) + 2 for (_, text) in stats)
+        if 1 + 12 + bar_width + stats_width <= width:
+            break
+        if dropped == "bar":
+            (bar_text, bar_width) = ('', 0)
+        else:
+            stats = [stat for stat in stats if stat[0] != dropped]
+    stats_width = sum(len(text) + 2 for (_, text) in stats)
+    name_width = max(min(30, width - 1 - bar_width - stats_width), 12)
+
+    # We're done, so return the completed progress bar.
+    line = " {0:<{1}.{1}}" . format(job.file, name_width)
+    if bar_text != '':
+        line += " " + bar_text
+    return fit_line(line + "".join("  " + text for (_, text) in stats), width)
+
+
+# Helper function - build the set of files that are open by any process, by
+# walking /proc/*/fd once. This is a lot cheaper than asking fuser about each
+# file in turn. Returns None if there's no /proc to walk.
+def scan_open_files():
+
+    if not os.path.isdir("/proc/self/fd"):
+        return None
+
+    found = set()
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+
+        # Processes come and go while we're looking, so skip any that vanish
+        # or that we're not allowed to inspect.
+        try:
+            with os.scandir(os.path.join("/proc", pid, "fd")) as fds:
+                for fd in fds:
+                    try:
+                        # stat() follows the fd's link to the open file.
+                        fd_stat = os.stat(fd.path)
+                    except OSError:
+                        continue
+                    found.add((fd_stat.st_dev, fd_stat.st_ino))
+        except OSError:
+            continue
+
+    return found
+
+
+# Helper function - check to see if a file is being used by another process.
+def file_is_in_use(watch, file):
+
+    # We'll take one of two approaches to this, depending on the platform.
+
+    if os.name == 'nt':
+
+        # For Windows, we'll try to rename the file to the same name. If it
+        # fails with an error, e.g., access-denied, something's working on/with
+        # the file.
+        try:
+            os.rename(os.path.join(watch.source_dir, file), os.path.join(watch.source_dir, file))
+            return False
+        except:
+            return True
+
+    elif open_files is not None:
+
+        # For Linux, check the file against the open file set that was built
+        # from /proc at the start of this pass.
+        try:
+            file_stat = os.stat(os.path.join(watch.source_dir, file))
+        except OSError:
+            return True
+
+        return (file_stat.st_dev, file_stat.st_ino) in open_files
+
+    else:
+
+        # No /proc, so we'll invoke "fuser" with the "-u" switch to see what
+        # users are accessing the file.
+        is_file_open = subprocess.Popen(
+            ["fuser", "-u", os.path.join(watch.source_dir, file)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=False,
+        )
+        file_users = is_file_open.stdout.read().decode("utf8", errors="replace").strip()
+        is_file_open.wait()
+
+        return (file_users != "")
+
+
+# Helper function - check to see if a file has stopped changing, i.e., its
+# size, modification time and inode have stayed the same for at least the
+# quiet period.
+def file_is_settled(watch, file):
+
+    try:
+        file_stat = os.stat(os.path.join(watch.source_dir, file))
+    except OSError:
+        return False
+
+    signature = (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+    now = time.monotonic()
+
+    # If this is new, or it's changed since we last looked, start the clock.
+    if file not in watch.candidate_stats or watch.candidate_stats[file][0] != signature:
+        watch.candidate_stats[file] = (signature, now)
+
+    return now - watch.candidate_stats[file][1] >= quiet_period
+
+
+# Helper function - where a source's claim file goes. Claim files mirror the
+# source's path, in a hidden directory in its watch folder's source directory
+# (so they're on the same share, and never mistaken for sources.)
+def claim_path(watch, file):
+
+    return os.path.join(watch.source_dir, claim_dir_name, file + ".claim")
+
+
+# Helper function - read a claim file. Returns its contents, or None if
+# there's no claim.
+def read_claim(path):
+
+    try:
+        with open(path, 'r') as claim_file:
+            return claim_file.read()
+    except OSError:
+        return None
+
+
+# Helper function - check to see if a process on this machine is still
+# running. (Windows can't be asked without opening the process, so we just
+# assume it is.)
+def process_is_running(pid):
+
+    if os.name == 'nt':
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+# Helper function - check to see if another instance has a live claim on a
+# file. A claim is dead once we've seen it go lease_time without being renewed
+# - timed by our own clock, so the machines' clocks don't have to agree - or
+# straight away if it belongs to a process on this machine that's gone.
+def source_is_claimed(watch, file):
+
+    path = claim_path(watch, file)
+    contents = read_claim(path)
+    now = time.monotonic()
+
+    with state_lock:
+        if contents is None:
+            claim_sightings.pop(path, None)
+            return False
+        if path not in claim_sightings or claim_sightings[path][0] != contents:
+            claim_sightings[path] = (contents, now)
+        seen_since = claim_sightings[path][1]
+
+    try:
+        claim = json.loads(contents)
+        if claim["host"] == claim_host and not process_is_running(claim["pid"]):
+            return False
+    except (ValueError, KeyError, TypeError):
+        pass
+
+    return now - seen_since < lease_time
+
+
+# Helper function - claim a job's source before working on it, taking over a
+# dead claim if there is one. Claim files are created with O_EXCL, which the
+# share does atomically, so only one instance can get the claim. Returns True
+# if we got it.
+def claim_source(job):
+
+    path = claim_path(job.watch, job.file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    claim = {"host": claim_host, "pid": os.getpid(), "token": os.urandom(8).hex(),
+             "claimed": time.time(), "renewed": time.time()}
+
+    for attempt in range(2):
+        try:
+            claim_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            if attempt > 0 or source_is_claimed(job.watch, job.file):
+                return False
+
+            # It's dead, so move it out of the way. Renaming is atomic too, so
+            # if another instance is doing the same, only one of us gets it -
+            # and if what we got isn't what we judged dead, put it back.
+            dead_contents = claim_sightings.get(path, (None, 0))[0]
+            stale_path = "{}.{}.stale" . format(path, claim["token"])
+            try:
+                os.rename(path, stale_path)
+            except FileNotFoundError:
+                continue
+            if dead_contents is not None and read_claim(stale_path) != dead_contents:
+                os.rename(stale_path, path)
+                return False
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+            write_log("  Taking over a dead claim on {}..." . format(job.file), "WARN")
+            continue
+
+        with os.fdopen(claim_fd, 'w') as claim_file:
+            json.dump(claim, claim_file)
+
+        job.claim = claim
+        job.claim_lost = False
+        with state_lock:
+            held_claims[path] = job
+        return True
+
+    return False
+
+
+# Helper function - renew our claim on a job's source, so other instances can
+# see we're still working on it. If another instance has taken it over, the
+# job's ffmpeg is stopped. Returns True if the claim is still ours (or we
+# aren't claiming files.)
+def renew_claim(job):
+
+    if job.claim_lost:
+        return False
+    if job.claim is None:
+        return True
+
+    path = claim_path(job.watch, job.file)
+    try:
+        current = json.loads(read_claim(path) or "{}")
+    except ValueError:
+        current = {}
+
+    if current.get("token") != job.claim["token"]:
+        with state_lock:
+            held_claims.pop(path, None)
+        job.claim = None
+        job.claim_lost = True
+        job.cancel.set()
+        write_log("  Another instance took over {} - stopping it." . format(job.file), "WARN")
+        return False
+
+    # Rewrite it in place (without O_CREAT, so a claim that's just been
+    # taken away isn't brought back.)
+    job.claim["renewed"] = time.time()
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_TRUNC), 'w') as claim_file:
+        json.dump(job.claim, claim_file)
+    return True
+
+
+# Helper function - give up our claim on a job's source, once we're done with
+# it one way or another. Empty claim subdirectories are tidied up too.
+def release_claim(job):
+
+    if job.claim is None:
+        return
+
+    path = claim_path(job.watch, job.file)
+    with state_lock:
+        held_claims.pop(path, None)
+
+    try:
+        current = json.loads(read_claim(path) or "{}")
+    except ValueError:
+        current = {}
+    if current.get("token") == job.claim["token"]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    job.claim = None
+
+    claim_root = os.path.join(job.watch.source_dir, claim_dir_name)
+    claim_subdir = os.path.dirname(path)
+    while claim_subdir != claim_root:
+        try:
+            os.rmdir(claim_subdir)
+        except OSError:
+            break
+        claim_subdir = os.path.dirname(claim_subdir)
+
+
+# Worker thread - renews the claims we hold a few times per lease.
+def claim_renewer():
+
+    while True:
+        time.sleep(lease_time / 4)
+
+        with state_lock:
+            claimed_jobs = list(held_claims.values())
+
+        for job in claimed_jobs:
+            try:
+                renew_claim(job)
+            except OSError as error:
+                write_log("  Couldn't renew the claim on {} ({})." . format(job.file, error), "WARN")
+
+
+# inotify constants, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+
+# Helper function - does a file name have one of the extensions a watch folder
+# watches for?
+def is_watched_file(watch, file):
+
+    file_name, file_ext = os.path.splitext(file)
+    return file_ext.lower().strip('.') in watch.file_exts
+
+
+# Helper function - is this a directory under a source directory that we
+# shouldn't look in? Hidden directories are skipped, as are the destination,
+# storage, quarantine and cache directories (and other watch folders) if
+# they're in there.
+def is_skipped_dir(dir_path):
+
+    return os.path.basename(dir_path).startswith('.') or os.path.realpath(dir_path) in skipped_dirs
+
+
+# Helper function - list the watched files currently in a watch folder's
+# source directory, as paths relative to it. With -recursive, subdirectories
+# are searched too, starting from top (relative to the source directory). A
+# subdirectory that hasn't changed since the last scan is taken from the
+# watch folder's dir_cache rather than listed again.
+def scan_source_dir(watch, top=''):
+
+    if not recursive:
+        return [file for file in os.listdir(watch.source_dir) if is_watched_file(watch, file)]
+
+    with watch.dir_lock:
+        files = []
+        seen_dirs = set()
+        pending_dirs = [top]
+        while len(pending_dirs) > 0:
+            rel_dir = pending_dirs.pop()
+            seen_dirs.add(rel_dir)
+            full_dir = os.path.join(watch.source_dir, rel_dir)
+
+            try:
+                dir_mtime = os.stat(full_dir).st_mtime_ns
+            except OSError:
+                continue
+
+            cached = watch.dir_cache.get(rel_dir)
+            if cached is not None and cached[0] == dir_mtime:
+                (_, dir_files, subdirs) = cached
+            else:
+                dir_files = []
+                subdirs = []
+                try:
+                    with os.scandir(full_dir) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                if not is_skipped_dir(entry.path):
+                                    subdirs.append(os.path.join(rel_dir, entry.name))
+                            elif is_watched_file(watch, entry.name):
+                                dir_files.append(os.path.join(rel_dir, entry.name))
+                except OSError:
+                    continue
+
+                # Modification times can be coarse, so a directory that
+                # changed very recently could change again without its time
+                # moving on. Don't trust the cache for it until it's been
+                # quiet a moment.
+                if time.time_ns() - dir_mtime < 2000000000:
+                    dir_mtime = None
+                watch.dir_cache[rel_dir] = (dir_mtime, dir_files, subdirs)
+
+            files.extend(dir_files)
+            pending_dirs.extend(subdirs)
+
+        # Forget about directories that have gone away.
+        if top == '':
+            for rel_dir in list(watch.dir_cache):
+                if rel_dir not in seen_dirs:
+                    del watch.dir_cache[rel_dir]
+
+        return files
+
+
+# Helper function - find which watch folder a file is in. Returns the watch
+# folder and the file's path relative to its source directory, or (None,
+# None) if it isn't in any of them (or, without -recursive, is in a
+# subdirectory).
+def locate_source(file_path):
+
+    # Look in the deepest source directories first, in case one watch folder
+    # is inside another.
+    for watch in sorted(watches, key=lambda watch: -len(os.path.normpath(watch.source_dir))):
+        file = os.path.relpath(os.path.normpath(file_path), os.path.normpath(watch.source_dir))
+        if file.startswith(os.pardir) or (not recursive and os.path.dirname(file) != ''):
+            continue
+        return (watch, file)
+
+    return (None, None)
+
+
+# Helper function - add an inotify watch on a directory under a watch folder's
+# source directory (and, with -recursive, everything under it.)
+def inotify_watch(inotify_fd, watch, rel_dir):
+
+    # We only care about files that have been closed after writing, or moved
+    # into the directory - either way, the writer is done with them. New
+    # subdirectories need watching too.
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO
+    if recursive:
+        mask |= IN_CREATE
+
+    watch_descriptor = inotify_libc.inotify_add_watch(inotify_fd,
+                                                      os.fsencode(os.path.join(watch.source_dir, rel_dir)),
+                                                      mask)
+    if watch_descriptor < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    inotify_dirs[watch_descriptor] = (watch, rel_dir)
+
+    if recursive:
+        with os.scandir(os.path.join(watch.source_dir, rel_dir)) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and not is_skipped_dir(entry.path):
+                    try:
+                        inotify_watch(inotify_fd, watch, os.path.join(rel_dir, entry.name))
+                    except OSError as error:
+                        write_log("Can't watch directory {} ({})."
+                                  . format(os.path.join(rel_dir, entry.name), error), "WARN")
+
+
+# Helper function - set up inotify watches on the source directories. Returns
+# the inotify file descriptor, or raises OSError if inotify isn't available.
+def inotify_open():
+
+    global inotify_libc
+
+    if not sys.platform.startswith("linux"):
+        raise OSError("inotify is only available on Linux")
+
+    inotify_libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+
+    inotify_fd = inotify_libc.inotify_init1(IN_CLOEXEC)
+    if inotify_fd < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+    try:
+        for watch in watches:
+            inotify_watch(inotify_fd, watch, '')
+    except OSError:
+        os.close(inotify_fd)
+        raise
+
+    return inotify_fd
+
+
+# Watcher thread (inotify backend) - reports files as soon as the writer
+# closes them or they're moved into a source directory. With -recursive,
+# new subdirectories are watched as they show up.
+def inotify_watcher(inotify_fd):
+
+    while True:
+
+        # Block until there's at least one event.
+        events = os.read(inotify_fd, 65536)
+
+        # Each event is a header (watch descriptor, mask, cookie, name
+        # length) followed by a NUL-padded file name.
+        offset = 0
+        while offset < len(events):
+            watch_descriptor, mask, _, name_length = struct.unpack_from("iIII", events, offset)
+            offset += struct.calcsize("iIII")
+            name = os.fsdecode(events[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                # The kernel dropped events, so fall back to a full scan.
+                for watch in watches:
+                    try:
+                        for file in scan_source_dir(watch):
+                            watch_events.put((watch, file))
+                    except OSError as error:
+                        write_log("Can't list source directory '{}' ({})."
+                                  . format(watch.source_dir, error), "WARN")
+            elif mask & IN_IGNORED:
+                # The directory's gone, and its watch with it.
+                inotify_dirs.pop(watch_descriptor, None)
+            elif watch_descriptor not in inotify_dirs:
+                continue
+            elif mask & IN_ISDIR:
+                # A new subdirectory - watch it, and pick up anything that
+                # was put in it before the watch was set up.
+                (watch, parent_dir) = inotify_dirs[watch_descriptor]
+                rel_dir = os.path.join(parent_dir, name)
+                full_dir = os.path.join(watch.source_dir, rel_dir)
+                if (recursive and os.path.isdir(full_dir) and not os.path.islink(full_dir)
+                        and not is_skipped_dir(full_dir)):
+                    try:
+                        inotify_watch(inotify_fd, watch, rel_dir)
+                    except OSError as error:
+                        write_log("Can't watch directory {} ({})."
+                                  . format(rel_dir, error), "WARN")
+                    for file in scan_source_dir(watch, rel_dir):
+                        watch_events.put((watch, file))
+            else:
+                (watch, parent_dir) = inotify_dirs[watch_descriptor]
+                if is_watched_file(watch, name):
+                    watch_events.put((watch, os.path.join(parent_dir, name)))
+
+
+# Watcher thread (polling backend) - lists the source directories every so
+# often and reports what it finds.
+def poll_watcher():
+
+    delay = loop_delay_min
+    last_files = None
+    unreachable = set()
+    while True:
+        files = []
+        for watch in watches:
+
+            # A source directory can go missing for a while, e.g. while a
+            # network share is remounted. Say so once, and keep trying.
+            try:
+                found = scan_source_dir(watch)
+            except OSError as error:
+                if watch not in unreachable:
+                    write_log("Can't list source directory '{}' ({}) - trying again shortly."
+                              . format(watch.source_dir, error), "WARN")
+                    unreachable.add(watch)
+                continue
+            if watch in unreachable:
+                write_log("Source directory '{}' is back." . format(watch.source_dir), "INFO")
+                unreachable.discard(watch)
+
+            for file in found:
+                watch_events.put((watch, file))
+                files.append((watch, file))
+
+        # Scan again soon if the directory changed, otherwise back off. (No
+        # rush while a directory's missing.)
+        if len(unreachable) > 0:
+            delay = loop_delay
+        elif set(files) != last_files:
+            delay = loop_delay_min
+        else:
+            delay = min(delay * 2, loop_delay)
+        last_files = set(files)
+        time.sleep(delay)
+
+
+# Watcher thread - runs one of the directory watchers. If it stops for
+# whatever reason, the main loop is handed the error, so the script exits and
+# says why rather than sitting there waiting for files it'll never hear about.
+def run_watcher(watcher_function, *args):
+
+    try:
+        watcher_function(*args)
+    except Exception as error:
+        write_log("*** ERROR! The directory watcher has stopped - exiting.", "ERROR")
+        write_log(traceback.format_exc(), "ERROR")
+        watch_events.put(error)
+
+
+# Transcode job - everything a worker needs to know about one file.
+class TranscodeJob:
+
+    def __init__(self, watch, file, job_id):
+        # Watch folder the file was found in
+        self.watch = watch
+
+        # Source file name (relative to the watch folder's source directory)
+        self.file = file
+
+        # Job store id
+        self.job_id = job_id
+
+        # Set if the job store says this file was already transcoded, and
+        # only needs moving/renaming
+        self.encoded = False
+
+        # Expanded ffmpeg command line for this file
+        self.cmdline = []
+
+        # Full paths to the transcoded files, one per output
+        self.dest_files = []
+
+        # Source duration in ms, once ffmpeg reports it
+        self.total_dur = None
+
+        # Transcode progress, in percent
+        self.prog_pct = 0
+
+        # Start time for ETA estimation
+        self.start_time = None
+
+        # When ffmpeg finished, so the encode time leaves out verification
+        self.encode_end = None
+
+        # Latest progress report from ffmpeg
+        self.progress = None
+
+        # What ffprobe found out about the source, if anything
+        self.media = None
+
+        # When the job was queued, for measuring how long it waited
+        self.queued_at = time.monotonic()
+
+        # Seconds between the file turning up and being queued, and between
+        # being queued and a worker picking it up
+        self.ready_wait = None
+        self.queue_wait = None
+
+        # CPU time used by ffmpeg, in seconds, if the OS can tell us
+        self.cpu_time = None
+
+        # Streams ("video" and/or "audio") to copy instead of transcoding,
+        # one set per output
+        self.passthrough = []
+
+        # Number of times we've tried to transcode it in this run
+        self.attempts = 0
+
+        # The last few lines of ffmpeg's diagnostic output, for working out
+        # why it failed
+        self.error_tail = collections.deque(maxlen=20)
+
+        # Output cache key, if there's an output cache
+        self.cache_key = None
+
+        # Set to stop the job's ffmpeg, e.g. when a remote worker loses its
+        # lease
+        self.cancel = threading.Event()
+
+        # What we wrote in the source's claim file, while we hold a claim on
+        # it, and whether another instance has since taken it over
+        self.claim = None
+        self.claim_lost = False
+
+
+# Media info - what ffprobe found out about a source file.
+class MediaInfo:
+
+    def __init__(self, probe):
+
+        source_format = probe.get("format", {})
+
+        # Every stream, as ffprobe describes them
+        self.streams = probe.get("streams", [])
+
+        # Container format name(s), e.g. "mov,mp4,m4a,3gp,3g2,mj2"
+        self.format_name = source_format.get("format_name")
+
+        # Duration in ms, and start time in seconds
+        try:
+            self.duration = float(source_format["duration"]) * 1000
+        except (KeyError, ValueError):
+            self.duration = None
+        try:
+            self.start_time = float(source_format.get("start_time", 0))
+        except ValueError:
+            self.start_time = 0.0
+
+        # The first video stream (ignoring cover art) and first audio stream
+        self.video = None
+        self.audio = None
+        for stream in self.streams:
+            if (self.video is None and stream.get("codec_type") == "video"
+                    and not stream.get("disposition", {}).get("attached_pic")):
+                self.video = stream
+            elif self.audio is None and stream.get("codec_type") == "audio":
+                self.audio = stream
+
+        # Video details
+        self.video_codec = None
+        self.width = None
+        self.height = None
+        self.frame_rate = None
+        if self.video is not None:
+            self.video_codec = self.video.get("codec_name")
+            self.width = self.video.get("width")
+            self.height = self.video.get("height")
+            (numerator, _, denominator) = self.video.get("avg_frame_rate", "0/0").partition("/")
+            try:
+                self.frame_rate = float(numerator) / float(denominator or 1)
+            except (ValueError, ZeroDivisionError):
+                self.frame_rate = None
+
+        # Audio details
+        self.audio_codec = None
+        if self.audio is not None:
+            self.audio_codec = self.audio.get("codec_name")
+
+
+# Progress report - one block of ffmpeg's "-progress" output. Fields ffmpeg
+# reports as "N/A" (or doesn't report at all) are None.
+class FfmpegProgress:
+
+    def __init__(self, fields):
+
+        def number(key, convert=float, suffix=''):
+            value = fields.get(key, "N/A").strip()
+            if suffix != '' and value.endswith(suffix):
+                value = value[:-len(suffix)]
+            try:
+                return convert(value)
+            except ValueError:
+                return None
+
+        # Frames encoded so far
+        self.frame = number("frame", int)
+
+        # Encoding rate, in frames per second
+        self.fps = number("fps")
+
+        # Output bitrate, in kbit/s
+        self.bitrate = number("bitrate", suffix="kbits/s")
+
+        # Output written so far, in bytes
+        self.total_size = number("total_size", int)
+
+        # Position in the output, in ms. (Despite its name, ffmpeg's
+        # "out_time_ms" is in microseconds too, so use "out_time_us".)
+        self.out_time = number("out_time_us")
+        if self.out_time is not None:
+            self.out_time /= 1000
+        elif "out_time" in fields and fields["out_time"][:1].isdigit():
+            self.out_time = to_ms(fields["out_time"])
+
+        # Encoding speed, as a multiple of real time
+        self.speed = number("speed", suffix="x")
+
+        # Set on the last report, once ffmpeg has finished
+        self.finished = fields.get("progress") == "end"
+
+        # The report as ffmpeg sent it, for passing on to a coordinator
+        self.fields = dict(fields)
+
+
+# Helper function - expand the ffmpeg command line for a job, writing to the
+# given destination files (one per output), by performing token replacement
+# as required. With several outputs, the input half of the command line (up
+# to and including "-i %SOURCEFILE%") comes from the first output, and each
+# output adds its own settings and destination file after it. ffmpeg decodes
+# the source once and hands the frames to every output. Any extra input
+# settings, e.g., seeking, go right before the source file.
+def expand_cmdline(job, dest_files, input_settings=()):
+
+    # Start with ffmpeg itself.
+    expanded = [ffmpeg_location]
+
+    for output_index, output in enumerate(job.watch.outputs):
+
+        # Skip the shared input settings for every output but the first.
+        entries = output["cmdline"]
+        if output_index > 0:
+            input_end = [index for index, entry in enumerate(entries)
+                         if "%SOURCEFILE%" in entry][0]
+            entries = entries[input_end + 1:]
+
+        # Streams to copy instead of transcoding for this output.
+        copy_streams = job.passthrough[output_index] if job.passthrough else set()
+        if output_index > 0:
+            expanded.extend(stream_copy_options(copy_streams))
+
+        for entry in entries:
+
+            is_input = output_index == 0 and "%SOURCEFILE%" in entry
+            if is_input:
+                expanded.extend(input_settings)
+
+            # Leave out settings for streams that are being copied.
+            option = entry.split(" ", 1)[0]
+            if (("video" in copy_streams and option in video_options)
+                    or ("audio" in copy_streams and option in audio_options)):
+                continue
+
+            #entry = entry.replace("%FFMPEG%", ffmpeg_location)
+            entry = entry.replace("%SOURCEFILE%", '"' + os.path.join(job.watch.source_dir, job.file) + '"')
+            entry = entry.replace("%DESTFILE%", '"' + dest_files[output_index] + '"')
+            entry = entry.replace("%SPATH%", job.watch.source_dir)
+            entry = entry.replace("%DPATH%", job.watch.dest_dir)
+            entry = entry.replace("%NEWEXT%", output["ext"])
+
+            expanded.append(entry)
+
+            if is_input:
+                expanded.extend(stream_copy_options(copy_streams))
+
+    return expanded
+
+
+# Helper function - the ffmpeg settings for copying the given streams.
+def stream_copy_options(copy_streams):
+
+    options = []
+    if "video" in copy_streams:
+        options.append("-c:v copy")
+    if "audio" in copy_streams:
+        options.append("-c:a copy")
+    return options
+
+
+# Helper function - check a probed stream against a preset's passthrough rules
+# for that kind of stream.
+def stream_conforms(stream, rules):
+
+    if stream is None or not rules:
+        return False
+
+    for (field, allowed) in rules.items():
+
+        # Work out the stream's value for this rule. ffprobe reports frame
+        # rates as fractions and some numbers as strings.
+        value = stream.get(field)
+        try:
+            if field == "frame_rate":
+                (numerator, _, denominator) = stream.get("avg_frame_rate", "0/0").partition("/")
+                value = round(float(numerator) / float(denominator or 1), 2)
+            elif field in ("width", "height", "level", "bit_rate", "sample_rate", "channels"):
+                value = int(value)
+        except (TypeError, ValueError, ZeroDivisionError):
+            return False
+        if value is None:
+            return False
+
+        if callable(allowed):
+            if not allowed(value):
+                return False
+        elif value not in allowed:
+            return False
+
+    return True
+
+
+# Helper function - work out which of the source's streams can be copied
+# straight into each output instead of being transcoded.
+def plan_passthrough(job):
+
+    job.passthrough = []
+    for output in job.watch.outputs:
+        copy_streams = set()
+        if passthrough and job.media is not None:
+            if stream_conforms(job.media.video, output["passthrough"].get("video")):
+                copy_streams.add("video")
+            if stream_conforms(job.media.audio, output["passthrough"].get("audio")):
+                copy_streams.add("audio")
+        job.passthrough.append(copy_streams)
+
+
+# Helper function - work out the job's destination files and build its
+# ffmpeg command line.
+def build_cmdline(job):
+
+    # Split off the filename into root name and extension (we don't care
+    # about the extension).
+    file_name, _ = os.path.splitext(job.file)
+
+    output_exts = [output["ext"] for output in job.watch.outputs]
+
+    job.dest_files = []
+    for output in job.watch.outputs:
+
+        # If two outputs use the same container, tell them apart by preset
+        # name, e.g., "clip.dnxhr.mov" and "clip.prores.mov".
+        if output_exts.count(output["ext"]) > 1:
+            job.dest_files.append(os.path.join(job.watch.dest_dir, file_name + "." + output["name"] + "." + output["ext"]))
+        else:
+            job.dest_files.append(os.path.join(job.watch.dest_dir, file_name + "." + output["ext"]))
+
+    plan_passthrough(job)
+    job.cmdline = expand_cmdline(job, job.dest_files)
+
+
+# Helper function - redraw the progress dashboard: the queue, every running
+# job, and the most recent finished jobs.
+def show_progress():
+
+    # Fetch the global dashboard vars - we're using globals so they retain
+    # their values outside this function.
+    global dashboard_height, throbber_step
+
+    with state_lock:
+        jobs = list(running_jobs)
+    queued = job_queue.qsize()
+
+    # Nothing to show if nothing's happening.
+    if len(jobs) == 0 and queued == 0:
+        with log_lock:
+            clear_dashboard()
+        return
+
+    # A header line with the queue, a line per job, then what's finished
+    # lately. (The "\033[?25l" at the end turns the cursor off so it doesn't
+    # blink at the end of the dashboard.)
+    # Every line is cut to fit the terminal, since a line that wraps would
+    # throw off how far up the next redraw has to go.
+    width = shutil.get_terminal_size().columns - 1
+    lines = [fit_line("{0}  {1} transcoding, {2} queued, {3} waiting to settle"
+                      . format(throbber[throbber_step], len(jobs), queued,
+                               sum(len(watch.candidates) for watch in watches)), width)]
+    lines.extend(progress_bar(job, width) for job in jobs)
+    if len(recent_outcomes) > 0:
+        lines.append(fit_line(" Recent: " + ", " . join(
+            "{} ({})" . format(os.path.basename(record["source"]), record["outcome"])
+            for record in recent_outcomes), width))
+    dashboard_text = "\n" . join(lines) + "\n"
+    if os.name != 'nt':
+        dashboard_text += "\033[?25l"
+
+    # Handle throbber text, which is basically changing a step counter.
+    throbber_step += 1
+    if throbber_step >= len(throbber):
+       throbber_step = 0
+
+    with log_lock:
+        clear_dashboard()
+        sys.stdout.write(dashboard_text)
+        sys.stdout.flush()
+        dashboard_height = len(lines)
+
+
+# Helper function - cut a dashboard line down to a given number of columns.
+# Color codes don't take up any columns, so they're skipped when counting
+# (and the color's reset after a cut, in case it was cut off mid-color.)
+def fit_line(line, width):
+
+    visible = 0
+    index = 0
+    while index < len(line):
+        if line.startswith("\033[", index):
+            index = line.index("m", index) + 1
+            continue
+        if visible == width:
+            return line[:index] + ("\033[0m" if "\033[" in line else "")
+        visible += 1
+        index += 1
+    return line
+
+
+# Helper function - erase the dashboard, so something else can be written in
+# its place. The caller must hold log_lock.
+def clear_dashboard():
+
+    global dashboard_height
+
+    if dashboard_height > 0:
+        sys.stdout.write("\033[{}F\033[J" . format(dashboard_height))
+        dashboard_height = 0
+
+
+# Helper function - redraw the dashboard every so often. Runs on its own
+# thread, so progress reports from ffmpeg don't have to wait on the screen.
+def dashboard_updater():
+
+    while True:
+        time.sleep(dashboard_refresh)
+        show_progress()
+
+
+# Helper function - make sure a file's contents (or a directory's entries) are
+# actually on disk, not just in the OS's write cache.
+def sync_file(file_path):
+
+    # Directories can't be opened on Windows, and don't need syncing there.
+    if os.path.isdir(file_path):
+        if os.name == 'nt':
+            return
+        sync_fd = os.open(file_path, os.O_RDONLY)
+    else:
+        sync_fd = os.open(file_path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(sync_fd)
+    finally:
+        os.close(sync_fd)
+
+
+# Helper function - move or rename a file, then check that it really moved.
+# If the target is on another filesystem, the file is copied and synced
+# before the original is removed.
+def move_file(source_file, target_file):
+
+    try:
+        os.rename(source_file, target_file)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        shutil.copy2(source_file, target_file)
+        sync_file(target_file)
+        os.remove(source_file)
+
+    # Make the change stick, then make sure it did what it should have.
+    sync_file(os.path.dirname(target_file))
+    if os.path.dirname(source_file) != os.path.dirname(target_file):
+        sync_file(os.path.dirname(source_file))
+    if not os.path.isfile(target_file) or os.path.lexists(source_file):
+        raise OSError("Moving {} to {} didn't take." . format(source_file, target_file))
+
+
+# Helper function - move the source file to storage if a storage directory is
+# provided. If not, rename the file.
+def finalize_source(job):
+
+    finalize_start = time.monotonic()
+
+    if job.watch.storage_dir != '':
+
+        # We'll be moving it.
+        write_log("  Moving source file {} to dir '{}'..." . format(job.file, job.watch.storage_dir), "INFO")
+
+        # Do the thing!
+        os.makedirs(os.path.dirname(os.path.join(job.watch.storage_dir, job.file)), exist_ok=True)
+        move_file(os.path.join(job.watch.source_dir, job.file),
+                  os.path.join(job.watch.storage_dir, job.file))
+
+    else:
+        # We'll be renaming it.
+        write_log("  Renaming source file {}..." . format(job.file), "INFO")
+
+        # Do the thing!
+        move_file(os.path.join(job.watch.source_dir, job.file),
+                  os.path.join(job.watch.source_dir, job.file + ".processed"))
+
+    # The source is gone from where it was probed, so forget the probe.
+    job_store.remove_probe(os.path.join(job.watch.source_dir, job.file))
+
+    metrics.observe("autotranscode_phase_duration_seconds",
+                    time.monotonic() - finalize_start, phase="finalize")
+
+    # Aaaaand done.
+    write_log("  Processing of {} complete." . format(job.file), "INFO")
+
+    # Pad out the log with an empty line.
+    write_log("", "INFO")
+
+
+# Helper function - pass a job's latest progress report to everything that's
+# subscribed to progress reports.
+def publish_progress(job, progress):
+
+    job.progress = progress
+    for subscriber in progress_subscribers:
+        subscriber(job, progress)
+
+
+# Helper function - add CPU time used by one of a job's ffmpegs to the job's
+# total.
+def add_cpu_time(job, cpu_time):
+
+    with state_lock:
+        job.cpu_time = (job.cpu_time or 0) + cpu_time
+
+
+# Helper function - run ffmpeg with the given command line until it finishes.
+# ffmpeg's "-progress -" reports come in on stdout, and are handed to the
+# on_progress callback as an FfmpegProgress, one per report. Everything else
+# ffmpeg says goes to stderr, which is read on its own thread, echoed to the
+# ffmpeg log (if there is one), and checked for the source duration (in ms),
+# which goes to the on_duration callback. The CPU time ffmpeg used (in
+# seconds) goes to the on_usage callback, if there is one and the OS can tell
+# us. If error_tail (a deque) is given, the diagnostic lines are added to it
+# too. Returns ffmpeg's return code.
+def run_ffmpeg(ffmpeg_cmdline, f_log, log_prefix, on_duration, on_progress, on_usage=None,
+               error_tail=None, cancel=None):
+
+    # Launch ffmpeg. Outside Windows, the shell hands over to it with exec, so
+    # stopping the process stops ffmpeg itself rather than just the shell.
+    shell_cmdline = " " . join(ffmpeg_cmdline)
+    if os.name != 'nt':
+        shell_cmdline = "exec " + shell_cmdline
+    ffmpeg = subprocess.Popen(
+        shell_cmdline,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=False,
+        shell=True,
+    )
+
+    # Read the diagnostic output.
+    def read_diagnostics():
+        duration_found = False
+        for line in iter(ffmpeg.stderr.readline, b''):
+            line = line.decode("utf8", errors="replace").strip()
+
+            # Echo the line of text to the log. Statistics lines end in a
+            # carriage return rather than a newline, so several may come in
+            # at once.
+            if f_log is not None:
+                if ffmpeg_log_diag:
+                    for part in line.split('\r'):
+                        part = part.strip()
+                        if part and not log_noise_regex.match(part):
+                            f_log.write(log_prefix + part + '\n')
+                else:
+                    f_log.write(log_prefix + line + '\n')
+
+            if error_tail is not None:
+                error_tail.append(line)
+
+            # Hat tip: Werner Robitza :: https://gist.github.com/slhck
+            if not duration_found:
+                result = dur_regex.search(line)
+                if result:
+                    duration_found = True
+                    on_duration(to_ms(**result.groupdict()))
+
+    diagnostics = threading.Thread(target=read_diagnostics, daemon=True)
+    diagnostics.start()
+
+    # Stop ffmpeg if we're told to. This is watched on its own thread, since
+    # an ffmpeg that's stuck (e.g., reading from a hung network share) stops
+    # sending progress reports too. (On Windows, ffmpeg is the shell's child,
+    # so the whole process tree has to go.)
+    finished = False
+    finished_lock = threading.Lock()
+
+    def watch_cancel():
+        while not cancel.wait(1):
+            if finished:
+                return
+        with finished_lock:
+            if finished:
+                return
+            if os.name == 'nt':
+                subprocess.run(["taskkill", "/F", "/T", "/PID", str(ffmpeg.pid)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            else:
+                ffmpeg.kill()
+
+    if cancel is not None:
+        threading.Thread(target=watch_cancel, daemon=True).start()
+
+    # Collect the progress output's key=value lines into a report, which ends
+    # with a "progress=" line.
+    fields = {}
+    for line in iter(ffmpeg.stdout.readline, b''):
+        (key, _, value) = line.decode("utf8", errors="replace").strip().partition("=")
+        fields[key] = value
+        if key == "progress":
+            on_progress(FfmpegProgress(fields))
+            fields = {}
+
+    diagnostics.join()
+
+    # It's done, so it's too late to stop it - and it mustn't be killed once
+    # it's been collected, in case its process ID has been reused.
+    with finished_lock:
+        finished = True
+
+    # Collect ffmpeg ourselves where we can, since that tells us how much CPU
+    # time it used. (Several ffmpegs can be running at once, so asking about
+    # all of our children wouldn't do.)
+    if hasattr(os, "wait4") and ffmpeg.returncode is None:
+        (_, status, usage) = os.wait4(ffmpeg.pid, 0)
+        ffmpeg.returncode = os.waitstatus_to_exitcode(status)
+        if on_usage is not None:
+            on_usage(usage.ru_utime + usage.ru_stime)
+        return ffmpeg.returncode
+
+    return ffmpeg.wait()
+
+
+# Helper function - work out where to split a long source for segmented
+# transcoding. Segments start on video keyframes, so each one can be
+# transcoded on its own and the results joined without re-encoding. Returns a
+# list of (start, duration) pairs in seconds (the last duration is None, for
+# "to the end"), or None if the source is too short to be worth splitting or
+# can't be probed.
+def plan_segments(job):
+
+    source_file = os.path.join(job.watch.source_dir, job.file)
+
+    # The probe stage tells us the start time and duration of the source.
+    if job.media is None or job.media.duration is None:
+        return None
+    start_time = job.media.start_time
+    duration = job.media.duration / 1000
+
+    if duration < segment_length * 2:
+        return None
+
+    # List the video keyframes. Only the packet headers are read, so this is
+    # quick even for long recordings.
+    probe = subprocess.run(
+        [ffprobe_location, "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "packet=pts_time,flags", "-of", "csv=print_section=0",
+         source_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    keyframes = []
+    for line in probe.stdout.splitlines():
+        fields = line.split(",")
+        if len(fields) >= 2 and "K" in fields[1]:
+            try:
+                keyframes.append(float(fields[0]) - start_time)
+            except ValueError:
+                pass
+
+    # Cut at the first keyframe at least one segment length after the last
+    # cut, but don't leave a tiny segment at the end.
+    cuts = [0.0]
+    for keyframe in sorted(keyframes):
+        if (keyframe - cuts[-1] >= segment_length
+                and duration - keyframe >= segment_length / 2):
+            cuts.append(keyframe)
+
+    if len(cuts) < 2:
+        return None
+
+    return ([(cuts[index], cuts[index + 1] - cuts[index]) for index in range(len(cuts) - 1)]
+            + [(cuts[-1], None)])
+
+
+# Helper function - transcode a source in keyframe-aligned segments, several
+# at a time, then join the results for each output with ffmpeg's concat
+# demuxer. Finished segments are remembered in a work directory, so a retried
+# or restarted job only redoes the segments that didn't finish. Returns 0 on
+# success, or the failing ffmpeg's return code.
+def transcode_segments(job, segments, f_log, log_prefix):
+
+    file_name, _ = os.path.splitext(job.file)
+    work_dir = os.path.join(job.watch.dest_dir, ".segments", file_name)
+
+    # If there's a work directory from an earlier attempt that was split up
+    # differently, start over.
+    plan = json.dumps({"segments": segments, "outputs": [output["name"] for output in job.watch.outputs]})
+    plan_file = os.path.join(work_dir, "plan.json")
+    if os.path.isfile(plan_file):
+        with open(plan_file, 'r') as existing_plan:
+            if existing_plan.read() != plan:
+                shutil.rmtree(work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    with open(plan_file, 'w') as new_plan:
+        new_plan.write(plan)
+
+    # Progress (in ms) of each segment, for the overall progress bar.
+    segment_progress = [0] * len(segments)
+
+    def encode_segment(segment_index):
+
+        (start, duration) = segments[segment_index]
+        done_marker = os.path.join(work_dir, "seg{:05d}.done" . format(segment_index))
+        segment_prefix = "{}[segment {}] " . format(log_prefix, segment_index + 1)
+
+        def on_progress(progress):
+            if progress.out_time is not None:
+                segment_progress[segment_index] = progress.out_time
+                job.prog_pct = (sum(segment_progress) / job.total_dur) * 100
+            publish_progress(job, progress)
+
+        # Skip segments that finished in an earlier attempt, counting the
+        # whole of each towards the progress. (The last segment runs to the
+        # end of the source.)
+        if os.path.isfile(done_marker):
+            if job.total_dur:
+                if duration is None:
+                    duration = job.total_dur / 1000 - start
+                segment_progress[segment_index] = duration * 1000
+                job.prog_pct = (sum(segment_progress) / job.total_dur) * 100
+            return True
+
+        # Seek to the segment's keyframe, and stop at the next segment's.
+        seek = ["-ss {:.6f}" . format(start)]
+        if duration is not None:
+            seek.append("-t {:.6f}" . format(duration))
+
+        segment_files = [os.path.join(work_dir, "seg{:05d}.{}.{}"
+                                      . format(segment_index, output["name"], output["ext"]))
+                         for output in job.watch.outputs]
+        segment_cmdline = expand_cmdline(job, segment_files, seek)
+
+        for attempt in range(segment_retries + 1):
+
+            if f_log is not None:
+                f_log.write(segment_prefix + 'Command line:\n')
+                f_log.write(segment_prefix + " " . join(segment_cmdline) + '\n\n')
+
+            segment_progress[segment_index] = 0
+            if run_ffmpeg(segment_cmdline, f_log, segment_prefix,
+                          lambda total_dur: None, on_progress,
+                          lambda cpu_time: add_cpu_time(job, cpu_time),
+                          job.error_tail, job.cancel) == 0:
+                with open(done_marker, 'w'):
+                    pass
+                return True
+
+            if job.cancel.is_set():
+                return False
+
+            write_log("  Segment {} of {} failed (attempt {} of {})."
+                      . format(segment_index + 1, job.file, attempt + 1, segment_retries + 1),
+                      "WARN")
+
+        return False
+
+    # Transcode the segments.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=segment_jobs) as segment_pool:
+        if not all(segment_pool.map(encode_segment, range(len(segments)))):
+            return 1
+
+    # Join each output's segments into the finished file.
+    for output_index, output in enumerate(job.watch.outputs):
+
+        list_file = os.path.join(work_dir, "concat.{}.txt" . format(output["name"]))
+        with open(list_file, 'w') as concat_list:
+            for segment_index in range(len(segments)):
+                segment_file = os.path.join(work_dir, "seg{:05d}.{}.{}"
+                                            . format(segment_index, output["name"], output["ext"]))
+                concat_list.write("file '{}'\n" . format(segment_file.replace("'", "'\\''")))
+
+        concat_cmdline = [ffmpeg_location, "-y", "-nostats", "-f concat", "-safe 0",
+                          '-i "' + list_file + '"', "-map 0", "-c copy"]
+        concat_cmdline += [entry for entry in output["cmdline"] if entry.startswith("-movflags")]
+        concat_cmdline.append('"' + job.dest_files[output_index] + '"')
+
+        if f_log is not None:
+            f_log.write(log_prefix + 'Command line:\n')
+            f_log.write(log_prefix + " " . join(concat_cmdline) + '\n\n')
+
+        returncode = run_ffmpeg(concat_cmdline, f_log, log_prefix,
+                                lambda total_dur: None, lambda progress: None,
+                                lambda cpu_time: add_cpu_time(job, cpu_time),
+                                job.error_tail)
+        if returncode != 0:
+            return returncode
+
+    # All done, so clean up.
+    shutil.rmtree(work_dir)
+    try:
+        os.rmdir(os.path.dirname(work_dir))
+    except OSError:
+        pass
+    return 0
+
+
+# Helper function - the name of a transcode's ffmpeg log file.
+def ffmpeg_log_name(job):
+
+    return "{}.{}.log" . format(job.file.replace(os.sep, "_"), job.job_id)
+
+
+# Helper function - open a log file for one transcode's ffmpeg output, and
+# delete the oldest ones if there are too many. Logs that running jobs are
+# still writing to are left alone, however old they are.
+def open_ffmpeg_log(job):
+
+    f_log = open(os.path.join(ffmpeg_log_dir, ffmpeg_log_name(job)), 'a')
+
+    if ffmpeg_log_keep > 0:
+        with state_lock:
+            open_logs = {ffmpeg_log_name(running_job) for running_job in running_jobs}
+        open_logs.add(ffmpeg_log_name(job))
+
+        logs = sorted((entry for entry in os.scandir(ffmpeg_log_dir)
+                       if entry.name.endswith(".log") and entry.is_file()),
+                      key=lambda entry: entry.stat().st_mtime)
+        for entry in logs[:-ffmpeg_log_keep]:
+            if entry.name in open_logs:
+                continue
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    return f_log
+
+
+# Helper function - make a copy of a file as cheaply as possible: a reflink
+# (copy-on-write clone) where the filesystem supports it, otherwise an actual
+# copy. Hard links are no good here - ffmpeg overwrites its output in place,
+# which would clobber the cached copy too.
+def clone_file(source_file, target_file):
+
+    if os.path.lexists(target_file):
+        os.remove(target_file)
+
+    # FICLONE, from <linux/fs.h>
+    if fcntl is not None and sys.platform.startswith("linux"):
+        try:
+            with open(source_file, 'rb') as source, open(target_file, 'wb') as target:
+                fcntl.ioctl(target.fileno(), 0x40049409, source.fileno())
+            return
+        except OSError:
+            os.remove(target_file)
+
+    shutil.copyfile(source_file, target_file)
+
+
+# Helper function - fingerprint a file's contents. By default this is the
+# file's size plus a hash of evenly spaced sample blocks, which only reads a
+# megabyte or so no matter how big the file is. A full hash reads the whole
+# file, and catches changes the samples would miss.
+def fingerprint_file(file_path):
+
+    file_hash = hashlib.sha256()
+    file_size = os.path.getsize(file_path)
+    file_hash.update(str(file_size).encode())
+
+    with open(file_path, 'rb') as source:
+        if cache_full_hash:
+            for block in iter(lambda: source.read(1024 * 1024), b''):
+                file_hash.update(block)
+        else:
+            block_size = 64 * 1024
+            sample_count = 16
+            for sample in range(sample_count):
+                source.seek(max(file_size - block_size, 0) * sample // (sample_count - 1))
+                file_hash.update(source.read(block_size))
+
+    return file_hash.hexdigest()
+
+
+# Output cache - keeps a copy of every transcode, keyed on the source's
+# contents and the ffmpeg command line used, so an identical source dropped
+# in again (even under another name) is reused instead of re-transcoded. The
+# index is a SQLite database in the cache directory, and the least recently
+# used entries are thrown out once the cache grows past its size limit.
+class OutputCache:
+
+    def __init__(self, directory, size_limit):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, "index.db"),
+                                  check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outputs ("
+            " cache_key TEXT NOT NULL,"
+            " output_index INTEGER NOT NULL,"
+            " file TEXT NOT NULL,"        # File name within the cache directory
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (cache_key, output_index)"
+            ")"
+        )
+
+    # Work out the cache key for a job - its source's fingerprint plus its
+    # expanded command line, with the source and destination files left out
+    # so the file names don't matter.
+    def key_for(self, job):
+        key_cmdline = expand_cmdline(job, ["%DESTFILE%"] * len(job.watch.outputs))
+        key_cmdline = [entry.replace('"' + os.path.join(job.watch.source_dir, job.file) + '"', "%SOURCEFILE%")
+                       for entry in key_cmdline[1:]]
+        key_hash = hashlib.sha256(fingerprint_file(os.path.join(job.watch.source_dir, job.file)).encode())
+        key_hash.update("\0" . join(key_cmdline).encode())
+        return key_hash.hexdigest()
+
+    # Copy a cached transcode to the destination files, if there is one.
+    # Returns True on a hit.
+    def fetch(self, cache_key, dest_files):
+        with self.lock:
+            cached = self.db.execute(
+                "SELECT output_index, file FROM outputs WHERE cache_key = ?"
+                " ORDER BY output_index", (cache_key,)).fetchall()
+            if (len(cached) != len(dest_files)
+                    or not all(os.path.isfile(os.path.join(self.directory, cached_file))
+                               for (_, cached_file) in cached)):
+                return False
+            for (output_index, cached_file) in cached:
+                clone_file(os.path.join(self.directory, cached_file), dest_files[output_index])
+            self.db.execute("UPDATE outputs SET last_used = ? WHERE cache_key = ?",
+                            (time.time(), cache_key))
+            return True
+
+    # Add a finished transcode to the cache, then make room if needed.
+    def store(self, cache_key, dest_files):
+        with self.lock:
+            for (output_index, dest_file) in enumerate(dest_files):
+                cached_file = "{}.{}{}" . format(cache_key, output_index,
+                                                 os.path.splitext(dest_file)[1])
+                clone_file(dest_file, os.path.join(self.directory, cached_file))
+                self.db.execute(
+                    "INSERT OR REPLACE INTO outputs (cache_key, output_index, file, size, last_used)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (cache_key, output_index, cached_file, os.path.getsize(dest_file), time.time()))
+
+            # Throw out the least recently used transcodes until we're under
+            # the size limit.
+            cache_used = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM outputs").fetchone()[0]
+            while self.size_limit > 0 and cache_used > self.size_limit:
+                (oldest_key,) = self.db.execute(
+                    "SELECT cache_key FROM outputs ORDER BY last_used LIMIT 1").fetchone()
+                for (cached_file, cached_size) in self.db.execute(
+                        "SELECT file, size FROM outputs WHERE cache_key = ?",
+                        (oldest_key,)).fetchall():
+                    try:
+                        os.remove(os.path.join(self.directory, cached_file))
+                    except OSError:
+                        pass
+                    cache_used -= cached_size
+                self.db.execute("DELETE FROM outputs WHERE cache_key = ?", (oldest_key,))
+
+
+# Metrics registry - counters, gauges and histograms, kept in memory and
+# rendered in Prometheus' text format for the /metrics endpoint or a
+# node_exporter textfile.
+class Metrics:
+
+    def __init__(self):
+        # Workers, the monitor loop and the exporter all touch the values, so
+        # take turns.
+        self.lock = threading.Lock()
+
+        # Metric name -> (type, help text, histogram buckets)
+        self.definitions = {}
+
+        # (metric name, labels) -> value, or for histograms, a list of
+        # per-bucket counts followed by the sum and count
+        self.values = {}
+
+    # Declare a metric.
+    def define(self, name, metric_type, help_text, buckets=None):
+        self.definitions[name] = (metric_type, help_text, buckets)
+
+    # Add to a counter.
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    # Set a gauge.
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    # Record an observation in a histogram.
+    def observe(self, name, value, **labels):
+        buckets = self.definitions[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            counts = self.values.setdefault(key, [0] * (len(buckets) + 2))
+            for (index, bound) in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    # Render every metric in Prometheus' text exposition format.
+    def render(self):
+
+        def label_text(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if len(labels) == 0:
+                return ''
+            return "{" + "," . join('{}="{}"' . format(label, str(value).replace("\\", "\\\\")
+                                                        .replace('"', '\\"').replace("\n", "\\n"))
+                                    for (label, value) in labels) + "}"
+
+        lines = []
+        with self.lock:
+            for (name, (metric_type, help_text, buckets)) in self.definitions.items():
+                lines.append("# HELP {} {}" . format(name, help_text))
+                lines.append("# TYPE {} {}" . format(name, metric_type))
+                for ((value_name, labels), value) in sorted(self.values.items()):
+                    if value_name != name:
+                        continue
+                    if metric_type == "histogram":
+                        for (index, bound) in enumerate(buckets):
+                            lines.append("{}_bucket{} {}" . format(
+                                name, label_text(labels, [("le", bound)]), value[index]))
+                        lines.append("{}_bucket{} {}" . format(
+                            name, label_text(labels, [("le", "+Inf")]), value[-1]))
+                        lines.append("{}_sum{} {}" . format(name, label_text(labels), value[-2]))
+                        lines.append("{}_count{} {}" . format(name, label_text(labels), value[-1]))
+                    else:
+                        lines.append("{}{} {}" . format(name, label_text(labels), value))
+        return "\n" . join(lines) + "\n"
+
+
+# Helper function - bring the gauges up to date and render the metrics.
+def collect_metrics():
+
+    with state_lock:
+        metrics.set("autotranscode_jobs_in_flight", len(running_jobs))
+        metrics.set("autotranscode_jobs_leased", len(leases))
+    metrics.set("autotranscode_queue_depth", job_queue.qsize())
+    metrics.set("autotranscode_candidates", sum(len(watch.candidates) for watch in watches))
+    return metrics.render()
+
+
+# Helper function - progress subscriber that records encode speed.
+def record_progress_metrics(job, progress):
+
+    if progress.finished:
+        return
+    if progress.speed is not None:
+        metrics.observe("autotranscode_encode_speed_ratio", progress.speed, preset=job.watch.preset_name)
+    if progress.fps is not None:
+        metrics.observe("autotranscode_encode_fps", progress.fps, preset=job.watch.preset_name)
+
+
+# Metrics endpoint - serves the metrics at /metrics.
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = collect_metrics().encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Scrapes would drown out everything else on the console, so don't log
+    # them.
+    def log_message(self, format, *args):
+        pass
+
+
+# Metrics thread - rewrites the metrics textfile every few seconds. The file
+# is written under another name and then renamed over the old one, so
+# node_exporter never sees half a file.
+def metrics_file_writer():
+
+    while True:
+        temp_file = metrics_file + ".tmp"
+        try:
+            with open(temp_file, 'w') as metrics_out:
+                metrics_out.write(collect_metrics())
+            os.replace(temp_file, metrics_file)
+        except OSError as error:
+            write_log("Couldn't write metrics file: {}" . format(error), "WARN")
+        time.sleep(metrics_interval)
+
+
+# Helper function - append a job's telemetry record to the telemetry log, as
+# one line of JSON.
+def write_telemetry(job, outcome):
+
+    source_file = os.path.join(job.watch.source_dir, job.file)
+    try:
+        source_size = os.path.getsize(source_file)
+    except OSError:
+        source_size = None
+
+    # Time the encode up to when ffmpeg finished, if it did, rather than
+    # including however long verification took.
+    encode_time = None
+    if job.start_time is not None:
+        encode_end = job.encode_end or datetime.datetime.now()
+        encode_time = (encode_end - job.start_time).total_seconds()
+
+    duration = job.total_dur / 1000 if job.total_dur else None
+
+    record = {
+        "job_id": job.job_id,
+        "finished_at": time.time(),
+        "source": source_file,
+        "source_size": source_size,
+        "duration": duration,
+        "watch": job.watch.name,
+        "preset": job.watch.preset_name,
+        "cmdline": " " . join(job.cmdline),
+        "passthrough": [sorted(copy_streams) for copy_streams in job.passthrough],
+        "ready_wait": job.ready_wait,
+        "queue_wait": job.queue_wait,
+        "encode_time": encode_time,
+        "cpu_time": job.cpu_time,
+        "speed": (duration / encode_time) if duration and encode_time else None,
+        "outputs": job.dest_files,
+        "output_size": sum(os.path.getsize(dest_file) for dest_file in job.dest_files
+                           if os.path.isfile(dest_file)),
+        "outcome": outcome,
+    }
+
+    with log_lock:
+        with open(telemetry_file, 'a') as telemetry_log:
+            telemetry_log.write(json.dumps(record) + "\n")
+
+    # Keep it for the dashboard, too.
+    recent_outcomes.appendleft(record)
+
+
+# Helper function - get a job ready to transcode, and deal with it straight
+# away if it doesn't need ffmpeg - if it was transcoded before a restart, or
+# matches a cached transcode. Returns True if it still needs transcoding.
+def prepare_job(job):
+
+    # On a shared source directory, make sure no other instance is working on
+    # it. Claiming only when a worker is free to start means each instance
+    # takes its share of the files as fast as it can get through them.
+    if claim_files and job.claim is None and not claim_source(job):
+        write_log("  {} has been claimed by another instance - leaving it to them." . format(job.file), "INFO")
+        job_store.update(job.job_id, state='dropped', finished_at=time.time())
+        release_job(job)
+        return False
+
+    job.attempts += 1
+    job.error_tail.clear()
+    job.cancel.clear()
+
+    # If this was transcoded before a restart, just finish it off.
+    if job.encoded:
+        write_log("  {} was already transcoded - finishing up..." . format(job.file), "INFO")
+        verify_pool.submit(finish_job, job)
+        return False
+
+    # Build the command line for this file.
+    build_cmdline(job)
+
+    # Make sure the file's subdirectory exists in the destination directory.
+    # If another worker beats us to it, that's fine.
+    os.makedirs(os.path.dirname(job.dest_files[0]), exist_ok=True)
+
+    # If an identical source has been transcoded with the same settings
+    # before, reuse that instead of running ffmpeg again.
+    job.cache_key = None
+    if output_cache is not None:
+        job.cache_key = output_cache.key_for(job)
+        if output_cache.fetch(job.cache_key, job.dest_files):
+            for dest_file in job.dest_files:
+                sync_file(dest_file)
+            sync_file(os.path.dirname(job.dest_files[0]))
+            write_log("  {} matches a cached transcode - reused it." . format(job.file), "INFO")
+            metrics.inc("autotranscode_cache_hits_total", preset=job.watch.preset_name)
+            write_telemetry(job, 'cached')
+            job_store.update(job.job_id, state='done', finished_at=time.time(),
+                             output_path="\n" . join(job.dest_files))
+            finalize_source(job)
+            release_job(job)
+            return False
+
+    return True
+
+
+# Helper function - run ffmpeg on a job whose command line has been built,
+# either all at once or a segment at a time. Returns ffmpeg's return code.
+def encode_job(job, f_log, log_prefix):
+
+    # Long sources can be split up and transcoded a segment at a time.
+    segments = None
+    if segment_length > 0:
+        segments = plan_segments(job)
+
+    if segments is not None:
+        write_log("  Transcoding {} in {} segments..." . format(job.file, len(segments)), "INFO")
+        returncode = transcode_segments(job, segments, f_log, log_prefix)
+
+    else:
+        # Start by writing the command line to the
+        # log, just in case inspecting it is needed.
+        if f_log is not None:
+            f_log.write(log_prefix + 'Command line:\n')
+            f_log.write(log_prefix + " " . join(job.cmdline) + '\n\n')
+
+        # Fall back on ffmpeg's idea of the duration if the source
+        # couldn't be probed.
+        def on_duration(total_dur):
+            if job.total_dur is None:
+                job.total_dur = total_dur
+
+        # Derive a percent value of the transcode progress, and pass the
+        # report on to whatever's subscribed to it.
+        def on_progress(progress):
+            if job.total_dur and progress.out_time is not None:
+                job.prog_pct = (progress.out_time / job.total_dur) * 100
+            publish_progress(job, progress)
+
+        returncode = run_ffmpeg(job.cmdline, f_log, log_prefix, on_duration, on_progress,
+                                lambda cpu_time: add_cpu_time(job, cpu_time),
+                                job.error_tail, job.cancel)
+
+    return returncode
+
+
+# Helper function - record a finished transcode, and make sure its files are
+# safely on disk.
+def encode_succeeded(job):
+
+    # Note when ffmpeg finished, then get the difference from start.
+    job.encode_end = datetime.datetime.now()
+    time_diff = job.encode_end - job.start_time
+
+    # Record how long it took. (It isn't counted as completed until it's
+    # been checked and the source finalized.)
+    metrics.observe("autotranscode_phase_duration_seconds",
+                    time_diff.total_seconds(), phase="encode")
+
+    # Create a blank variable for the total time the transcode
+    # took.
+    elapsed_time = ''
+
+    # Break the time difference down into days/hours/mins/secs,
+    # and build display text based on the results.
+    (days, remainder) = divmod(time_diff.total_seconds(), 86400)
+    (hours, remainder) = divmod(remainder, 3600)
+    (minutes, seconds) = divmod(remainder, 60)
+    days = int(days)
+    hours = int(hours)
+    minutes = int(minutes)
+    seconds = int(seconds)
+    if time_diff.total_seconds() > 86400:
+        elapsed_time = ("{}:{:02d}:{:02d}:{:02d}"
+                          . format(days, hours, minutes, seconds))
+    elif time_diff.total_seconds() > 3600:
+        elapsed_time = ("{}:{:02d}:{:02d}"
+                          . format(hours, minutes, seconds))
+    elif time_diff.total_seconds() > 60:
+        elapsed_time = "00:{:02d}:{:02d}" . format(minutes, seconds)
+    else:
+        elapsed_time = "{}s" . format(seconds)
+
+
+    # Transcode complete!
+    write_log("  Transcode of {} completed in {}."
+              . format(job.file, elapsed_time), "INFO")
+
+    # Make sure the transcoded files are safely on disk, then record
+    # that the transcode is done, so a restart won't redo it.
+    for dest_file in job.dest_files:
+        sync_file(dest_file)
+    sync_file(os.path.dirname(job.dest_files[0]))
+    job_store.update(job.job_id, state='done', finished_at=time.time(),
+                     output_path="\n" . join(job.dest_files))
+
+
+# Helper function - transcode a single file, then hand it over to be checked
+# and have the source moved or renamed. Returns True once it's been handed
+# over (or scheduled for a retry, or finished), since it's still in use then.
+def transcode_file(job):
+
+    if not prepare_job(job):
+        return True
+
+    # Note in the log that the file will be transcoded.
+    write_log("  Handing over to FFMPEG for transcode of {}..." . format(job.file), "INFO")
+
+    # Note which streams are being copied rather than transcoded.
+    for (output, copy_streams) in zip(job.watch.outputs, job.passthrough):
+        if len(copy_streams) == 0:
+            path_taken = "transcoding video and audio"
+        elif copy_streams == {"video", "audio"}:
+            path_taken = "copying video and audio (source already matches)"
+        elif "video" in copy_streams:
+            path_taken = "copying video (source already matches), transcoding audio"
+        else:
+            path_taken = "transcoding video, copying audio (source already matches)"
+        write_log("  {} output: {}." . format(output["name"], path_taken), "INFO")
+
+    # Each job has its own ffmpeg log, if ffmpeg logging is enabled.
+    f_log = None
+    log_prefix = ''
+
+    try:
+
+        # Get the current time for estimating remaining time.
+        job.start_time = datetime.datetime.now()
+
+        with state_lock:
+            running_jobs.append(job)
+
+        # Record that we've started.
+        job_store.start(job.job_id)
+
+        # Open a log file if ffmpeg logging is enabled.
+        if save_ffmpeg_output == True:
+            f_log = open_ffmpeg_log(job)
+
+        returncode = encode_job(job, f_log, log_prefix)
+
+        # Check for a non-zero return code (error) from ffmpeg.
+        if returncode != 0:
+            if save_ffmpeg_output == True:
+                write_log("  Transcode of {} failed. Check the ffmpeg"
+                          " output log ({}) for more information."
+                          . format(job.file, f_log.name), "ERROR")
+
+            else:
+                write_log("  Transcode of {} failed. Enable ffmpeg "
+                          "output logging with -flog and retry "
+                          "for more information."
+                          . format(job.file), "ERROR")
+
+            # Retry it later or give up on it, depending on what went wrong.
+            reason = "ffmpeg exited with code {}" . format(returncode)
+            if len(job.error_tail) > 0:
+                reason += " - " + job.error_tail[-1]
+            return fail_job(job, reason, failure_is_transient(returncode, job.error_tail))
+
+        encode_succeeded(job)
+
+
+    finally:
+        with state_lock:
+            if job in running_jobs:
+                running_jobs.remove(job)
+
+        # Close the log file.
+        if f_log is not None:
+            f_log.close()
+
+    # Check it over and finish it off, while this worker moves on.
+    verify_pool.submit(finish_job, job, job.cache_key)
+    return True
+
+
+# Helper function - run ffprobe on a file. Returns its report (JSON text), or
+# an empty string if ffprobe can't make sense of the file.
+def run_ffprobe(file_path):
+
+    probe = subprocess.run(
+        [ffprobe_location, "-v", "error", "-show_format", "-show_streams",
+         "-of", "json", file_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    return probe.stdout if probe.returncode == 0 else ''
+
+
+# Helper function - check a job's transcoded files against the source: each
+# one must be a readable container, have video and audio if the source did,
+# and be within verify_tolerance seconds of the source's duration. With
+# verify_decode set, the start and end of each one are decoded too. Returns
+# what's wrong, or None if everything checks out (or there's no ffprobe to
+# check with).
+def verify_job(job):
+
+    if not verify_outputs or not probe_available:
+        return None
+
+    verify_start = time.monotonic()
+    try:
+        for dest_file in job.dest_files:
+            dest_name = os.path.basename(dest_file)
+
+            try:
+                output = MediaInfo(json.loads(run_ffprobe(dest_file)))
+            except ValueError:
+                output = None
+            if output is None or not output.format_name:
+                return "{} isn't a readable media file" . format(dest_name)
+
+            if job.media is not None:
+                if job.media.video is not None and output.video is None:
+                    return "{} has no video stream" . format(dest_name)
+                if job.media.audio is not None and output.audio is None:
+                    return "{} has no audio stream" . format(dest_name)
+            elif output.video is None and output.audio is None:
+                return "{} has no video or audio streams" . format(dest_name)
+
+            if job.total_dur and output.duration is not None:
+                if abs(output.duration - job.total_dur) > verify_tolerance * 1000:
+                    return ("{} is {:0.2f}s long, but the source is {:0.2f}s"
+                            . format(dest_name, output.duration / 1000, job.total_dur / 1000))
+
+            # Decode the start and end, throwing away what's decoded. With
+            # "-v error", ffmpeg only says anything if something's wrong.
+            if verify_decode > 0:
+                for (part, seek) in (("start", ["-t", str(verify_decode)]),
+                                     ("end", ["-sseof", "-" + str(verify_decode)])):
+                    decode = subprocess.run(
+                        [ffmpeg_location, "-v", "error", "-nostdin"] + seek
+                        + ["-i", dest_file, "-f", "null", "-"],
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.PIPE,
+                        universal_newlines=True,
+                    )
+                    if decode.returncode != 0 or decode.stderr.strip() != '':
+                        return ("{} has errors near the {}: {}"
+                                . format(dest_name, part,
+                                         (decode.stderr.strip().splitlines() or ["ffmpeg failed"])[0]))
+
+        return None
+
+    finally:
+        metrics.observe("autotranscode_phase_duration_seconds",
+                        time.monotonic() - verify_start, phase="verify")
+
+
+# Helper function - check a transcode, then record it and move or rename the
+# source. Runs on the verification pool, so the worker that did the
+# transcode can get on with the next one in the meantime.
+def finish_job(job, cache_key=None):
+
+    retrying = False
+    try:
+        problem = verify_job(job)
+        if problem is not None:
+            # A bad output might just be a bad run, so it's worth another go.
+            write_log("  Verification of {} failed - {}." . format(job.file, problem), "ERROR")
+            retrying = fail_job(job, problem, True)
+            return
+
+        # Make sure nobody's taken the file over before we move it.
+        if not renew_claim(job):
+            retrying = fail_job(job, "another instance took it over", True)
+            return
+
+        # Keep a copy in the output cache.
+        if cache_key is not None:
+            output_cache.store(cache_key, job.dest_files)
+
+        # Only move or rename the source once the transcode has checked out.
+        source_size = os.path.getsize(os.path.join(job.watch.source_dir, job.file))
+        finalize_source(job)
+
+    except Exception as error:
+        # Log the error, and deal with it like a failed transcode.
+        write_log("*** ERROR in finishing {}!" . format(job.file), "ERROR")
+        write_log(traceback.format_exc(), "ERROR")
+        retrying = fail_job(job, "{}: {}" . format(type(error).__name__, error),
+                            error_is_transient(error))
+
+    else:
+        # Now it's done, count it. (Only here, so each job gets exactly one
+        # telemetry record - a job that fails above gets a 'failed' one.)
+        metrics.inc("autotranscode_jobs_completed_total", preset=job.watch.preset_name)
+        metrics.inc("autotranscode_bytes_in_total", source_size, preset=job.watch.preset_name)
+        metrics.inc("autotranscode_bytes_out_total",
+                    sum(os.path.getsize(dest_file) for dest_file in job.dest_files
+                        if os.path.isfile(dest_file)),
+                    preset=job.watch.preset_name)
+        write_telemetry(job, 'done')
+
+    finally:
+        if not retrying:
+            release_job(job)
 
 
-        else:
-            # Something got passed to the script that we don't recognize.
-            print("Unrecognized option - please check your command line.")
-            quit()
+# Helper function - we're done with a job one way or another, so let the
+# monitor loop see its file again.
+def release_job(job):
 
+    release_claim(job)
 
-        # Advance the index.
-        index += 1
+    with state_lock:
+        job.watch.active_files.discard(job.file)
 
-else:
-    print("No parameters given. Follow with '--help' for usage information.")
-    quit()
 
+# Helper function - decide whether a failed transcode is worth retrying - was
+# ffmpeg killed, or did it complain about something that might clear up on
+# its own? Anything else (usually bad source data) counts as permanent.
+def failure_is_transient(returncode, error_tail):
 
-# Sanity checks - let's make sure we have some settings.
-if source_dir == '':
-    print("No source directory - please check your command line or config file.")
-    quit()
-if dest_dir == '':
-    print("No destination directory - please check your command line or config file.")
-    quit()
-if cmdline == []:
-    print("No transcode mode selected - please check your command line or config file.")
-    quit()
-if new_ext == '':
-    print("No container selected - please check your command line or config file.")
-    quit()
+    # Killed by a signal - negative if we collected ffmpeg ourselves, or
+    # 128 + the signal number if a shell did.
+    if returncode < 0 or 128 < returncode < 160:
+        return True
 
+    return any(transient_regex.search(line) for line in error_tail)
 
-# More sanity checking - let's make sure we can access programs we need to access.
-if os.name == 'nt':
-    if shutil.which(ffmpeg_location) is None:
-        print("Program 'ffmpeg' not found or not on system's PATH - install the "
-              "application package 'ffmpeg' to install it. Or, use the '-ffmpeg' "
-              "argument to provide a full path to ffmpeg.exe.")
-        quit()
-else:
-    if shutil.which(ffmpeg_location) is None:
-        print("Program 'ffmpeg' not found or not on system's PATH - install the "
-              "package 'ffmpeg' to install it. Or, use the '-ffmpeg' "
-              "argument to provide a full path to ffmpeg.")
-        quit()
-    if shutil.which("fuser") is None:
-        print("Program 'fuser' not found or not on system's PATH - install the "
-              "package 'psmisc' to install it.")
-        quit()
 
+# Helper function - the same, for an error the script itself ran into.
+def error_is_transient(error):
 
-# Even more sanity checking - check to ensure we have write access to the
-# destination directory.
-try:
-    with open(os.path.join(dest_dir, "check.tmp"), 'w') as check_file:
-        pass
-    os.remove(os.path.join(dest_dir, "check.tmp"))
-except:
-    print("Can't write to destination directory - please check your command line "
-          "or config file, and if it is correct, make sure it's writable by "
-          "root/sudo/admin accounts.")
-    quit()
+    return (isinstance(error, OSError)
+            and error.errno in (errno.ENOSPC, errno.EIO, errno.EAGAIN, errno.ENOMEM,
+                                errno.ETIMEDOUT, errno.ECONNRESET,
+                                getattr(errno, "EDQUOT", errno.ENOSPC)))
 
 
-# Check to see if we have elevated privileges.
-# Hat tip: "tahoar" at https://stackoverflow.com/questions/2946746/
-if os.name == 'nt':
+# Helper function - deal with a job that failed. Transient failures are
+# retried after a while, up to job_retries times, with the wait doubling each
+# time. Anything else (or running out of retries) means giving up on the
+# file - it's quarantined, and left alone from then on. Either way, whatever
+# was written for it is deleted. Returns True if it's been scheduled for a
+# retry, since it's still in use then.
+def fail_job(job, reason, transient):
+
+    # If another instance took the file over, it's theirs now - including
+    # whatever's been written for it.
+    if job.claim_lost:
+        write_log("  {} was taken over by another instance ({}) - leaving it to them."
+                  . format(job.file, reason), "WARN")
+        job_store.update(job.job_id, state='dropped', finished_at=time.time(), error=reason)
+        return False
+
+    for dest_file in job.dest_files:
+        try:
+            os.remove(dest_file)
+        except OSError:
+            pass
+
+    if transient and job.attempts <= job_retries:
+        delay = retry_delay * 2 ** (max(job.attempts, 1) - 1)
+        write_log("  {} failed ({}) - retrying in {}s (attempt {} of {})."
+                  . format(job.file, reason, delay, job.attempts + 1, job_retries + 1), "WARN")
+        job_store.update(job.job_id, state='queued', queued_at=time.time(), error=reason)
+        metrics.inc("autotranscode_jobs_retried_total", preset=job.watch.preset_name)
+        write_telemetry(job, 'retried')
+
+        retry_timer = threading.Timer(delay, requeue_job, args=(job,))
+        retry_timer.daemon = True
+        retry_timer.start()
+        return True
+
+    write_log("  {} failed ({}) - giving up on it." . format(job.file, reason), "ERROR")
+    job_store.update(job.job_id, state='failed', finished_at=time.time(), error=reason)
+    metrics.inc("autotranscode_jobs_failed_total", preset=job.watch.preset_name)
+    write_telemetry(job, 'failed')
+    quarantine_source(job, reason)
+    return False
+
+
+# Helper function - put a job that's due for a retry back in the queue, if
+# its source is still there.
+def requeue_job(job):
+
+    if not os.path.isfile(os.path.join(job.watch.source_dir, job.file)):
+        job_store.update(job.job_id, state='dropped', finished_at=time.time())
+        release_job(job)
+        return
+
+    job.encoded = False
+    job.prog_pct = 0
+    job.progress = None
+    job.start_time = None
+    job.encode_end = None
+    job.queued_at = time.monotonic()
+    job_queue.put((queue_key(job, job.queued_at), next(queue_counter), job))
+
+
+# Helper function - get a source that couldn't be transcoded out of the way.
+# With a quarantine directory, it's moved there along with a note of what went
+# wrong (including the end of ffmpeg's output). Otherwise, or if it can't be
+# moved, it's left where it is and skipped unless it changes.
+def quarantine_source(job, reason):
+
+    source_file = os.path.join(job.watch.source_dir, job.file)
+
+    if quarantine_dir != '':
+        try:
+            os.makedirs(os.path.dirname(os.path.join(quarantine_dir, job.file)), exist_ok=True)
+            with open(os.path.join(quarantine_dir, job.file + ".error.txt"), 'w') as error_file:
+                error_file.write("Source: {}\n" . format(source_file))
+                error_file.write("Failed: {}\n" . format(time.strftime("%Y-%m-%d %H:%M:%S")))
+                error_file.write("Reason: {}\n" . format(reason))
+                error_file.write("Attempts: {}\n" . format(job.attempts))
+                error_file.write("\nCommand line:\n{}\n" . format(" " . join(job.cmdline)))
+                error_file.write("\nLast lines from ffmpeg:\n")
+                for line in job.error_tail:
+                    error_file.write(line + "\n")
+            move_file(source_file, os.path.join(quarantine_dir, job.file))
+            job_store.remove_probe(source_file)
+            write_log("  Moved {} to the quarantine directory." . format(job.file), "INFO")
+            return
+        except OSError as error:
+            write_log("  Couldn't quarantine {} ({}) - leaving it where it is."
+                      . format(job.file, error), "WARN")
+
     try:
-        # Try to pull a directory listing of the Windows TEMP directory, which
-        # requires administrator rights.
-        temp = os.listdir(os.sep.join([os.environ.get('SystemRoot','C:\\windows'),'temp']))
-    except:
-        print("This script must be run with elevated privileges. Aborting.")
-        quit()
+        file_stat = os.stat(source_file)
+    except OSError:
+        return
+    with state_lock:
+        job.watch.failed_files[job.file] = (file_stat.st_ino, file_stat.st_size)
 
-else:
-    # Check to see if the current users is in the sudoers list and running the
-    # script as root.
-    #
-    # NOTE: This will require "sudo" even when running in a root shell!
-    if (not 'SUDO_USER' in os.environ) or (os.geteuid() != 0):
-        print("This script must be run with elevated privileges. Aborting.")
-        quit()
 
+# Helper function - inspect a source file with ffprobe, unless it's been
+# probed since it last changed. Returns a MediaInfo, or None if ffprobe isn't
+# available or can't make sense of the file.
+def probe_file(watch, file):
 
-# Candidate file list
-candidates = []
+    if not probe_available:
+        return None
 
-# Command line for each file
-this_cmdline = []
+    source_file = os.path.join(watch.source_dir, file)
+    try:
+        file_stat = os.stat(source_file)
+    except OSError:
+        return None
+
+    result = job_store.find_probe(source_file, file_stat.st_ino, file_stat.st_size,
+                                  file_stat.st_mtime)
+    if result is None:
+        probe_start = time.monotonic()
+        result = run_ffprobe(source_file)
+        metrics.observe("autotranscode_phase_duration_seconds",
+                        time.monotonic() - probe_start, phase="probe")
+
+        # Only remember a successful probe - a failure might just be the
+        # share acting up, so it's worth trying again next time.
+        if result != '':
+            job_store.add_probe(source_file, file_stat.st_ino, file_stat.st_size,
+                                file_stat.st_mtime, result)
 
-# Progress bar length
-bar_length = 40
+    try:
+        return MediaInfo(json.loads(result))
+    except ValueError:
+        return None
 
-# Loop delay time (seconds)
-loop_delay = 5
 
-# Start time for ETA estimation
-start_time = 0
+# Helper function - probe several source files, given as (watch folder, file
+# name) pairs, at once, and queue each one as soon as its probe's done. That
+# way the first transcode can start while the rest of a big batch is still
+# being probed.
+def probe_and_queue(entries):
 
-# Throbber text for progress bar
-if os.name == 'nt':
-    throbber = [
-        "[*.   ]",
-        "[.*.  ]",
-        "[ .*. ]",
-        "[  .*.]",
-        "[   .*]",
-        "[  .*.]",
-        "[ .*. ]",
-        "[.*.  ]",
-        "[*.   ]"
-    ]
-else:
-    throbber = [
-        "[\033[93m*\033[33m*\033[0m   ]",
-        "[\033[33m*\033[93m*\033[33m*\033[0m  ]",
-        "[ \033[33m*\033[93m*\033[33m*\033[0m ]",
-        "[  \033[33m*\033[93m*\033[33m*\033[0m]",
-        "[   \033[33m*\033[93m*\033[0m]",
-        "[  \033[33m*\033[93m*\033[33m*\033[0m]",
-        "[ \033[33m*\033[93m*\033[33m*\033[0m ]",
-        "[\033[33m*\033[93m*\033[33m*\033[0m  ]"
-    ]
+    probes = {probe_pool.submit(probe_file, *entry): entry for entry in entries}
+    for probe in concurrent.futures.as_completed(probes):
+        entry = probes[probe]
+        result = probe.result()
 
-# Throbber step for progress bar
-throbber_step = 0
+        # Remember how long it is, for guessing at files that can't be
+        # probed. (Only here, so a file counts once however often it's
+        # queued.)
+        if result is not None and result.duration:
+            probed_durations.append(result.duration / 1000)
 
+        queue_files([entry], {entry: result})
 
-# Helper REGEXes for transcode progress
-# Hat tip: Werner Robitza :: https://gist.github.com/slhck
-dur_regex = re.compile(
-    r"Duration: (?P<hour>\d{2}):(?P<min>\d{2}):(?P<sec>\d{2})\.(?P<ms>\d{2})"
-)
-time_regex = re.compile(
-    r"out_time=(?P<hour>\d{2}):(?P<min>\d{2}):(?P<sec>\d{2})\.(?P<ms>\d{2})"
-)
 
+# Helper function - queue files, given as (watch folder, file name) pairs, for
+# the workers, recording each one in the job store (or picking up its
+# existing record, if we've seen it before). Files that have been probed
+# (media maps pairs to MediaInfo or None) take the results along. They're
+# handed over best first, so an idle worker doesn't grab whichever one
+# happened to be listed first, whichever watch folder it's from.
+def queue_files(files, media):
 
-# Helper function for logging
-def write_log(log_text, level='INFO'):
+    entries = []
+    for (watch, file) in files:
 
-    # Print the log text to the screen.
-    if __name__ == "__main__":
-        print("[{0: <5}] {1}" . format(level, log_text))
+        found_at = watch.candidate_found.pop(file, None)
 
-    # Save to a log file.
-    if debug_mode == True:
-        with open(os.path.join(path, os.path.basename(sys.argv[0]) + ".log"), 'a') as log_file:
-            log_file.write("[{0: <5}] {1}\n" . format(level, log_text))
+        # It may have been deleted or renamed since it was found to be ready.
+        try:
+            file_stat = os.stat(os.path.join(watch.source_dir, file))
+        except OSError:
+            write_log("  {} went away before it could be queued - skipping it."
+                      . format(file), "DEBUG")
+            if file in watch.candidates:
+                watch.candidates.remove(file)
+            watch.candidate_stats.pop(file, None)
+            continue
+
+        stored_job = job_store.find(os.path.join(watch.source_dir, file),
+                                    file_stat.st_ino, file_stat.st_size)
+
+        if stored_job is None:
+            job = TranscodeJob(watch, file, job_store.add(os.path.join(watch.source_dir, file),
+                                                          file_stat.st_ino, file_stat.st_size,
+                                                          watch.preset_name))
+        else:
+            job = TranscodeJob(watch, file, stored_job["id"])
+            if stored_job["state"] == 'done':
+                # Already transcoded, it just didn't get moved or renamed.
+                job.encoded = True
+                job.dest_files = stored_job["output_path"].split("\n")
+            else:
+                job_store.update(job.job_id, state='queued', queued_at=time.time())
 
+        job.media = media[(watch, file)]
+        if found_at is not None:
+            job.ready_wait = time.monotonic() - found_at
+            metrics.observe("autotranscode_phase_duration_seconds",
+                            job.ready_wait, phase="ready")
+        if job.media is not None and job.media.duration:
+            job.total_dur = job.media.duration
 
-# Helper function for converting timestamps to ms
-# Hat tip: Werner Robitza :: https://gist.github.com/slhck
-def to_ms(s=None, des=None, **kwargs) -> float:
+        if found_at is None:
+            found_at = time.monotonic()
 
-    if s:
-        hour = int(s[0:2])
-        minute = int(s[3:5])
-        sec = int(s[6:8])
-        ms = int(s[10:11])
-    else:
-        hour = int(kwargs.get("hour", 0))
-        minute = int(kwargs.get("min", 0))
-        sec = int(kwargs.get("sec", 0))
-        ms = int(kwargs.get("ms", 0))
+        with state_lock:
+            watch.active_files.add(file)
+        entries.append((queue_key(job, found_at), next(queue_counter), job))
 
-    result = (hour * 60 * 60 * 1000) + (minute * 60 * 1000) + (sec * 1000) + ms
-    if des and isinstance(des, int):
-        return round(result, des)
-    return result
+    for entry in sorted(entries):
+        job_queue.put(entry)
 
 
-# Helper function for creating a neat-looking progress bar
-def progress_bar(percentage):
+# Helper function - work out where a job goes in the queue. Lower keys are
+# transcoded first: by priority tag, then by the queue order's measure, with
+# aging taken off for the time the job's been waiting. (Everything in the
+# queue ages at the same rate, so taking off the time since some fixed point
+# until the job showed up is the same as taking off how long it's waited, and
+# the key never has to change.)
+def queue_key(job, arrived_at):
 
-    # Sanity check - percentage must be 0..100
-    # NOTE: Sometimes transcodes will exceed 100%.
-    if percentage < 0:
-        percentage = 0
-    if percentage > 100:
-        percentage = 100
+    tag = priority_regex.search(job.file)
+    priority = int(tag.group(1)) if tag else 5
 
+    if queue_order == 'smallest':
+        try:
+            cost = os.path.getsize(os.path.join(job.watch.source_dir, job.file)) / 1048576
+        except OSError:
+            cost = 0
 
-    # Calculate how much of a progress bar should be shown based on the
-    # percentage value.
-    block = int(round(bar_length * (percentage / 100)))
+    elif queue_order == 'shortest' and job.total_dur:
+        cost = job.total_dur / 1000
 
-    # Make an empty holder for the remaining time text.
-    remaining_time = '??:??:??'
+    elif queue_order == 'shortest':
+        # Couldn't tell how long it is, so guess it's as long as a typical
+        # file, and let it age like the rest.
+        cost = percentile(probed_durations, 50) if len(probed_durations) > 0 else 0
 
-    # Calculate an ETA based on (current time - start time) extrapolated to 100%
-    # but don't bother if we're below 10% as the calculation will be largely
-    # meaningless in the early part of the job.
-    if percentage >= 10:
+    else:
+        return (priority, arrived_at)
 
-        # Get the current time, then the difference from start.
-        current_time = datetime.datetime.now()
-        time_diff = current_time - start_time
+    return (priority, cost + queue_aging * arrived_at)
 
-        # Calculate ETA (well, est. time remaining) from time thus far and
-        # percentage complete.
-        total_time = (time_diff.total_seconds() * 100) / percentage
-        eta = total_time * ((100 - percentage) / 100)
 
-        # Break the ETA down into days/hours/mins/secs, and build display
-        # text based on the results.
-        (days, remainder) = divmod(eta, 86400)
-        (hours, remainder) = divmod(remainder, 3600)
-        (minutes, seconds) = divmod(remainder, 60)   
-        days = int(days)
-        hours = int(hours)
-        minutes = int(minutes)
-        seconds = int(seconds)
-        if eta > 86400:
-            remaining_time = ("{}:{:02d}:{:02d}:{:02d}  "
-                              . format(days, hours, minutes, seconds))
-        elif eta > 3600:
-            remaining_time = ("{}:{:02d}:{:02d}  "
-                              . format(hours, minutes, seconds))
-        elif eta > 60:
-            remaining_time = "00:{:02d}:{:02d}  " . format(minutes, seconds)
-        else:        
-            remaining_time = "{}s     " . format(seconds)
+# Worker thread - pulls jobs off the shared queue and transcodes them until
+# told to stop.
+def transcode_worker():
 
-    # Fetch the global throbber step var - we're using a global so it retains
-    # its value outside this function.
-    global throbber_step
+    while True:
 
+        # Wait for a job.
+        (_, _, job) = job_queue.get()
 
-    # Build the progress bar. (The "\033[?25l" at the end turns the cursor off
-    # so it doesn't blink at the end of the bar.)
-    if os.name == 'nt':
-        bar_text = ("{0}    [{1}{2}] : {3:0.2f}% / {4}" 
-                    . format(throbber[throbber_step],
-                             "#" * block,
-                             "-" * (bar_length - block),
-                             percentage,
-                             remaining_time))
+        job.queue_wait = time.monotonic() - job.queued_at
+        metrics.observe("autotranscode_phase_duration_seconds",
+                        job.queue_wait, phase="queue")
+
+        handed_over = False
+        try:
+            handed_over = transcode_file(job)
+        except Exception as error:
+            # Log the error, and deal with it like a failed transcode.
+            write_log("*** ERROR in transcode of {}!" . format(job.file), "ERROR")
+            write_log(traceback.format_exc(), "ERROR")
+            handed_over = fail_job(job, "{}: {}" . format(type(error).__name__, error),
+                                   error_is_transient(error))
+        finally:
+            # Unless it's been handed over to be checked, or is waiting for a
+            # retry, we're done with it.
+            if not handed_over:
+                release_job(job)
+            job_queue.task_done()
+
+
+# Helper function - hand a queued job to a remote worker, waiting a few
+# seconds for one if the queue's empty. Jobs that don't need ffmpeg are dealt
+# with here, like a local worker would. Returns the message for the worker, or
+# None if there's nothing to hand out.
+def lease_job(host, lease_ids):
+
+    deadline = time.monotonic() + loop_delay
+    while True:
+        try:
+            (_, _, job) = job_queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+        except queue.Empty:
+            return None
+
+        job.queue_wait = time.monotonic() - job.queued_at
+        metrics.observe("autotranscode_phase_duration_seconds",
+                        job.queue_wait, phase="queue")
+
+        try:
+            if prepare_job(job):
+                break
+        except Exception as error:
+            write_log("*** ERROR in transcode of {}!" . format(job.file), "ERROR")
+            write_log(traceback.format_exc(), "ERROR")
+            if not fail_job(job, "{}: {}" . format(type(error).__name__, error),
+                            error_is_transient(error)):
+                release_job(job)
+        finally:
+            job_queue.task_done()
+
+    write_log("  Handing {} over to remote worker {}..." . format(job.file, host), "INFO")
+
+    job.start_time = datetime.datetime.now()
+    job_store.start(job.job_id)
+
+    with state_lock:
+        running_jobs.append(job)
+        lease_id = next(lease_counter)
+        leases[lease_id] = {"job": job, "host": host,
+                            "expires": time.monotonic() + lease_time}
+    lease_ids.add(lease_id)
+
+    # The outputs go by preset name (or the custom command line), and the
+    # worker builds them itself - the presets' passthrough rules can't be
+    # sent as JSON.
+    if job.watch.outputs[0]["name"] == "custom":
+        (custom, preset_names) = (job.watch.outputs[0]["cmdline"], [])
     else:
-        bar_text = ("{0}    [\033[42m{1}\033[0m{2}] : {3:0.2f}% / {4}\033[?25l" 
-                    . format(throbber[throbber_step],
-                             ">" * block,
-                             "-" * (bar_length - block),
-                             percentage,
-                             remaining_time))
+        (custom, preset_names) = ([], [output["name"] for output in job.watch.outputs])
 
-    # Handle throbber text, which is basically changing a step counter.
-    throbber_step += 1
-    if throbber_step >= len(throbber):
-       throbber_step = 0
+    return {"op": "job", "lease": lease_id, "lease_time": lease_time,
+            "job_id": job.job_id, "watch": job.watch.name, "file": job.file,
+            "custom": custom, "presets": preset_names,
+            "container": job.watch.outputs[0]["ext"]}
 
-    # We're done, so return the completed progress bar.
-    return bar_text
 
+# Helper function - take a job back from a remote worker. Returns the lease,
+# or None if it's already expired.
+def end_lease(lease_id):
 
-# Helper function - check to see if a file is being used by another process.
-def file_is_in_use(file):
+    with state_lock:
+        lease = leases.pop(lease_id, None)
+        if lease is not None and lease["job"] in running_jobs:
+            running_jobs.remove(lease["job"])
 
-    # We'll take one of two approaches to this, depending on the platform.
+    return lease
 
-    if os.name == 'nt':
 
-        # For Windows, we'll try to rename the file to the same name. If it
-        # fails with an error, e.g., access-denied, something's working on/with
-        # the file.
-        try:
-            os.rename(file, file)
-            return False
-        except:
-            return True
+# Helper function - deal with a remote worker's report that it's finished a
+# job, the same way a local worker deals with ffmpeg finishing.
+def finish_remote_job(job, host, report):
 
+    job.cpu_time = report.get("cpu_time")
+    job.error_tail.clear()
+    job.error_tail.extend(report.get("error_tail") or [])
+    returncode = report.get("returncode", 1)
+
+    handed_over = False
+    try:
+        if returncode != 0:
+            write_log("  Transcode of {} on remote worker {} failed." . format(job.file, host), "ERROR")
+
+            # Retry it later or give up on it, depending on what went wrong.
+            reason = "ffmpeg on {} exited with code {}" . format(host, returncode)
+            if len(job.error_tail) > 0:
+                reason += " - " + job.error_tail[-1]
+            handed_over = fail_job(job, reason, failure_is_transient(returncode, job.error_tail))
+            return
+
+        encode_succeeded(job)
+
+        # Check it over and finish it off here - the worker can move on.
+        verify_pool.submit(finish_job, job, job.cache_key)
+        handed_over = True
+
+    except Exception as error:
+        write_log("*** ERROR in finishing {}!" . format(job.file), "ERROR")
+        write_log(traceback.format_exc(), "ERROR")
+        handed_over = fail_job(job, "{}: {}" . format(type(error).__name__, error),
+                               error_is_transient(error))
+
+    finally:
+        if not handed_over:
+            release_job(job)
+
+
+# Helper function - answer one request from a remote worker.
+def coordinator_request(message, host, lease_ids):
+
+    request = message.get("op")
+
+    # The worker wants a job.
+    if request == "lease":
+        return lease_job(host, lease_ids) or {"op": "none"}
+
+    # The worker's still going - extend its lease, and pass its progress on.
+    if request == "heartbeat":
+        with state_lock:
+            lease = leases.get(message.get("lease"))
+            if lease is not None:
+                lease["expires"] = time.monotonic() + lease_time
+        if lease is None:
+            return {"op": "lost"}
+
+        job = lease["job"]
+        if job.total_dur is None and message.get("total_dur"):
+            job.total_dur = message["total_dur"]
+        if message.get("progress") is not None:
+            job.prog_pct = message.get("prog_pct") or 0
+            publish_progress(job, FfmpegProgress(message["progress"]))
+        return {"op": "ok"}
+
+    # The worker can't do this job - put it back for someone else.
+    if request == "release":
+        lease = end_lease(message.get("lease"))
+        if lease is not None:
+            lease["job"].attempts -= 1
+            requeue_job(lease["job"])
+        return {"op": "ok"}
+
+    # The worker's finished.
+    if request == "done":
+        lease = end_lease(message.get("lease"))
+        if lease is None:
+            return {"op": "lost"}
+        finish_remote_job(lease["job"], host, message)
+        return {"op": "ok"}
+
+    return {"op": "error", "error": "unknown request"}
+
+
+# Coordinator connection - one per remote worker thread. Each line from the
+# worker is a request in JSON, answered with a line of JSON.
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        host = self.client_address[0]
+        lease_ids = set()
+        try:
+            for line in self.rfile:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    break
+                host = message.get("host", host)
+
+                # Whatever goes wrong with one request, the worker still gets
+                # an answer, and the connection carries on.
+                try:
+                    reply = json.dumps(coordinator_request(message, host, lease_ids))
+                except Exception as error:
+                    write_log("*** ERROR answering remote worker {}!" . format(host), "ERROR")
+                    write_log(traceback.format_exc(), "ERROR")
+                    reply = json.dumps({"op": "error", "error": "{}: {}" . format(type(error).__name__, error)})
+                self.wfile.write((reply + "\n").encode())
+        except OSError:
+            pass
+        finally:
+            # If the worker's gone, so are its jobs - there's no need to wait
+            # for their leases to run out.
+            with state_lock:
+                for lease_id in lease_ids:
+                    if lease_id in leases:
+                        leases[lease_id]["expires"] = 0
+
+
+# Coordinator server - a thread per remote worker connection.
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+# Coordinator thread - takes back jobs from remote workers that have stopped
+# checking in. It counts as a failed attempt, in case it was the file that
+# took the worker down.
+def lease_reaper():
+
+    while True:
+        time.sleep(1)
+
+        now = time.monotonic()
+        with state_lock:
+            expired = [lease_id for (lease_id, lease) in leases.items()
+                       if lease["expires"] < now]
+
+        for lease_id in expired:
+            lease = end_lease(lease_id)
+            if lease is None:
+                continue
+            write_log("  Remote worker {} stopped checking in on {}."
+                      . format(lease["host"], lease["job"].file), "WARN")
+            if not fail_job(lease["job"], "remote worker {} stopped checking in"
+                            . format(lease["host"]), True):
+                release_job(lease["job"])
+
+
+# Connection to the coordinator, for a remote worker. Requests go one at a
+# time, each getting one reply. If the connection drops, it's opened again on
+# the next request.
+class CoordinatorLink:
+
+    def __init__(self, address):
+        (host, _, port) = address.rpartition(":")
+        self.address = (host.strip("[]"), int(port))
+        self.connection = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    # Send a request and wait for the reply. Raises OSError if the
+    # coordinator can't be reached.
+    def request(self, message):
+        message["host"] = "{}:{}" . format(platform.node(), os.getpid())
+        with self.lock:
+            try:
+                if self.connection is None:
+                    self.connection = socket.create_connection(self.address, timeout=loop_delay * 6)
+                    self.reader = self.connection.makefile('rb')
+                self.connection.sendall((json.dumps(message) + "\n").encode())
+                reply = self.reader.readline()
+                if reply == b'':
+                    raise OSError("the coordinator closed the connection")
+                return json.loads(reply)
+            except (OSError, ValueError) as error:
+                self.close()
+                if isinstance(error, ValueError):
+                    raise OSError("the coordinator sent a garbled reply")
+                raise
+
+    def close(self):
+        if self.connection is not None:
+            self.reader.close()
+            self.connection.close()
+        self.connection = None
+        self.reader = None
+
+
+# Helper function - transcode a job leased from the coordinator, checking in
+# with it every so often, and report back how it went. The coordinator does
+# the rest - checking the outputs and moving the source.
+def run_remote_job(link, lease):
+
+    # Find where the job's watch folder is on this machine.
+    local_watch = None
+    for watch in watches:
+        if watch.name == lease["watch"]:
+            local_watch = watch
+    unknown_presets = [name for name in lease["presets"] if name not in presets]
+    if local_watch is None or len(unknown_presets) > 0:
+        if local_watch is None:
+            write_log("No watch folder '{}' here for {} - handing it back."
+                      . format(lease["watch"], lease["file"]), "ERROR")
+        else:
+            write_log("No preset(s) {} here for {} - handing it back."
+                      . format(", " . join(unknown_presets), lease["file"]), "ERROR")
+        try:
+            link.request({"op": "release", "lease": lease["lease"]})
+        except OSError:
+            pass
+        time.sleep(loop_delay)
+        return
+
+    outputs = build_outputs(lease["custom"], lease["presets"], lease["container"])
+    job = TranscodeJob(Watch(local_watch.name, local_watch.source_dir, local_watch.dest_dir,
+                             '', local_watch.file_exts, outputs),
+                       lease["file"], lease["job_id"])
+
+    write_log("", "INFO")
+    write_log(" Leased {} from the coordinator..." . format(job.file), "INFO")
+
+    # Check in a few times per lease. If the coordinator says it's given up
+    # on us, or can't be reached for a whole lease, stop ffmpeg - the job's
+    # been (or will be) handed to someone else.
+    finished = threading.Event()
+    def heartbeat():
+        last_reply = time.monotonic()
+        while not finished.wait(lease["lease_time"] / 4):
+            try:
+                reply = link.request({"op": "heartbeat", "lease": lease["lease"],
+                                      "total_dur": job.total_dur, "prog_pct": job.prog_pct,
+                                      "progress": job.progress.fields if job.progress is not None else None})
+            except OSError:
+                if time.monotonic() - last_reply > lease["lease_time"] and not job.cancel.is_set():
+                    write_log("  Lost touch with the coordinator - stopping {}." . format(job.file), "WARN")
+                    job.cancel.set()
+                continue
+            last_reply = time.monotonic()
+            if reply.get("op") == "lost" and not job.cancel.is_set():
+                write_log("  The coordinator took {} back - stopping it." . format(job.file), "WARN")
+                job.cancel.set()
+    heartbeat_thread = threading.Thread(target=heartbeat, name="heartbeat", daemon=True)
+    heartbeat_thread.start()
+
+    f_log = None
+    returncode = 1
+    try:
+        job.media = probe_file(job.watch, job.file)
+        if job.media is not None and job.media.duration:
+            job.total_dur = job.media.duration
+        build_cmdline(job)
+        os.makedirs(os.path.dirname(job.dest_files[0]), exist_ok=True)
+
+        write_log("  Handing over to FFMPEG for transcode of {}..." . format(job.file), "INFO")
+        job.start_time = datetime.datetime.now()
+        with state_lock:
+            running_jobs.append(job)
+        if save_ffmpeg_output == True:
+            f_log = open_ffmpeg_log(job)
+
+        returncode = encode_job(job, f_log, '')
+
+    except Exception as error:
+        write_log("*** ERROR in transcode of {}!" . format(job.file), "ERROR")
+        write_log(traceback.format_exc(), "ERROR")
+        job.error_tail.append("{}: {}" . format(type(error).__name__, error))
+
+    finally:
+        finished.set()
+        heartbeat_thread.join()
+        with state_lock:
+            if job in running_jobs:
+                running_jobs.remove(job)
+        if f_log is not None:
+            f_log.close()
+
+    # If it was taken back, the coordinator's already dealt with it.
+    if job.cancel.is_set():
+        return
+
+    # Report back. If the coordinator can't be reached before the lease runs
+    # out, it'll have given the job to someone else anyway.
+    give_up_at = time.monotonic() + lease["lease_time"]
+    while True:
+        try:
+            reply = link.request({"op": "done", "lease": lease["lease"], "returncode": returncode,
+                                  "error_tail": list(job.error_tail), "cpu_time": job.cpu_time})
+            break
+        except OSError as error:
+            if time.monotonic() > give_up_at:
+                write_log("  Couldn't tell the coordinator about {} ({})." . format(job.file, error), "ERROR")
+                return
+            time.sleep(1)
+
+    if reply.get("op") == "lost":
+        write_log("  The coordinator had already taken {} back." . format(job.file), "WARN")
+    elif returncode == 0:
+        write_log("  Transcode of {} done - handed back to the coordinator." . format(job.file), "INFO")
     else:
+        write_log("  Transcode of {} failed (ffmpeg exited with code {})."
+                  . format(job.file, returncode), "ERROR")
 
-        # For Linux, we'll invoke "fuser" with the "-u" switch to see what
-        # users are accessing the file.
-        is_file_open = subprocess.Popen(
-            ['fuser -u "' + os.path.join(source_dir, file) + '"'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=False,
-            shell=True,
-        )
-        file_users = is_file_open.stdout.read().decode("utf8", errors="replace").strip()
 
-        return (file_users != "")
+# Worker thread (remote worker mode) - leases jobs from the coordinator and
+# transcodes them, one at a time.
+def remote_worker():
+
+    link = CoordinatorLink(worker_address)
+    while True:
+        try:
+            reply = link.request({"op": "lease"})
+        except OSError as error:
+            write_log("Can't reach the coordinator at {} ({}) - trying again shortly."
+                      . format(worker_address, error), "WARN")
+            time.sleep(loop_delay)
+            continue
+
+        if reply.get("op") == "job":
+            run_remote_job(link, reply)
+        elif reply.get("op") == "error":
+            write_log("The coordinator couldn't hand out a job ({}) - trying again shortly."
+                      . format(reply.get("error")), "WARN")
+            time.sleep(loop_delay)
+
+
+# Set up the metrics.
+metrics = Metrics()
+metrics.define("autotranscode_queue_depth", "gauge",
+               "Files queued and waiting for a worker.")
+metrics.define("autotranscode_jobs_in_flight", "gauge",
+               "Files being transcoded right now.")
+metrics.define("autotranscode_jobs_leased", "gauge",
+               "Files being transcoded right now by remote workers.")
+metrics.define("autotranscode_candidates", "gauge",
+               "Files found but not ready to transcode yet.")
+metrics.define("autotranscode_jobs_completed_total", "counter",
+               "Transcodes that finished successfully.")
+metrics.define("autotranscode_jobs_failed_total", "counter",
+               "Transcodes that failed.")
+metrics.define("autotranscode_jobs_retried_total", "counter",
+               "Failed transcodes that were scheduled for another try.")
+metrics.define("autotranscode_cache_hits_total", "counter",
+               "Transcodes copied from the output cache instead of being run.")
+metrics.define("autotranscode_bytes_in_total", "counter",
+               "Bytes of source files transcoded.")
+metrics.define("autotranscode_bytes_out_total", "counter",
+               "Bytes of transcoded files written.")
+metrics.define("autotranscode_encode_speed_ratio", "histogram",
+               "Encoding speed as a multiple of real time, from each ffmpeg progress report.",
+               [0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64])
+metrics.define("autotranscode_encode_fps", "histogram",
+               "Encoding rate in frames per second, from each ffmpeg progress report.",
+               [1, 5, 15, 30, 60, 120, 240, 480, 960])
+metrics.define("autotranscode_phase_duration_seconds", "histogram",
+               "Time spent in each phase: ready (from being found until it's "
+               "settled and not in use), in_use_check, probe, queue (waiting "
+               "for a worker), encode, verify and finalize.",
+               [0.01, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 1800, 3600, 7200, 14400, 43200])
+
+
+# Open the metrics server's port, if there is one.
+metrics_server = None
+if metrics_listen != '':
+    (metrics_address, _, metrics_port) = metrics_listen.rpartition(":")
+    try:
+        metrics_server = http.server.ThreadingHTTPServer(
+            (metrics_address.strip("[]"), int(metrics_port)), MetricsHandler)
+    except OSError as error:
+        print("Can't serve metrics on '{}' ({}) - please check your command line "
+              "or config file." . format(metrics_listen, error))
+        quit()
+    metrics_server.daemon_threads = True
+
+
+# Open the coordinator's port for remote workers, if there is one.
+coordinator_server = None
+if coordinator_listen != '':
+    (coordinator_address, _, coordinator_port) = coordinator_listen.rpartition(":")
+    try:
+        coordinator_server = CoordinatorServer(
+            (coordinator_address.strip("[]"), int(coordinator_port)), CoordinatorHandler)
+    except OSError as error:
+        print("Can't listen for remote workers on '{}' ({}) - please check your command line "
+              "or config file." . format(coordinator_listen, error))
+        quit()
+
+
+# Record encode speed from the progress reports. (The dashboard picks them up
+# on its own schedule.)
+progress_subscribers.append(record_progress_metrics)
+
+# Only draw the dashboard on a terminal. Windows consoles need to be told to
+# understand the escape codes it uses.
+if not sys.stdout.isatty():
+    show_dashboard = False
+if show_dashboard and os.name == 'nt':
+    console_handle = ctypes.windll.kernel32.GetStdHandle(-11)
+    console_mode = ctypes.c_uint32()
+    if ctypes.windll.kernel32.GetConsoleMode(console_handle, ctypes.byref(console_mode)):
+        # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+        ctypes.windll.kernel32.SetConsoleMode(console_handle, console_mode.value | 0x0004)
+
+
+# Start the pool of threads that run ffprobe, and the pool that checks
+# finished transcodes.
+probe_pool = concurrent.futures.ThreadPoolExecutor(max_workers=probe_jobs)
+verify_pool = concurrent.futures.ThreadPoolExecutor(max_workers=verify_jobs)
+
+
+# Run the preset benchmark if asked, then quit. Each output is benchmarked on
+# its own against every test clip, using the same command line building as a
+# normal transcode.
+if run_benchmark:
+
+    source_dir = tempfile.mkdtemp(prefix="autotranscode-bench-")
+
+    # Find out which ffmpeg we're benchmarking.
+    ffmpeg_version = subprocess.run(
+        [ffmpeg_location, "-version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        universal_newlines=True).stdout.split("\n")[0]
+
+    print("Benchmarking {} on {} ({} CPUs)..." . format(ffmpeg_version, platform.node(),
+                                                       os.cpu_count()))
+    print("")
+
+    # Make the test clips.
+    for clip in benchmark_clips:
+        clip["file"] = clip["name"] + ".mkv"
+        print("Generating test clip {} ({}, {} FPS, {}s)..."
+              . format(clip["name"], clip["size"], clip["rate"], clip["duration"]))
+        generate = subprocess.run(
+            " " . join([ffmpeg_location, "-y", "-v error",
+                        '-f lavfi -i "testsrc2=size={}:rate={}:duration={}"'
+                        . format(clip["size"], clip["rate"], clip["duration"]),
+                        '-f lavfi -i "sine=frequency=440:sample_rate=48000:duration={}"'
+                        . format(clip["duration"]),
+                        "-c:v libx264", "-preset veryfast", "-crf 18", "-pix_fmt yuv420p",
+                        "-g {}" . format(clip["rate"]), "-c:a aac", "-b:a 192k", "-shortest",
+                        '"' + os.path.join(source_dir, clip["file"]) + '"']),
+            shell=True)
+        if generate.returncode != 0:
+            print("Couldn't generate test clip {} - check that ffmpeg has the lavfi, "
+                  "libx264 and aac components." . format(clip["name"]))
+            shutil.rmtree(source_dir)
+            quit()
+    print("")
+
+    # Transcode every clip with every output, one at a time.
+    results = {}
+    for output in watches[0].outputs:
+        benchmark_watch = Watch("benchmark", source_dir, source_dir, '', file_exts, [output])
+        for clip in benchmark_clips:
+
+            job = TranscodeJob(benchmark_watch, clip["file"], None)
+            build_cmdline(job)
+            last_progress = []
+            cpu_times = []
+
+            start_time = time.monotonic()
+            returncode = run_ffmpeg(job.cmdline, None, '', lambda total_dur: None,
+                                    last_progress.append, cpu_times.append)
+            wall_time = time.monotonic() - start_time
+
+            result_name = "{}/{}" . format(output["name"], clip["name"])
+            if returncode != 0:
+                print("{:<20} FAILED (ffmpeg returned {})" . format(result_name, returncode))
+                results[result_name] = None
+                continue
+
+            frames = 0
+            if len(last_progress) > 0 and last_progress[-1].frame is not None:
+                frames = last_progress[-1].frame
+            results[result_name] = {
+                "wall_time": wall_time,
+                "fps": frames / wall_time,
+                "speed": clip["duration"] / wall_time,
+                "cpu_time": sum(cpu_times) if len(cpu_times) > 0 else None,
+                "output_size": sum(os.path.getsize(dest_file) for dest_file in job.dest_files),
+            }
+            print("{:<20} {:>8.1f} fps  {:>7.2f}x  cpu {:>8}  {:>10} bytes"
+                  . format(result_name, results[result_name]["fps"],
+                           results[result_name]["speed"],
+                           "{:0.1f}s" . format(results[result_name]["cpu_time"])
+                           if results[result_name]["cpu_time"] is not None else "n/a",
+                           results[result_name]["output_size"]))
+            for dest_file in job.dest_files:
+                os.remove(dest_file)
+
+    shutil.rmtree(source_dir)
+    print("")
+
+    # Compare against the baseline, if there is one. Slower, more CPU time or
+    # bigger files than the baseline allows for are regressions.
+    regressions = 0
+    if os.path.isfile(benchmark_baseline) and not save_baseline:
+        with open(benchmark_baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        print("Compared with the baseline from {} ({}):"
+              . format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(baseline["created"])),
+                       baseline["ffmpeg"]))
+        limit = benchmark_tolerance / 100
+        for (result_name, result) in results.items():
+            before = baseline["results"].get(result_name)
+            if before is None:
+                print("  {:<20} not in baseline" . format(result_name))
+                continue
+            flags = []
+            if result is None:
+                flags.append("FAILED")
+            else:
+                if result["speed"] < before["speed"] * (1 - limit):
+                    flags.append("SLOWER ({:+0.0f}% speed)"
+                                 . format((result["speed"] / before["speed"] - 1) * 100))
+                if (result["cpu_time"] is not None and before["cpu_time"]
+                        and result["cpu_time"] > before["cpu_time"] * (1 + limit)):
+                    flags.append("MORE CPU ({:+0.0f}%)"
+                                 . format((result["cpu_time"] / before["cpu_time"] - 1) * 100))
+                if result["output_size"] > before["output_size"] * (1 + limit):
+                    flags.append("BIGGER ({:+0.0f}%)"
+                                 . format((result["output_size"] / before["output_size"] - 1) * 100))
+            if len(flags) > 0:
+                regressions += 1
+                print("  {:<20} REGRESSION: {}" . format(result_name, ", " . join(flags)))
+            else:
+                print("  {:<20} ok" . format(result_name))
+        print("")
+        print("{} regression(s) found." . format(regressions))
+
+    else:
+        # No baseline yet (or asked to replace it), so this run becomes it.
+        with open(benchmark_baseline, 'w') as baseline_file:
+            json.dump({"created": time.time(), "ffmpeg": ffmpeg_version,
+                       "host": platform.node(), "cpus": os.cpu_count(),
+                       "results": results}, baseline_file, indent=2)
+        print("Saved results as the baseline in '{}'." . format(benchmark_baseline))
+
+    sys.exit(1 if regressions > 0 else 0)
+
+
+# Open the output cache, if there is one.
+output_cache = None
+if cache_dir != '':
+    output_cache = OutputCache(cache_dir, cache_size * 1024 * 1024 * 1024)
+
+
+# Directories we put files in aren't watched, in case they're under a source
+# directory, and neither are other watch folders' source directories.
+for skipped_dir in (quarantine_dir, cache_dir, ffmpeg_log_dir):
+    if skipped_dir != '':
+        skipped_dirs.add(os.path.realpath(skipped_dir))
+for watch in watches:
+    for skipped_dir in (watch.source_dir, watch.dest_dir, watch.storage_dir):
+        if skipped_dir != '':
+            skipped_dirs.add(os.path.realpath(skipped_dir))
+
+
+# Pick a directory watcher backend, falling back to polling if inotify isn't
+# available (unless it was asked for specifically). Shared source directories
+# are always polled - inotify can't see files written by other machines, and
+# wouldn't tell us again about a file another instance claimed if that claim
+# later died.
+if claim_files:
+    watch_backend = 'poll'
+elif watch_backend != 'poll' and worker_address == '':
+    try:
+        inotify_fd = inotify_open()
+        watch_backend = 'inotify'
+    except OSError as error:
+        if watch_backend == 'inotify':
+            print("Can't watch the source directory with inotify ({}) - use "
+                  "'-watch poll' instead." . format(error))
+            quit()
+        watch_backend = 'poll'
 
 
 # Start the log...
@@ -1023,20 +6344,58 @@ write_log("", "INFO")
 write_log("", "INFO")
 write_log("", "INFO")
 write_log("Automatic FFMPEG Transcoding Handler starting...", "INFO")
-write_log(" * Transcode mode:", "INFO")
-write_log("   {}" . format(trans_mode), "INFO")
-write_log(" * Watching path:", "INFO")
-write_log("   '{}'" . format(source_dir), "INFO")
-write_log(" * Watching for the following file extensions:", "INFO")
-write_log("   {}" . format(file_exts), "INFO")
-write_log(" * Storing transcoded files in path:", "INFO")
-write_log("   '{}'" . format(dest_dir), "INFO")
-if storage_dir != '':
-    write_log(" * Storing original files after transcoding in path:", "INFO") 
-    write_log("   '{}'" . format(storage_dir), "INFO")
+if worker_address != '':
+    write_log(" * Working for the coordinator at:", "INFO")
+    write_log("   {}" . format(worker_address), "INFO")
+    for watch in watches:
+        write_log(" * Shared folders for watch folder '{}':" . format(watch.name), "INFO")
+        write_log("   '{}' -> '{}'" . format(watch.source_dir, watch.dest_dir), "INFO")
+    write_log(" * Running up to {} transcode(s) at once." . format(worker_count), "INFO")
 else:
-    write_log(" * Original files will have filename extensions changed after ", "INFO")
-    write_log("   transcoding.", "INFO")
+    for watch in watches:
+        if len(watches) > 1:
+            write_log(" * Watch folder '{}':" . format(watch.name), "INFO")
+        write_log(" * Transcode mode:", "INFO")
+        for output in watch.outputs:
+            write_log("   {}" . format(output["description"]), "INFO")
+        write_log(" * Watching path:", "INFO")
+        write_log("   '{}'" . format(watch.source_dir), "INFO")
+        write_log(" * Watching for the following file extensions:", "INFO")
+        write_log("   {}" . format(watch.file_exts), "INFO")
+        write_log(" * Storing transcoded files in path:", "INFO")
+        write_log("   '{}'" . format(watch.dest_dir), "INFO")
+        if watch.storage_dir != '':
+            write_log(" * Storing original files after transcoding in path:", "INFO") 
+            write_log("   '{}'" . format(watch.storage_dir), "INFO")
+        else:
+            write_log(" * Original files will have filename extensions changed after ", "INFO")
+            write_log("   transcoding.", "INFO")
+    write_log(" * Running up to {} transcode(s) at once across all watch folders." . format(worker_count), "INFO")
+    write_log(" * Watching for new files using:", "INFO")
+    write_log("   {}" . format(watch_backend), "INFO")
+    if quiet_period > 0:
+        write_log(" * Waiting for files to stay unchanged for:", "INFO")
+        write_log("   {} seconds" . format(quiet_period), "INFO")
+    if not handle_check:
+        write_log(" * Not checking whether files are open in other programs.", "INFO")
+    if recursive:
+        write_log(" * Watching subdirectories too.", "INFO")
+    if claim_files:
+        write_log(" * Claiming files before transcoding them, as:", "INFO")
+        write_log("   {} (process {})" . format(claim_host, os.getpid()), "INFO")
+if metrics_listen != '':
+    write_log(" * Serving metrics at:", "INFO")
+    write_log("   http://{}/metrics" . format(metrics_listen if ":" in metrics_listen
+                                              else "localhost:" + metrics_listen), "INFO")
+if metrics_file != '':
+    write_log(" * Writing metrics to file:", "INFO")
+    write_log("   '{}'" . format(metrics_file), "INFO")
+if cache_dir != '':
+    write_log(" * Keeping a cache of transcodes in path:", "INFO")
+    write_log("   '{}'" . format(cache_dir), "INFO")
+if coordinator_listen != '':
+    write_log(" * Handing out jobs to remote workers on:", "INFO")
+    write_log("   {}" . format(coordinator_listen), "INFO")
 write_log("", "INFO")
 write_log("Starting monitor loop...", "INFO")
 
@@ -1044,274 +6403,244 @@ write_log("Starting monitor loop...", "INFO")
 # Wrap the endless loop in a try/except.
 try:
 
-    # The eternal loop!
-    while (True):
-
-        # Our loop will look for and enumerate files within the source directory
-        # that end in one of the extensions we watch for. 
-
-        # Clear the candidate list - we'll populate this in a moment.
-        candidates.clear()
-
-        # Start by grabbing a list of the source directory
-        dir_contents = os.listdir(source_dir)
-
-        # Enumerare the directory listing
-        for file in dir_contents:
+    # Start serving or writing metrics, if asked.
+    if metrics_server is not None:
+        threading.Thread(target=metrics_server.serve_forever, name="metrics-server",
+                         daemon=True).start()
+    if metrics_file != '':
+        threading.Thread(target=metrics_file_writer, name="metrics-file",
+                         daemon=True).start()
+
+    # Start drawing the dashboard.
+    if show_dashboard:
+        threading.Thread(target=dashboard_updater, name="dashboard",
+                         daemon=True).start()
+
+    # A remote worker doesn't watch for files - it just takes jobs from the
+    # coordinator, as many at a time as it has workers.
+    if worker_address != '':
+        for worker_index in range(worker_count):
+            threading.Thread(target=remote_worker,
+                             name="remote-{}" . format(worker_index + 1),
+                             daemon=True).start()
+        while True:
+            time.sleep(loop_delay)
 
-            # Check to see if the file matches one of our target file
-            # extensions.
-            file_name, file_ext = os.path.splitext(file)
-            if file_ext.lower().strip('.') in file_exts:
+    # Start handing out jobs to remote workers, if asked.
+    if coordinator_server is not None:
+        threading.Thread(target=coordinator_server.serve_forever, name="coordinator",
+                         daemon=True).start()
+        threading.Thread(target=lease_reaper, name="lease-reaper", daemon=True).start()
+
+    # Start renewing claims, if we're claiming files.
+    if claim_files:
+        threading.Thread(target=claim_renewer, name="claim-renewer", daemon=True).start()
+
+    # Start the transcode workers.
+    workers = []
+    for worker_index in range(worker_count):
+        worker = threading.Thread(target=transcode_worker,
+                                  name="transcode-{}" . format(worker_index + 1),
+                                  daemon=True)
+        worker.start()
+        workers.append(worker)
+
+    # Remember which files failed for good last time and are still here, so
+    # they aren't tried again unless they change.
+    for stored_job in job_store.jobs('failed'):
+        (watch, file) = locate_source(stored_job["path"])
+        if watch is None:
+            continue
+        try:
+            file_stat = os.stat(stored_job["path"])
+        except OSError:
+            continue
+        if (file_stat.st_ino, file_stat.st_size) == (stored_job["inode"], stored_job["size"]):
+            watch.failed_files[file] = (file_stat.st_ino, file_stat.st_size)
+
+    # Pick up any jobs that were queued or running when we last stopped.
+    # Files that have since gone away, or been replaced, are dropped.
+    interrupted = job_store.requeue_interrupted()
+    if interrupted > 0:
+        write_log("Requeueing {} interrupted transcode(s)..." . format(interrupted), "INFO")
+    resumed = []
+    for stored_job in job_store.jobs('queued'):
+        (watch, file) = locate_source(stored_job["path"])
+        try:
+            file_stat = os.stat(stored_job["path"])
+        except OSError:
+            file_stat = None
+        if (watch is not None
+                and file_stat is not None
+                and (file_stat.st_ino, file_stat.st_size) == (stored_job["inode"], stored_job["size"])
+                and (watch, file) not in resumed):
+            write_log(" Resuming queued file {}..." . format(file), "INFO")
+            resumed.append((watch, file))
+        else:
+            job_store.update(stored_job["id"], state='dropped', finished_at=time.time())
+    probe_and_queue(resumed)
+
+    # Start the directory watcher.
+    if watch_backend == 'inotify':
+        watcher = threading.Thread(target=run_watcher, args=(inotify_watcher, inotify_fd),
+                                   name="watcher", daemon=True)
+
+        # inotify only tells us about new activity, so do one scan up front
+        # to pick up anything that arrived while we weren't running.
+        for watch in watches:
+            for file in scan_source_dir(watch):
+                watch_events.put((watch, file))
+    else:
+        watcher = threading.Thread(target=run_watcher, args=(poll_watcher,),
+                                   name="watcher", daemon=True)
+    watcher.start()
 
-                # Ooh, we found something!
+    # How long to wait before checking on files that aren't ready yet.
+    recheck_delay = loop_delay_min
 
-                # Have we seen this file before?
-                if file not in candidates:
+    # The eternal loop!
+    while (True):
 
-                    # Nope, so let's add it.
-                    candidates.append(file)
+        # Wait for the watcher to report files. If some files are still in
+        # use, only wait a little while so we can check on them again.
+        try:
+            if any(len(watch.candidates) > 0 for watch in watches):
+                reported = [watch_events.get(timeout=recheck_delay)]
+            else:
+                reported = [watch_events.get()]
+        except queue.Empty:
+            reported = []
+
+        # Grab anything else the watcher has reported in the meantime.
+        while True:
+            try:
+                reported.append(watch_events.get_nowait())
+            except queue.Empty:
+                break
+
+        # Grab the files that are already queued or being transcoded.
+        with state_lock:
+            busy_files = {watch: set(watch.active_files) for watch in watches}
+
+        # Add what the watcher found to the candidate lists.
+        for entry in reported:
+
+            # A None is just a wake-up call.
+            if entry is None:
+                continue
+
+            # An error means the watcher's stopped, and we'd never hear about
+            # another file, so give up.
+            if isinstance(entry, Exception):
+                raise entry
+            (watch, file) = entry
+
+            # Skip files that failed for good, unless they've changed since.
+            if file in watch.failed_files:
+                try:
+                    file_stat = os.stat(os.path.join(watch.source_dir, file))
+                except OSError:
+                    continue
+                if (file_stat.st_ino, file_stat.st_size) == watch.failed_files[file]:
+                    continue
+                with state_lock:
+                    del watch.failed_files[file]
+
+            # Have we seen this file before?
+            if file not in watch.candidates and file not in busy_files[watch]:
+
+                # Nope, so let's add it, and look at it again soon.
+                watch.candidates.append(file)
+                watch.candidate_found[file] = time.monotonic()
+                recheck_delay = loop_delay_min
+
+        # Forget about files that have disappeared since we last looked.
+        for watch in watches:
+            for file in list(watch.candidates):
+                if not os.path.isfile(os.path.join(watch.source_dir, file)):
+                    watch.candidates.remove(file)
+                    watch.candidate_stats.pop(file, None)
+                    watch.candidate_found.pop(file, None)
+
+        candidate_count = sum(len(watch.candidates) for watch in watches)
 
 
         # How 'bout we process what we found, assuming we found anything.
-        if len(candidates) > 0:
+        if candidate_count > 0:
 
             # Log what we're doing. This is here instead of up above the line
-            # that lists the source directory contents so it'll only trigger
-            # if we find files to process. This helps keep the debug logs from
-            # unnecessarily getting too big.
+            # that waits on the watcher so it'll only trigger if we find files
+            # to process. This helps keep the debug logs from unnecessarily
+            # getting too big.
             write_log("", "INFO")
             write_log("Updating directory listing...", "INFO")
 
             # How many candidates did we find?
             write_log("... Done. {} transcoding candidate files found." 
-                      . format(len(candidates)), "INFO")
+                      . format(candidate_count), "INFO")
 
             # Time to do work.
             write_log("Processing transcoding candidate files...", "INFO")
 
-            for file in candidates:
-
-                write_log("", "INFO")
-                write_log(" Found file {} - checking..."
-                          . format(file), "INFO")
-
-
-                # Check to see if any process has the file open. If no users
-                # have a claim on the file, let's do things with/to it.
-                if not file_is_in_use(file):
-
-                    # Note in the log that the file will be transcoded.
-                    write_log("  Handing over to FFMPEG for transcode...", "INFO")
-
-                    # Clear a var for progress monitoring
-                    total_dur = None
-
-                    # Prepare to make a copy of the command line list for this
-                    # file.
-                    this_cmdline.clear()
-
-                    # Start with ffmpeg itself.
-                    this_cmdline.append(ffmpeg_location)
-
-                    # Split off the filename into root name and extension
-                    # (we don't care about the extension).
-                    file_name, _ = os.path.splitext(file)
+            # Take one look at which files are open, and check every
+            # candidate against that.
+            check_start = time.monotonic()
+            if os.name != 'nt' and handle_check:
+                open_files = scan_open_files()
 
+            ready = []
+            for (watch, file) in [(watch, file) for watch in watches for file in watch.candidates]:
 
-                    # Build the command line by performing token replacement as
-                    # required.
-                    for entry in cmdline:
+                write_log("", "INFO")
+                if len(watches) > 1:
+                    write_log(" Found file {} in watch folder '{}' - checking..."
+                              . format(file, watch.name), "INFO")
+                else:
+                    write_log(" Found file {} - checking..."
+                              . format(file), "INFO")
 
-                        #entry = entry.replace("%FFMPEG%", ffmpeg_location)
-                        entry = entry.replace("%SOURCEFILE%", '"' + os.path.join(source_dir, file) + '"')
-                        entry = entry.replace("%DESTFILE%", '"' + os.path.join(dest_dir, file_name + "." + new_ext) + '"')
-                        entry = entry.replace("%SPATH%", source_dir)
-                        entry = entry.replace("%DPATH%", dest_dir)
-                        entry = entry.replace("%NEWEXT%", new_ext)
 
-                        this_cmdline.append(entry)
+                # Check to see if the file has stopped changing, and if any
+                # process has it open. If it's settled and no users have a
+                # claim on the file, queue it up for a worker.
+                if not file_is_settled(watch, file):
+                    # Note in the log that this is an ongoing observation.
+                    write_log(" File hasn't stayed unchanged for the quiet period yet - skipping for now...", "INFO")
 
-                    try:
+                elif handle_check and file_is_in_use(watch, file):
+                    # Note in the log that this is an ongoing observation.
+                    write_log(" File is still in use or being transferred - skipping for now...", "INFO")
 
-                        # Clear the progress percentage variables.
-                        prog_pct = 0
-                        last_prog_pct = 0
-
-                        # Reset the throbber step var.
-                        throbber_step = 0
-
-                        # Get the current time for estimating remaining time.
-                        start_time = datetime.datetime.now()
-
-
-                        # Open a log file if debug mode is enabled.
-                        if save_ffmpeg_output == True:
-                            f_log = open(os.path.join(path, "ffmpeg.log"), 'a')
-
-                            # Start by writing the command line to the
-                            # log, just in case inspecting it is needed.
-                            f_log.write('Command line:\n')
-                            f_log.write(" " . join(this_cmdline) + '\n\n')
-
-                        # Launch ffmpeg
-                        ffmpeg = subprocess.Popen(
-                            " " . join(this_cmdline),
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT,
-                            universal_newlines=False,
-                            shell=True,
-                        )
-
-                        # Loop until ffmpeg finishes.
-                        while True:
-
-                            # Grab a line of output from ffmpeg.
-                            line = ffmpeg.stdout.readline().decode("utf8", errors="replace").strip()
-
-                            # If the line is empty and poll() is no longer None,
-                            # we're done.
-                            if line == "" and ffmpeg.poll() is not None:
-                                break                                
-
-                            # Echo the line of text to the log.
-                            if save_ffmpeg_output == True:
-                                f_log.write(line.strip() + '\n')
-
-                            # Check for progress info and derive a percent
-                            # value of the transcode progress.
-                            # Hat tip: Werner Robitza :: https://gist.github.com/slhck
-                            if not total_dur and dur_regex.search(line):
-                                total_dur = dur_regex.search(line).groupdict()
-                                total_dur = to_ms(**total_dur)
-                                continue
-                            if total_dur:
-                                result = time_regex.search(line)
-                                if result:
-                                    elapsed_time = to_ms(**result.groupdict())
-                                    prog_pct = (elapsed_time / total_dur) * 100
-
-                            # Update the progress, but only if it's changed.
-                            if (prog_pct != last_prog_pct):
-                                progress_bar_text = ("\r{}"
-                                                     . format(progress_bar(prog_pct)))
-                                sys.stdout.write(progress_bar_text)
-                                sys.stdout.flush()
-                                last_prog_pct = prog_pct
-
-
-                        # Check for a non-zero return code (error) from ffmpeg.
-                        if ffmpeg.returncode != 0:
-                            if save_ffmpeg_output == True:
-                                write_log("  Transcode failed. Check the ffmpeg"
-                                          " output log for more information.",
-                                          "ERROR")
-
-                            else:
-                                write_log("  Transcode failed. Enable ffmpeg "
-                                          "output logging with -flog and retry "
-                                          "for more information.",
-                                          "ERROR")
-
-                            # Quit so the transcode failure can be investigated.
-                            sys.exit(0)
-
-
-                        # Get the current time, then the difference from start.
-                        current_time = datetime.datetime.now()
-                        time_diff = current_time - start_time
-
-                        # Create a blank variable for the total time the transcode
-                        # took.
-                        elapsed_time = ''
-
-                        # Break the time difference down into days/hours/mins/secs,
-                        # and build display text based on the results.
-                        (days, remainder) = divmod(time_diff.total_seconds(), 86400)
-                        (hours, remainder) = divmod(remainder, 3600)
-                        (minutes, seconds) = divmod(remainder, 60)   
-                        days = int(days)
-                        hours = int(hours)
-                        minutes = int(minutes)
-                        seconds = int(seconds)
-                        if time_diff.total_seconds() > 86400:
-                            elapsed_time = ("{}:{:02d}:{:02d}:{:02d}"
-                                              . format(days, hours, minutes, seconds))
-                        elif time_diff.total_seconds() > 3600:
-                            elapsed_time = ("{}:{:02d}:{:02d}"
-                                              . format(hours, minutes, seconds))
-                        elif time_diff.total_seconds() > 60:
-                            elapsed_time = "00:{:02d}:{:02d}" . format(minutes, seconds)
-                        else:        
-                            elapsed_time = "{}s" . format(seconds)
-
-
-                        # Write a little bit of whitespace to the log file
-                        # and close it.
-                        if save_ffmpeg_output == True:
-                            f_log.write('\n\n\n')
-                            f_log.close()
-
-
-                        # Transcode complete!
-                        sys.stdout.write('\n')
-                        sys.stdout.flush()
-                        write_log("  Transcode completed in {}."
-                                  . format(elapsed_time), "INFO")
-
-                        # Sleep 5 seconds for everything to settle.
-                        time.sleep(5)
-
-
-                    finally:
-                        # Move the file to storage if a storage directory
-                        # is provided. If not, rename the file.
-                        if storage_dir != '':
-
-                            # We'll be moving it.
-                            write_log("  Moving source file to dir '{}'..." . format(storage_dir), "INFO")
-
-                            # Do the thing!
-                            os.rename(os.path.join(source_dir, file),
-                                    os.path.join(storage_dir, file))
-
-                        else:
-                            # We'll be renaming it.
-                            write_log("  Renaming source file...", "INFO")
-
-                            # Do the thing!
-                            os.rename(os.path.join(source_dir, file),
-                                      os.path.join(source_dir, file + ".processed"))
-
-
-                        # Sleep 5 seconds for file moves/renames to
-                        # follow through.
-                        time.sleep(5)
-
-                        # Aaaaand done.
-                        write_log("  Processing complete.", "INFO")
+                elif claim_files and source_is_claimed(watch, file):
+                    # Note in the log that this is an ongoing observation.
+                    write_log(" File is being transcoded by another instance - skipping for now...", "INFO")
 
-                        # Pad out the log with an empty line.
-                        write_log("", "INFO")
+                else:
+                    write_log("  Queueing for transcode...", "INFO")
 
+                    watch.candidates.remove(file)
+                    watch.candidate_stats.pop(file, None)
+                    ready.append((watch, file))
 
-                else:
-                    # Note in the log that this is an ongoing observation.
-                    write_log(" File is still in use or being transferred - skipping for now...", "INFO")
+            metrics.observe("autotranscode_phase_duration_seconds",
+                            time.monotonic() - check_start, phase="in_use_check")
 
+            # Probe the files that are ready, handing each one over to the
+            # workers as soon as it's been probed.
+            probe_and_queue(ready)
 
-            # Throw a little time delay into the iteration.
-            time.sleep(loop_delay)
+            # If nothing was ready, back off a bit before checking again,
+            # otherwise keep checking on the rest at full speed.
+            if len(ready) > 0:
+                recheck_delay = loop_delay_min
+            else:
+                recheck_delay = min(recheck_delay * 2, loop_delay)
 
 
             # Aaand we're done for now.
             write_log("... Done.", "INFO")
 
 
-        # Sleep for a bit before doing it all again.
-        time.sleep(loop_delay)
-
-
 except SystemExit:
     write_log("Exiting.", "INFO")
 
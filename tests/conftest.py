@@ -0,0 +1,96 @@
+import ast
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "auto_transcode.py")
+
+
+def load_script():
+    """Load the script's functions, classes and module-level settings without
+    running it.
+
+    auto_transcode.py does all of its work at the top level (argument parsing,
+    sanity checks, the monitor loop), so it can't just be imported. Instead,
+    only its imports (optional ones included), definitions, plain assignments
+    and metric definitions are run, leaving every setting at its default.
+    (Assignments that depend on the parsed arguments are skipped.) Tests
+    change settings by assigning to the returned module. Its print() does
+    nothing, so the script's log lines stay out of the test output.
+    """
+    with open(SCRIPT, "r", encoding="utf8") as script_file:
+        tree = ast.parse(script_file.read(), SCRIPT)
+
+    def wanted(node):
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef,
+                             ast.Assign, ast.AnnAssign)):
+            return True
+        # try: import ... except ImportError: blocks, for optional modules.
+        if isinstance(node, ast.Try):
+            return all(isinstance(child, (ast.Import, ast.ImportFrom)) for child in node.body)
+        # metrics.define(...) calls, so the helpers can record metrics.
+        return (isinstance(node, ast.Expr) and isinstance(node.value, ast.Call)
+                and ast.unparse(node.value.func) == "metrics.define")
+
+    module = types.ModuleType("auto_transcode")
+    module.__file__ = SCRIPT
+    module.print = lambda *args, **kwargs: None
+    for node in tree.body:
+        if not wanted(node):
+            continue
+        try:
+            exec(compile(ast.Module([node], []), SCRIPT, "exec"), module.__dict__)
+        except NameError:
+            # Worked out from something set while parsing the arguments.
+            if not isinstance(node, (ast.Assign, ast.AnnAssign)):
+                raise
+    return module
+
+
+@pytest.fixture
+def script():
+    return load_script()
+
+
+@pytest.fixture
+def stub_tools(tmp_path):
+    """A directory holding the scale benchmark's stub ffmpeg and ffprobe."""
+    stub_dir = tmp_path / "bin"
+    stub_dir.mkdir()
+    load_script().write_stub_tools(str(stub_dir), 0.2)
+    return stub_dir
+
+
+def run_script(args, output, timeout=None):
+    """Start the script with the given arguments, as root would run it."""
+    env = dict(os.environ, SUDO_USER=os.environ.get("SUDO_USER", "root"))
+    return subprocess.Popen([sys.executable, "-u", SCRIPT] + args + ["-noprogress"],
+                            stdout=output, stderr=subprocess.STDOUT, env=env)
+
+
+needs_root = pytest.mark.skipif(os.name == 'nt' or os.geteuid() != 0,
+                                reason="the script only runs with elevated privileges")
+
+
+@pytest.fixture
+def watch(script, tmp_path):
+    """A watch folder (transcoding with the YouTube preset) in a scratch
+    directory, set up as the script's only one."""
+    source = tmp_path / "source"
+    dest = tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    watch = script.Watch("default", str(source), str(dest), '', ["mkv", "mov", "mp4"],
+                         script.build_outputs([], ["youtube"], "mov"))
+    script.watches = [watch]
+    return watch
+
+
+@pytest.fixture
+def job_store(script, tmp_path):
+    script.job_store = script.JobStore(str(tmp_path / "jobs.db"))
+    return script.job_store
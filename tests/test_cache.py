@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from test_queue import add_file
+
+
+@pytest.fixture
+def cache(script, tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    return script.OutputCache(str(cache_dir), 0)
+
+
+def test_cache_key_ignores_the_file_name(script, watch, cache):
+    add_file(watch, "a.mkv")
+    add_file(watch, "b.mkv")
+    assert cache.key_for(script.TranscodeJob(watch, "a.mkv", 1)) == \
+        cache.key_for(script.TranscodeJob(watch, "b.mkv", 1))
+
+
+def test_cache_key_follows_the_contents_and_settings(script, watch, cache):
+    add_file(watch, "a.mkv")
+    original = cache.key_for(script.TranscodeJob(watch, "a.mkv", 1))
+
+    add_file(watch, "a.mkv", 2048)
+    changed = cache.key_for(script.TranscodeJob(watch, "a.mkv", 1))
+    assert changed != original
+
+    watch.outputs = script.build_outputs([], ["plexhd"], "mkv")
+    assert cache.key_for(script.TranscodeJob(watch, "a.mkv", 1)) != changed
+
+
+def test_cached_transcodes_are_reused(script, watch, cache):
+    dest_file = os.path.join(watch.dest_dir, "a.mov")
+    with open(dest_file, "wb") as transcode:
+        transcode.write(b"transcoded")
+    cache.store("key", [dest_file])
+    os.remove(dest_file)
+
+    assert cache.fetch("key", [dest_file])
+    with open(dest_file, "rb") as transcode:
+        assert transcode.read() == b"transcoded"
+    assert not cache.fetch("other", [dest_file])
+
+
+def test_clone_falls_back_to_a_copy(script, tmp_path):
+    def no_reflinks(*args):
+        raise OSError("Operation not supported")
+
+    script.fcntl = type("fcntl", (), {"ioctl": staticmethod(no_reflinks)})
+    source = tmp_path / "source"
+    source.write_bytes(b"contents")
+
+    # An existing target is replaced, not written through - so a hard link to
+    # the source doesn't clobber it.
+    target = tmp_path / "target"
+    os.link(source, target)
+    script.clone_file(str(source), str(target))
+    target.write_bytes(b"changed")
+
+    assert source.read_bytes() == b"contents"
+    script.clone_file(str(source), str(target))
+    assert target.read_bytes() == b"contents"
@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from test_queue import add_file
+
+
+@pytest.fixture
+def claiming(script, watch):
+    script.claim_files = True
+    script.lease_time = 60
+    add_file(watch, "clip.mkv")
+    return watch
+
+
+def write_claim(script, watch, **claim):
+    path = script.claim_path(watch, "clip.mkv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as claim_file:
+        json.dump(dict({"token": "theirs"}, **claim), claim_file)
+
+
+def test_a_live_claim_keeps_other_instances_off(script, claiming):
+    ours = script.TranscodeJob(claiming, "clip.mkv", 1)
+    assert script.claim_source(ours)
+    assert script.source_is_claimed(claiming, "clip.mkv")
+    assert not script.claim_source(script.TranscodeJob(claiming, "clip.mkv", 2))
+
+    script.release_claim(ours)
+    assert os.listdir(os.path.join(claiming.source_dir, script.claim_dir_name)) == []
+    assert not script.source_is_claimed(claiming, "clip.mkv")
+
+
+def test_a_dead_local_claim_is_taken_over(script, claiming):
+    finished = subprocess.Popen([sys.executable, "-c", ""])
+    finished.wait()
+    write_claim(script, claiming, host=script.claim_host, pid=finished.pid)
+
+    job = script.TranscodeJob(claiming, "clip.mkv", 1)
+    assert script.claim_source(job)
+    with open(script.claim_path(claiming, "clip.mkv")) as claim_file:
+        assert json.load(claim_file)["token"] == job.claim["token"]
+
+
+def test_a_remote_claim_is_taken_over_once_it_stops_being_renewed(script, claiming):
+    script.lease_time = 0.5
+    write_claim(script, claiming, host="elsewhere", pid=1)
+
+    job = script.TranscodeJob(claiming, "clip.mkv", 1)
+    assert not script.claim_source(job)
+    time.sleep(0.6)
+    assert script.claim_source(job)
+
+
+def test_losing_a_claim_stops_the_job(script, claiming):
+    job = script.TranscodeJob(claiming, "clip.mkv", 1)
+    assert script.claim_source(job)
+    assert script.renew_claim(job)
+
+    write_claim(script, claiming, host="elsewhere", pid=1)
+    assert not script.renew_claim(job)
+    assert job.claim_lost
+    assert job.cancel.is_set()
+
+    # The other instance's claim is left alone.
+    script.release_claim(job)
+    assert os.path.isfile(script.claim_path(claiming, "clip.mkv"))
@@ -0,0 +1,148 @@
+import json
+import os
+import signal
+import socket
+import time
+
+import pytest
+
+from conftest import load_script, needs_root, run_script
+
+
+PRESETS = sorted(load_script().presets)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def stop(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except Exception:
+            process.kill()
+            process.wait()
+
+
+@pytest.fixture
+def farm(tmp_path, stub_tools):
+    """Start a coordinator (with no local workers) and remote workers on
+    localhost, all sharing one source and destination directory."""
+    source = tmp_path / "source"
+    dest = tmp_path / "dest"
+    source.mkdir()
+    dest.mkdir()
+    port = free_port()
+    processes = []
+
+    def common(name):
+        return ["-s", str(source), "-d", str(dest), "-ffmpeg", str(stub_tools),
+                "-jobdb", str(tmp_path / (name + ".db")),
+                "-telemetry", str(tmp_path / (name + ".jsonl"))]
+
+    def start_coordinator(*args):
+        output = open(tmp_path / "coordinator.txt", "w")
+        processes.append(run_script(common("coordinator") + ["-jobs", "0", "-lease", "4",
+                                    "-retrydelay", "1", "-coordinator",
+                                    "127.0.0.1:{}".format(port)] + list(args), output))
+        # Wait for it to start listening.
+        assert wait_for(lambda: socket.socket().connect_ex(("127.0.0.1", port)) == 0, 15)
+
+    def start_worker(name):
+        output = open(tmp_path / (name + ".txt"), "w")
+        processes.append(run_script(common(name) + ["-worker", "127.0.0.1:{}".format(port)],
+                                    output))
+
+    farm = type("Farm", (), {})()
+    farm.source = source
+    farm.dest = dest
+    farm.port = port
+    farm.log = lambda name="coordinator": (tmp_path / (name + ".txt")).read_text()
+    farm.start_coordinator = start_coordinator
+    farm.start_worker = start_worker
+    yield farm
+    stop(processes)
+
+
+def processed(source, names):
+    return all((source / (name + ".processed")).exists() for name in names)
+
+
+@needs_root
+@pytest.mark.parametrize("preset", PRESETS)
+def test_remote_workers_run_every_preset(farm, preset):
+    names = ["clip{}.mkv".format(index) for index in range(4)]
+    for name in names:
+        (farm.source / name).write_bytes(b"\0" * 1024)
+
+    farm.start_coordinator("-" + preset)
+    farm.start_worker("worker1")
+    farm.start_worker("worker2")
+
+    assert wait_for(lambda: processed(farm.source, names)), farm.log()
+    ext = load_script().presets[preset]["ext"]
+    for name in names:
+        assert (farm.dest / (os.path.splitext(name)[0] + "." + ext)).exists()
+    assert "over to remote worker" in farm.log()
+    assert "*** ERROR" not in farm.log()
+
+
+@needs_root
+def test_dropped_lease_is_retried_by_another_worker(farm):
+    (farm.source / "clip.mkv").write_bytes(b"\0" * 1024)
+    farm.start_coordinator("-youtube")
+
+    # Lease the job by hand, check the protocol's answers, then vanish.
+    with socket.create_connection(("127.0.0.1", farm.port)) as link:
+        stream = link.makefile("rw")
+
+        def request(message):
+            stream.write(json.dumps(message) + "\n")
+            stream.flush()
+            return json.loads(stream.readline())
+
+        deadline = time.monotonic() + 15
+        lease = request({"op": "lease", "host": "test"})
+        while lease["op"] != "job" and time.monotonic() < deadline:
+            lease = request({"op": "lease", "host": "test"})
+        assert lease["op"] == "job"
+        assert lease["file"] == "clip.mkv"
+        assert lease["presets"] == ["youtube"]
+
+        assert request({"op": "heartbeat", "lease": lease["lease"]}) == {"op": "ok"}
+        assert request({"op": "heartbeat", "lease": -1}) == {"op": "lost"}
+        assert request({"op": "bogus"})["op"] == "error"
+
+    # Dropping the connection gives the job up, and it's retried.
+    assert wait_for(lambda: "stopped checking in" in farm.log(), 10), farm.log()
+    farm.start_worker("worker1")
+    assert wait_for(lambda: processed(farm.source, ["clip.mkv"])), farm.log()
+
+
+@needs_root
+def test_remote_failure_is_handled_by_the_coordinator(farm, stub_tools):
+    (farm.source / "broken.mkv").write_bytes(b"\0" * 1024)
+    with open(stub_tools / "ffmpeg", "w") as stub:
+        stub.write("#!/bin/sh\necho 'Invalid data found when processing input' >&2\nexit 1\n")
+
+    farm.start_coordinator("-youtube")
+    farm.start_worker("worker1")
+
+    assert wait_for(lambda: "giving up on it" in farm.log()), farm.log()
+    assert "failed" in farm.log("worker1") or "exited with code 1" in farm.log()
+    assert (farm.source / "broken.mkv").exists()
@@ -0,0 +1,39 @@
+import datetime
+import re
+
+import pytest
+
+
+def visible(line):
+    return len(re.sub(r"\033\[[0-9;?]*[a-zA-Z]", "", line))
+
+
+@pytest.fixture
+def job(script):
+    job = script.TranscodeJob(None, "a fairly long source file name, for good measure.mov", 1)
+    job.prog_pct = 55
+    job.start_time = datetime.datetime.now() - datetime.timedelta(seconds=30)
+    job.progress = script.FfmpegProgress({"fps": "59.9", "speed": "1.5x",
+                                          "total_size": "12345678"})
+    return job
+
+
+@pytest.mark.parametrize("width", [200, 119, 79, 59, 39, 20])
+def test_progress_line_fits_the_terminal(script, job, width):
+    assert visible(script.progress_bar(job, width)) <= width
+
+
+def test_narrow_terminal_drops_columns_before_the_eta(script, job):
+    wide = script.progress_bar(job, 200)
+    narrow = script.progress_bar(job, 59)
+    assert "MB" in wide and "fps" in wide
+    assert "MB" not in narrow and "fps" not in narrow
+    assert "ETA" in narrow and "55.00%" in narrow
+
+
+def test_fit_line_skips_color_codes(script):
+    line = "ab\033[42mcdef\033[0mgh"
+    assert script.fit_line(line, 20) == line
+    cut = script.fit_line(line, 4)
+    assert visible(cut) == 4
+    assert cut.endswith("\033[0m")
@@ -0,0 +1,70 @@
+import os
+import queue
+
+import pytest
+
+from test_queue import add_file
+
+
+@pytest.fixture
+def failed_job(script, watch, job_store, tmp_path):
+    """A job for a source whose transcode has just failed, leaving a partial
+    output behind."""
+    script.telemetry_file = str(tmp_path / "telemetry.jsonl")
+    script.quarantine_dir = str(tmp_path / "quarantine")
+    script.retry_delay = 0
+    add_file(watch, "clip.mkv")
+
+    job = script.TranscodeJob(watch, "clip.mkv", job_store.add(
+        os.path.join(watch.source_dir, "clip.mkv"), 1, 1024, watch.preset_name))
+    job.attempts = 1
+    job.dest_files = [os.path.join(watch.dest_dir, "clip.mov")]
+    with open(job.dest_files[0], "w") as partial:
+        partial.write("partial")
+    job.error_tail.append("Connection timed out")
+    return job
+
+
+def job_state(job_store, job):
+    return job_store.db.execute("SELECT state FROM jobs WHERE id = ?", (job.job_id,)).fetchone()[0]
+
+
+def test_transient_failures_are_retried(script, failed_job, job_store):
+    assert script.fail_job(failed_job, "ffmpeg exited with code 1", True)
+
+    assert not os.path.exists(failed_job.dest_files[0])
+    assert job_state(job_store, failed_job) == 'queued'
+    (_, _, retried) = script.job_queue.get(timeout=5)
+    assert retried is failed_job
+    assert os.path.isfile(os.path.join(failed_job.watch.source_dir, "clip.mkv"))
+
+
+def test_permanent_failures_are_quarantined(script, failed_job, job_store):
+    assert not script.fail_job(failed_job, "invalid data", False)
+
+    assert not os.path.exists(failed_job.dest_files[0])
+    assert job_state(job_store, failed_job) == 'failed'
+    assert not os.path.exists(os.path.join(failed_job.watch.source_dir, "clip.mkv"))
+    assert os.path.isfile(os.path.join(script.quarantine_dir, "clip.mkv"))
+    with open(os.path.join(script.quarantine_dir, "clip.mkv.error.txt")) as error_file:
+        notes = error_file.read()
+    assert "Reason: invalid data" in notes
+    assert "Connection timed out" in notes
+    with pytest.raises(queue.Empty):
+        script.job_queue.get_nowait()
+
+
+def test_transient_failures_give_up_after_the_last_retry(script, failed_job, job_store):
+    failed_job.attempts = script.job_retries + 1
+    assert not script.fail_job(failed_job, "ffmpeg exited with code 1", True)
+
+    assert job_state(job_store, failed_job) == 'failed'
+    assert os.path.isfile(os.path.join(script.quarantine_dir, "clip.mkv"))
+
+
+def test_without_a_quarantine_directory_the_source_is_skipped(script, failed_job):
+    script.quarantine_dir = ''
+    assert not script.fail_job(failed_job, "invalid data", False)
+
+    assert os.path.isfile(os.path.join(failed_job.watch.source_dir, "clip.mkv"))
+    assert "clip.mkv" in failed_job.watch.failed_files
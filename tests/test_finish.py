@@ -0,0 +1,76 @@
+import datetime
+import json
+import os
+import time
+
+import pytest
+
+from test_queue import add_file
+
+
+@pytest.fixture
+def transcoded_job(script, watch, job_store, tmp_path):
+    """A job whose ffmpeg has just finished, two seconds after it started."""
+    script.telemetry_file = str(tmp_path / "telemetry.jsonl")
+    add_file(watch, "clip.mkv")
+
+    job = script.TranscodeJob(watch, "clip.mkv", job_store.add(
+        os.path.join(watch.source_dir, "clip.mkv"), 1, 1024, watch.preset_name))
+    job.attempts = 1
+    job.dest_files = [os.path.join(watch.dest_dir, "clip.mov")]
+    with open(job.dest_files[0], "wb") as transcode:
+        transcode.write(b"\0" * 512)
+    job.start_time = datetime.datetime.now() - datetime.timedelta(seconds=2)
+    script.encode_succeeded(job)
+    return job
+
+
+def telemetry(script):
+    with open(script.telemetry_file) as telemetry_log:
+        return [json.loads(line) for line in telemetry_log]
+
+
+def test_encode_time_leaves_out_verification(script, transcoded_job):
+    def slow_verify(job):
+        time.sleep(1)
+        return None
+
+    script.verify_job = slow_verify
+    script.finish_job(transcoded_job)
+
+    (record,) = telemetry(script)
+    assert record["outcome"] == 'done'
+    assert 2 <= record["encode_time"] < 2.9
+
+
+def counted(script, name):
+    return sum(value for ((metric, _), value) in script.metrics.values.items() if metric == name)
+
+
+def test_jobs_that_fail_verification_are_not_counted_as_completed(script, transcoded_job):
+    script.retry_delay = 3600
+    script.verify_job = lambda job: "clip.mov isn't a readable media file"
+    script.finish_job(transcoded_job)
+
+    assert counted(script, "autotranscode_jobs_completed_total") == 0
+    assert counted(script, "autotranscode_bytes_out_total") == 0
+
+
+def test_finalized_jobs_are_counted_as_completed(script, transcoded_job):
+    script.verify_job = lambda job: None
+    script.finish_job(transcoded_job)
+
+    assert counted(script, "autotranscode_jobs_completed_total") == 1
+    assert counted(script, "autotranscode_bytes_in_total") == 1024
+    assert counted(script, "autotranscode_bytes_out_total") == 512
+
+
+def test_a_job_that_fails_to_finalize_gets_one_telemetry_record(script, transcoded_job):
+    def broken_finalize(job):
+        raise PermissionError(13, "Permission denied")
+
+    script.verify_job = lambda job: None
+    script.finalize_source = broken_finalize
+    script.finish_job(transcoded_job)
+
+    assert [record["outcome"] for record in telemetry(script)] == ['failed']
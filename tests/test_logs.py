@@ -0,0 +1,26 @@
+import os
+
+
+def make_log(log_dir, name, age):
+    log_path = os.path.join(log_dir, name)
+    with open(log_path, "w") as log_file:
+        log_file.write("frame=1\n")
+    modified = os.path.getmtime(log_path) - age
+    os.utime(log_path, (modified, modified))
+
+
+def test_logs_of_running_jobs_are_kept(script, watch, tmp_path):
+    script.ffmpeg_log_dir = str(tmp_path / "logs")
+    os.mkdir(script.ffmpeg_log_dir)
+    script.ffmpeg_log_keep = 1
+
+    running = script.TranscodeJob(watch, "running.mkv", 1)
+    script.running_jobs.append(running)
+    make_log(script.ffmpeg_log_dir, script.ffmpeg_log_name(running), 120)
+    make_log(script.ffmpeg_log_dir, "finished.mkv.2.log", 60)
+
+    new = script.TranscodeJob(watch, "new.mkv", 3)
+    script.running_jobs.append(new)
+    script.open_ffmpeg_log(new).close()
+
+    assert sorted(os.listdir(script.ffmpeg_log_dir)) == ["new.mkv.3.log", "running.mkv.1.log"]
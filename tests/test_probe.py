@@ -0,0 +1,49 @@
+import json
+import os
+
+from test_queue import add_file
+
+
+PROBE = json.dumps({"format": {"format_name": "matroska,webm", "duration": "60.0"},
+                    "streams": [{"codec_type": "video", "codec_name": "h264"}]})
+
+
+def probe_rows(job_store):
+    return [row["path"] for row in job_store.db.execute("SELECT path FROM probes")]
+
+
+def test_failed_probes_are_tried_again(script, watch, job_store):
+    script.probe_available = True
+    add_file(watch, "clip.mkv")
+
+    script.run_ffprobe = lambda file_path: ''
+    assert script.probe_file(watch, "clip.mkv") is None
+    assert probe_rows(job_store) == []
+
+    script.run_ffprobe = lambda file_path: PROBE
+    assert script.probe_file(watch, "clip.mkv").duration == 60000
+
+    # A good result is kept, though.
+    script.run_ffprobe = lambda file_path: ''
+    assert script.probe_file(watch, "clip.mkv").duration == 60000
+
+
+def test_probes_are_forgotten_once_the_source_is_finalized(script, watch, job_store):
+    script.probe_available = True
+    script.run_ffprobe = lambda file_path: PROBE
+    add_file(watch, "clip.mkv")
+    script.probe_file(watch, "clip.mkv")
+
+    script.finalize_source(script.TranscodeJob(watch, "clip.mkv", 1))
+    assert probe_rows(job_store) == []
+
+
+def test_probes_of_missing_files_are_pruned(script, watch, job_store):
+    add_file(watch, "kept.mkv")
+    kept = os.path.join(watch.source_dir, "kept.mkv")
+    gone = os.path.join(watch.source_dir, "gone.mkv")
+    for file_path in (kept, gone):
+        job_store.add_probe(file_path, 1, 1024, 0, PROBE)
+
+    job_store.prune_probes()
+    assert probe_rows(job_store) == [kept]
@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+
+import pytest
+
+
+def test_progress_report_is_parsed(script):
+    progress = script.FfmpegProgress({
+        "frame": "250", "fps": "49.8", "bitrate": "1843.2kbits/s",
+        "total_size": "2359296", "out_time_us": "10000000", "out_time_ms": "10000000",
+        "out_time": "00:00:10.000000", "speed": "1.99x", "progress": "continue"})
+
+    assert progress.frame == 250
+    assert progress.fps == 49.8
+    assert progress.bitrate == 1843.2
+    assert progress.total_size == 2359296
+    assert progress.out_time == 10000
+    assert progress.speed == 1.99
+    assert not progress.finished
+
+
+def test_unknown_fields_are_none(script):
+    progress = script.FfmpegProgress({
+        "frame": "0", "fps": "0.00", "bitrate": "N/A", "total_size": "N/A",
+        "out_time_us": "N/A", "out_time": "N/A", "speed": "N/A", "progress": "end"})
+
+    assert progress.frame == 0
+    assert progress.bitrate is None
+    assert progress.total_size is None
+    assert progress.out_time is None
+    assert progress.speed is None
+    assert progress.finished
+
+
+def test_out_time_falls_back_to_the_timestamp(script):
+    progress = script.FfmpegProgress({"out_time": "00:01:02.500000", "progress": "continue"})
+    assert progress.out_time == 62500
+    assert progress.frame is None
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="needs a shell script stub")
+def test_a_stuck_ffmpeg_can_still_be_stopped(script, tmp_path):
+    # One progress report, then nothing, as if it's hung on a read.
+    stub = tmp_path / "ffmpeg"
+    stub.write_text("#!/bin/sh\necho frame=1\necho progress=continue\nexec sleep 60\n")
+    stub.chmod(0o755)
+
+    reports = []
+    cancel = threading.Event()
+    threading.Timer(0.5, cancel.set).start()
+    started = time.monotonic()
+    returncode = script.run_ffmpeg([str(stub)], None, "", lambda total_dur: None,
+                                   reports.append, cancel=cancel)
+
+    assert returncode != 0
+    assert time.monotonic() - started < 10
+    assert [report.frame for report in reports] == [1]
@@ -0,0 +1,109 @@
+import os
+
+
+def add_file(watch, name, size=1024):
+    with open(os.path.join(watch.source_dir, name), "wb") as source:
+        source.write(b"\0" * size)
+
+
+def queued_files(script):
+    files = []
+    while not script.job_queue.empty():
+        files.append(script.job_queue.get_nowait()[2].file)
+    return files
+
+
+def test_files_that_vanish_before_queueing_are_skipped(script, watch, job_store):
+    add_file(watch, "kept.mkv")
+    watch.candidates.append("gone.mkv")
+    entries = [(watch, "gone.mkv"), (watch, "kept.mkv")]
+
+    script.queue_files(entries, {entry: None for entry in entries})
+
+    assert queued_files(script) == ["kept.mkv"]
+    assert watch.active_files == {"kept.mkv"}
+    assert "gone.mkv" not in watch.candidates
+
+
+def test_ready_wait_is_recorded_as_a_phase(script, watch, job_store):
+    add_file(watch, "clip.mkv")
+    watch.candidate_found["clip.mkv"] = script.time.monotonic() - 5
+
+    script.queue_files([(watch, "clip.mkv")], {(watch, "clip.mkv"): None})
+
+    rendered = script.metrics.render()
+    assert 'autotranscode_phase_duration_seconds_count{phase="ready"} 1' in rendered
+
+
+def make_job(script, watch, name, duration=None):
+    job = script.TranscodeJob(watch, name, 1)
+    job.total_dur = duration
+    return job
+
+
+def test_shortest_order_puts_short_files_first(script, watch):
+    script.queue_order = 'shortest'
+    short = script.queue_key(make_job(script, watch, "short.mkv", 10000), 0)
+    long = script.queue_key(make_job(script, watch, "long.mkv", 3600000), 0)
+    assert short < long
+
+
+def test_unprobed_files_age_past_a_stream_of_probed_ones(script, watch):
+    script.queue_order = 'shortest'
+    script.probed_durations.extend((60, 120, 180))
+
+    # Guessed at the median (120s), so it's behind a 60s file that showed up
+    # at the same time, but ahead of one that turned up long after.
+    unknown = script.queue_key(make_job(script, watch, "unknown.mkv"), 0)
+    assert unknown > script.queue_key(make_job(script, watch, "a.mkv", 60000), 0)
+    assert unknown < script.queue_key(make_job(script, watch, "b.mkv", 1000), 600)
+
+
+def test_each_probed_duration_is_sampled_once(script, watch, job_store):
+    script.queue_order = 'shortest'
+    add_file(watch, "clip.mkv")
+    script.probe_file = lambda watch, file: script.MediaInfo({"format": {"duration": "90"}})
+
+    script.probe_and_queue([(watch, "clip.mkv")])
+    (_, _, job) = script.job_queue.get_nowait()
+    script.requeue_job(job)
+    script.requeue_job(job)
+
+    assert list(script.probed_durations) == [90]
+
+
+def test_priority_tags_come_before_everything_else(script, watch):
+    for order in ("fifo", "smallest", "shortest"):
+        script.queue_order = order
+        add_file(watch, "big [p1].mkv", 10 * 1048576)
+        add_file(watch, "small.mkv")
+        tagged = script.queue_key(make_job(script, watch, "big [p1].mkv", 3600000), 1000)
+        untagged = script.queue_key(make_job(script, watch, "small.mkv", 1000), 0)
+        assert tagged < untagged
+
+
+def test_smallest_order_with_aging(script, watch):
+    script.queue_order = 'smallest'
+    add_file(watch, "big.mkv", 100 * 1048576)
+    add_file(watch, "small.mkv", 1048576)
+    big = script.queue_key(make_job(script, watch, "big.mkv"), 0)
+    assert script.queue_key(make_job(script, watch, "small.mkv"), 50) < big
+    assert script.queue_key(make_job(script, watch, "small.mkv"), 150) > big
+
+    script.queue_aging = 0
+    big = script.queue_key(make_job(script, watch, "big.mkv"), 0)
+    assert script.queue_key(make_job(script, watch, "small.mkv"), 150) < big
+
+
+def test_fifo_order_goes_by_arrival(script, watch):
+    script.queue_order = 'fifo'
+    first = script.queue_key(make_job(script, watch, "long.mkv", 3600000), 0)
+    second = script.queue_key(make_job(script, watch, "short.mkv", 1000), 1)
+    assert first < second
+
+
+def test_smallest_order_copes_with_a_vanished_file(script, watch):
+    script.queue_order = 'smallest'
+    add_file(watch, "big.mkv", 100 * 1048576)
+    assert script.queue_key(make_job(script, watch, "gone.mkv"), 0) < \
+        script.queue_key(make_job(script, watch, "big.mkv"), 0)
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+
+def test_resumed_segments_count_fully_towards_progress(script, watch):
+    job = script.TranscodeJob(watch, "long.mkv", 1)
+    job.total_dur = 30000
+    job.dest_files = [os.path.join(watch.dest_dir, "long.mov")]
+    segments = [(0.0, 10.0), (10.0, 10.0), (20.0, None)]
+
+    # Every segment finished in an earlier attempt, so only the joins run.
+    work_dir = os.path.join(watch.dest_dir, ".segments", "long")
+    os.makedirs(work_dir)
+    for index in range(len(segments)):
+        open(os.path.join(work_dir, "seg{:05d}.done".format(index)), "w").close()
+    joins = []
+    script.run_ffmpeg = lambda cmdline, *args: joins.append(cmdline) or 0
+
+    assert script.transcode_segments(job, segments, None, "") == 0
+    assert len(joins) == len(watch.outputs)
+    assert job.prog_pct == 100
+
+
+def keyframe_probe(script, tmp_path, keyframes, start_time=0.0):
+    """Point the script at a stub ffprobe that lists a keyframe at each of the
+    given times (plus an ordinary frame after each one)."""
+    packets = "".join("{:.6f},K__\n{:.6f},___\n".format(time + start_time, time + start_time + 1)
+                      for time in keyframes)
+    stub = tmp_path / "ffprobe"
+    stub.write_text("#!/bin/sh\ncat <<'END'\n" + packets + "END\n")
+    stub.chmod(0o755)
+    script.ffprobe_location = str(stub)
+
+
+def probed_job(script, watch, duration, start_time=0.0):
+    job = script.TranscodeJob(watch, "long.mkv", 1)
+    job.media = script.MediaInfo({"format": {"duration": str(duration),
+                                             "start_time": str(start_time)}})
+    return job
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="needs a shell script stub")
+def test_segments_start_on_keyframes(script, watch, tmp_path):
+    script.segment_length = 10
+    keyframe_probe(script, tmp_path, range(0, 60, 3), start_time=1.5)
+
+    # Cuts go at the first keyframe a segment length after the last, but not
+    # within half a segment of the end.
+    assert script.plan_segments(probed_job(script, watch, 60, start_time=1.5)) == [
+        (0.0, 12.0), (12.0, 12.0), (24.0, 12.0), (36.0, 12.0), (48.0, None)]
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="needs a shell script stub")
+def test_short_or_unprobed_sources_are_not_split(script, watch, tmp_path):
+    script.segment_length = 10
+    keyframe_probe(script, tmp_path, range(0, 60, 2))
+
+    assert script.plan_segments(probed_job(script, watch, 15)) is None
+    assert script.plan_segments(script.TranscodeJob(watch, "long.mkv", 1)) is None
+
+    # No keyframes far enough apart to cut at.
+    keyframe_probe(script, tmp_path, [0])
+    assert script.plan_segments(probed_job(script, watch, 60)) is None
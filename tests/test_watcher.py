@@ -0,0 +1,82 @@
+import os
+import threading
+
+import pytest
+
+from conftest import needs_root, run_script
+
+
+def test_poll_watcher_survives_a_missing_source_directory(script, watch):
+    script.loop_delay = 0.2
+    os.rmdir(watch.source_dir)
+
+    watcher = threading.Thread(target=script.poll_watcher, daemon=True)
+    watcher.start()
+    watcher.join(1)
+    assert watcher.is_alive()
+
+    # Once it's back, files in it are reported.
+    os.mkdir(watch.source_dir)
+    with open(os.path.join(watch.source_dir, "clip.mkv"), "wb") as clip:
+        clip.write(b"\0")
+    assert script.watch_events.get(timeout=5) == (watch, "clip.mkv")
+
+
+def test_a_dead_watcher_hands_its_error_to_the_main_loop(script):
+    def broken_watcher():
+        raise OSError("inotify went away")
+
+    script.run_watcher(broken_watcher)
+    error = script.watch_events.get_nowait()
+    assert isinstance(error, OSError)
+
+
+def test_concurrent_recursive_scans_agree(script, watch):
+    script.recursive = True
+    for index in range(20):
+        subdir = os.path.join(watch.source_dir, "dir{}".format(index), "deeper")
+        os.makedirs(subdir)
+        with open(os.path.join(subdir, "clip.mkv"), "wb") as clip:
+            clip.write(b"\0")
+    expected = sorted(os.path.join("dir{}".format(index), "deeper", "clip.mkv")
+                      for index in range(20))
+
+    # Full scans and subdirectory rescans (like the inotify watcher's) at once.
+    results = []
+    errors = []
+
+    def scan(top):
+        try:
+            for _ in range(30):
+                results.append((top, sorted(script.scan_source_dir(watch, top))))
+        except Exception as error:
+            errors.append(error)
+
+    scanners = [threading.Thread(target=scan, args=(top,))
+                for top in ("", "", "dir3", "dir7")]
+    for scanner in scanners:
+        scanner.start()
+    for scanner in scanners:
+        scanner.join()
+
+    assert errors == []
+    for (top, files) in results:
+        assert files == [file for file in expected if file.startswith(top)]
+    assert sorted(script.scan_source_dir(watch)) == expected
+
+
+@needs_root
+@pytest.mark.parametrize("missing", ["source", "destination", "finished"])
+def test_missing_watch_folder_directories_are_reported(tmp_path, missing):
+    for directory in ("source", "destination", "finished"):
+        if directory != missing:
+            (tmp_path / directory).mkdir()
+    config_file = tmp_path / "config.ini"
+    config_file.write_text("[watch:shows]\nsource = {0}/source\ndestination = {0}/destination\n"
+                           "finished = {0}/finished\npresets = youtube\n".format(tmp_path))
+
+    with open(tmp_path / "output.txt", "w") as output:
+        run_script(["-conf", str(config_file), "-jobdb", str(tmp_path / "jobs.db")],
+                   output).wait(timeout=30)
+
+    assert "directory for watch folder 'shows' doesn't exist" in (tmp_path / "output.txt").read_text()